@@ -1,11 +1,43 @@
-from flask import Flask, render_template, request, jsonify
-import numpy as np
-from datetime import datetime
-import pandas as pd
+import os
+
+from flask import Flask, Response, render_template, request, jsonify
+import cache
 import extract as ex
+import http_cache as hc
+import matrix as mx
+import metrics as mt
+import poisson
 import predict as pr
+import preload
+import refresh as rf
+import service as sv
+import simulate as sim
+import singleflight as sf
+import store
 
 app = Flask(__name__)
+# 'sync' scores on the request thread, 'async' goes through service.py
+app.config['SERVING_MODE'] = os.environ.get('SERVING_MODE', 'sync')
+
+SERVER_BUSY_ERROR = "Too many requests right now, please try again shortly!"
+TIMEOUT_ERROR = "The prediction took too long, please try again shortly!"
+UNKNOWN_ENGINE_ERROR = "Unknown engine!"
+UNKNOWN_LEAGUE_ERROR = "Unknown league!"
+INVALID_SEASONS_ERROR = f"seasons must be a number from 1 to {sim.MAX_SEASONS}!"
+SIMULATION_ERROR = "Could not simulate the season, please try again later!"
+
+# Keep the current season csv files and the prediction matrices up to date off the request path
+rf.add_listener(mx.on_refresh)
+rf.add_listener(poisson.on_refresh)
+rf.add_listener(hc.on_refresh)
+# A preloading gunicorn master starts the refresher in its workers (gunicorn.conf.py)
+if not preload.ENABLED:
+    rf.start_refresher()
+
+@app.after_request
+def count_request(response):
+    mt.count('requests_total', endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
 
 @app.route('/')
 def home():
@@ -18,23 +50,191 @@ def get_teams():
     teams = ex.get_teams(league)
     return {"teams": teams}
 
+# Cacheable variant, e.g. /get_teams?league=Serie%20A
+@app.route("/get_teams", methods=["GET"])
+def get_teams_cached():
+    league = request.args.get("league")
+    if league not in ex.get_leagues():
+        return jsonify({"error": UNKNOWN_LEAGUE_ERROR}), 400
+
+    version, bodies = hc.teams_bodies(league)
+    response = hc.not_modified(request, version)
+    if response is not None:
+        return response
+    return hc.respond(request, version, bodies)
+
+def _predict(league, home_team, away_team, engine, windows):
+    if app.config['SERVING_MODE'] == 'async':
+        return sv.get_stats(league, home_team, away_team, engine, windows)
+    return pr.get_stats(league, home_team, away_team, engine, windows)
+
 @app.route('/get_stats', methods=['POST'])
 def get_stats():
     data = request.get_json()
     league = data.get('league')
     home_team = data.get('home_team')
     away_team = data.get('away_team')
+    engine = data.get('engine', 'form')
 
+    if engine not in pr.ENGINES:
+        return jsonify({"error": UNKNOWN_ENGINE_ERROR}), 400
+    try:
+        windows = pr.parse_windows(data, engine)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     if home_team == away_team:
         if home_team == "Man United":
             return jsonify({"error": "GLORY GLORY MAN UNITED!"})
-        return jsonify({"error": "Home and Away teams must be different!"})
+        return jsonify({"error": pr.SAME_TEAMS_ERROR})
 
     try:
-        stats = pr.get_stats(league, home_team, away_team)
+        stats = _predict(league, home_team, away_team, engine, windows)
         return jsonify({"stats": stats})
+    except sv.Saturated:
+        return jsonify({"error": SERVER_BUSY_ERROR}), 503
+    except sv.TimedOut:
+        return jsonify({"error": TIMEOUT_ERROR}), 504
     except Exception as e:
-        return jsonify({"error": "Not enough data to make a prediction for recently promoted team(s)!"})
+        mt.count('errors_total', type=type(e).__name__)
+        return jsonify({"error": pr.NOT_ENOUGH_DATA_ERROR})
+
+# Cacheable variant, e.g. /get_stats?league=Serie%20A&home_team=Inter&away_team=Milan&engine=poisson.
+# The ETag changes with the league data, so a revalidation is answered without scoring.
+@app.route('/get_stats', methods=['GET'])
+def get_stats_cached():
+    data = request.args
+    league = data.get('league')
+    home_team = data.get('home_team')
+    away_team = data.get('away_team')
+    engine = data.get('engine', 'form')
+
+    if league not in ex.get_leagues():
+        return jsonify({"error": UNKNOWN_LEAGUE_ERROR}), 400
+    if engine not in pr.ENGINES:
+        return jsonify({"error": UNKNOWN_ENGINE_ERROR}), 400
+    try:
+        windows = pr.parse_windows(data, engine)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if home_team == away_team:
+        if home_team == "Man United":
+            return jsonify({"error": "GLORY GLORY MAN UNITED!"})
+        return jsonify({"error": pr.SAME_TEAMS_ERROR})
+
+    try:
+        version = pr.fixture_version(store.get_league(league), engine, windows, (home_team, away_team))
+    except Exception as e:
+        mt.count('errors_total', type=type(e).__name__)
+        return jsonify({"error": pr.NOT_ENOUGH_DATA_ERROR})
+    response = hc.not_modified(request, version)
+    if response is not None:
+        return response
+    try:
+        bodies = hc.stats_bodies((league, home_team, away_team, version),
+                                 lambda: {"stats": _predict(league, home_team, away_team, engine, windows)})
+    except sv.Saturated:
+        return jsonify({"error": SERVER_BUSY_ERROR}), 503
+    except sv.TimedOut:
+        return jsonify({"error": TIMEOUT_ERROR}), 504
+    except Exception as e:
+        mt.count('errors_total', type=type(e).__name__)
+        return jsonify({"error": pr.NOT_ENOUGH_DATA_ERROR})
+    return hc.respond(request, version, bodies)
+
+@app.route('/get_stats/batch', methods=['POST'])
+def get_stats_batch():
+    data = request.get_json()
+    league = data.get('league')
+    fixtures = data.get('fixtures') or []
+    engine = data.get('engine', 'form')
+
+    if league not in ex.get_leagues():
+        return jsonify({"error": UNKNOWN_LEAGUE_ERROR}), 400
+    if engine not in pr.ENGINES:
+        return jsonify({"error": UNKNOWN_ENGINE_ERROR}), 400
+    try:
+        windows = pr.parse_windows(data, engine)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        pairs = [(fixture['home_team'], fixture['away_team']) for fixture in fixtures]
+    except (KeyError, TypeError):
+        return jsonify({"error": "Each fixture needs a home_team and an away_team!"}), 400
+
+    try:
+        if app.config['SERVING_MODE'] == 'async':
+            results = sv.get_stats_batch(league, pairs, engine, windows)
+        else:
+            results = pr.get_stats_batch(league, pairs, engine, windows)
+    except sv.Saturated:
+        return jsonify({"error": SERVER_BUSY_ERROR}), 503
+    except sv.TimedOut:
+        return jsonify({"error": TIMEOUT_ERROR}), 504
+    except Exception as e:
+        mt.count('errors_total', type=type(e).__name__)
+        return jsonify({"error": pr.NOT_ENOUGH_DATA_ERROR})
+    return jsonify({"results": results})
+
+# Title, top 4, relegation and final position probabilities of the current season,
+# e.g. /simulate_season?league=Serie%20A&seasons=100000
+@app.route('/simulate_season', methods=['GET'])
+def simulate_season():
+    league = request.args.get('league')
+    engine = request.args.get('engine', 'form')
+
+    if league not in ex.get_leagues():
+        return jsonify({"error": UNKNOWN_LEAGUE_ERROR}), 400
+    if engine not in pr.ENGINES:
+        return jsonify({"error": UNKNOWN_ENGINE_ERROR}), 400
+    try:
+        seasons = int(request.args.get('seasons', sim.SEASONS))
+    except ValueError:
+        return jsonify({"error": INVALID_SEASONS_ERROR}), 400
+    if not 1 <= seasons <= sim.MAX_SEASONS:
+        return jsonify({"error": INVALID_SEASONS_ERROR}), 400
+
+    # Simulations are seeded from the data version, so the ETag identifies the body
+    try:
+        version = f"{pr.fixture_version(store.get_league(league), engine, teams=store.league_teams(league))}-s{seasons}"
+    except Exception as e:
+        mt.count('errors_total', type=type(e).__name__)
+        return jsonify({"error": SIMULATION_ERROR})
+    response = hc.not_modified(request, version)
+    if response is not None:
+        return response
+    # Simulations are scored like predictions, on the bounded pool in async mode
+    if app.config['SERVING_MODE'] == 'async':
+        simulate_league = sv.simulate_league
+    else:
+        simulate_league = sim.simulate_league
+    try:
+        bodies = hc.stats_bodies((league, 'simulate_season', engine, version),
+                                 lambda: {"simulation": simulate_league(league, seasons, engine)})
+    except sv.Saturated:
+        return jsonify({"error": SERVER_BUSY_ERROR}), 503
+    except sv.TimedOut:
+        return jsonify({"error": TIMEOUT_ERROR}), 504
+    except Exception as e:
+        mt.count('errors_total', type=type(e).__name__)
+        return jsonify({"error": SIMULATION_ERROR})
+    return hc.respond(request, version, bodies)
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(dict(cache.stats(), singleflight=sf.stats()))
+
+@app.route('/metrics')
+def metrics():
+    cache_stats = cache.stats()
+    singleflight_stats = sf.stats()
+    gauges = [
+        ('prediction_cache_hits_total', 'counter', 'Prediction cache hits.', cache_stats['hits']),
+        ('prediction_cache_misses_total', 'counter', 'Prediction cache misses.', cache_stats['misses']),
+        ('prediction_cache_hit_rate', 'gauge', 'Share of prediction cache lookups that hit.', cache_stats['hit_rate']),
+        ('prediction_cache_entries', 'gauge', 'Predictions held in memory.', cache_stats['entries']),
+        ('singleflight_coalesced_total', 'counter', 'Predictions that waited for an identical one in flight.', singleflight_stats['coalesced']),
+    ]
+    return Response(mt.render(gauges), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)
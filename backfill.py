@@ -0,0 +1,245 @@
+"""
+Backfill the historic file of every league with the past seasons of its feed.
+
+Every season from FIRST_SEASON up to the one before the current one is downloaded
+from football-data.co.uk (or FOOTBALL_DATA_URL, e.g. a local `python -m http.server`
+serving <season>/<code>.csv files) over one pooled session, a few files at a time,
+with retries on connection errors and 5xx/429 answers:
+
+    python backfill.py
+    python backfill.py --league 'Serie A' --first-season 2010 --workers 8
+
+Raw files are kept under resources/seasons/<code>/<season>.csv and progress in
+resources/.backfill.json, so an interrupted run picks up where it stopped. The
+seasons are then normalized (column names, team names, dates) into the league's
+historic csv, which the store reads like any other change of its files.
+"""
+import argparse
+import fcntl
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import extract as ex
+import metrics as mt
+import refresh as rf
+import registry
+import store
+
+# Start year of the first season; earlier seasons have no shots, corners or cards
+FIRST_SEASON = int(os.environ.get('BACKFILL_FIRST_SEASON', 2000))
+# Downloads in flight at once, also the size of the session's connection pool
+WORKERS = int(os.environ.get('BACKFILL_WORKERS', 4))
+RETRIES = 3
+# Retries wait 0.5s, 1s, 2s, ... or what a Retry-After header asks for
+BACKOFF = 0.5
+SEASONS_DIR = 'seasons'
+PROGRESS_FILE = '.backfill.json'
+# Column names of older feeds
+COLUMN_NAMES = {'HT': 'HomeTeam', 'AT': 'AwayTeam'}
+# Columns of a new historic file, those the store reads (`Div` through `AR`)
+COLUMNS = ['Div', 'Date', 'Time', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR', 'HTHG', 'HTAG', 'HTR', 'Referee',
+           'HS', 'AS', 'HST', 'AST', 'HF', 'AF', 'HC', 'AC', 'HY', 'AY', 'HR', 'AR']
+
+_progress_lock = threading.Lock()
+
+
+# Season codes from `first` (start year) up to the one before the current season
+def past_seasons(first=FIRST_SEASON, date=None):
+    return [rf.season_code(year) for year in range(first, rf.season_year(date))]
+
+
+def season_path(code, season):
+    return os.path.join(ex.resources_dir, SEASONS_DIR, code, f'{season}.csv')
+
+
+def _progress_path():
+    return os.path.join(ex.resources_dir, PROGRESS_FILE)
+
+
+# Status of every season already handled, code -> {season: 'downloaded', 'merged' or 'missing'}
+def read_progress():
+    try:
+        with open(_progress_path()) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _record(progress, code, season, status):
+    with _progress_lock:
+        progress.setdefault(code, {})[season] = status
+        rf.atomic_write(_progress_path(), json.dumps(progress, indent=1, sort_keys=True).encode())
+
+
+# HTTP session sharing `workers` keep-alive connections, retrying failed requests
+def make_session(workers=WORKERS):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Download one season of a league feed
+def download(session, league, season):
+    """
+    :return: 'downloaded', 'missing' (the feed has no such season) or 'failed'.
+    """
+    import requests
+
+    code = ex.league_codes[league][0]
+    try:
+        with mt.span('download', league):
+            response = session.get(rf.feed_url(code, season), timeout=rf.REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Failed to retrieve {code} {season}: {e}")
+        mt.count('errors_total', type=type(e).__name__)
+        return 'failed'
+    if response.status_code == 404:
+        return 'missing'
+    if response.status_code != 200:
+        print(f"Failed to retrieve {code} {season}. Status code: {response.status_code}")
+        return 'failed'
+
+    path = season_path(code, season)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rf.atomic_write(path, response.content)
+    return 'downloaded'
+
+
+# Read a season file of any era of the feed into the columns of the store
+def read_season(path, league):
+    """
+    Older files are latin-1, name the teams HT/AT, have two-digit years and some
+    rows with more fields than the header; those are cut to the header's length.
+    Cells other than the date are kept as written, e.g. odds of 8 are not turned into 8.0.
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = content.decode('latin-1')
+    size = len(text.split('\n', 1)[0].split(','))
+    df = pd.read_csv(io.StringIO(text), engine='python', dtype=str, index_col=False,
+                     on_bad_lines=lambda fields: fields[:size])
+
+    df = df.loc[:, ~df.columns.str.startswith('Unnamed')].rename(columns=COLUMN_NAMES)
+    df = df.dropna(subset=['HomeTeam', 'AwayTeam'])
+    if 'Div' not in df.columns:
+        df.insert(0, 'Div', ex.league_codes[league][0])
+    df[['HomeTeam', 'AwayTeam']] = df[['HomeTeam', 'AwayTeam']].replace(registry.ALIASES)
+    df['Date'] = parse_dates(df['Date'])
+    return df
+
+
+# Dates of a feed, with four-digit years or, in older files, two-digit years
+def parse_dates(dates):
+    try:
+        return pd.to_datetime(dates, format='%d/%m/%Y')
+    except ValueError:
+        return pd.to_datetime(dates, format='%d/%m/%y')
+
+
+# Merge season files into the historic csv of a league
+def add_to_history(league, paths):
+    """
+    The historic file keeps its columns (COLUMNS for a new one) and its cells as
+    written, a match of `paths` replaces the stored one with the same key (see
+    store.KEY_COLUMNS). The caller holds the feed's lock file.
+
+    :param paths: Season csv files of the league.
+    :return: Number of matches in the historic file.
+    """
+    historic = store.league_files(league)[0]
+    frames = [read_season(path, league) for path in paths]
+    columns = COLUMNS
+    if os.path.exists(historic):
+        history = pd.read_csv(historic, dtype=str, keep_default_na=False)
+        history['Date'] = parse_dates(history['Date'])
+        frames.insert(0, history)
+        columns = list(history.columns)
+
+    df = pd.concat([frame.reindex(columns=columns) for frame in frames], ignore_index=True)
+    df = df.drop_duplicates(subset=store.KEY_COLUMNS, keep='last').sort_values(by='Date', kind='stable')
+    df['Date'] = df['Date'].dt.strftime('%d/%m/%Y')
+    rf.atomic_write(historic, df.to_csv(index=False).encode())
+    return len(df)
+
+
+def _code_lock(code):
+    lock_file = open(os.path.join(ex.resources_dir, f'.{code}.lock'), 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+# Download the past seasons of some leagues and merge them into their historic files
+def backfill(leagues=None, first=FIRST_SEASON, workers=WORKERS, force=False):
+    """
+    :param force: Download the seasons already downloaded or missing again.
+    :return: A dict league -> {'downloaded', 'missing', 'failed' (season counts),
+             'matches' (in the historic file, None when it was not rewritten)}.
+    """
+    leagues = leagues or ex.leagues
+    progress = read_progress()
+    jobs = [(league, season) for league in leagues for season in past_seasons(first)
+            if force or progress.get(ex.league_codes[league][0], {}).get(season) not in ('downloaded', 'merged', 'missing')]
+
+    summary = {league: {'downloaded': 0, 'missing': 0, 'failed': 0, 'matches': None} for league in leagues}
+    session = make_session(workers)
+
+    def run(job):
+        league, season = job
+        status = download(session, league, season)
+        if status != 'failed':
+            _record(progress, ex.league_codes[league][0], season, status)
+        return status
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (league, _), status in zip(jobs, pool.map(run, jobs)):
+            summary[league][status] += 1
+
+    # Downloads of an interrupted run are merged too
+    for league in leagues:
+        code = ex.league_codes[league][0]
+        seasons = [season for season, status in progress.get(code, {}).items() if status == 'downloaded']
+        if not seasons:
+            continue
+        # A season file that cannot be read stays 'downloaded', the other leagues are still merged
+        try:
+            with _code_lock(code):
+                summary[league]['matches'] = add_to_history(league, [season_path(code, season) for season in seasons])
+        except Exception as e:
+            print(f"Failed to merge the seasons {', '.join(sorted(seasons))} of {code}: {e}")
+            mt.count('errors_total', type=type(e).__name__)
+            continue
+        for season in seasons:
+            _record(progress, code, season, 'merged')
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download the past seasons of the league feeds into their historic files.')
+    parser.add_argument('--league', action='append', dest='leagues', choices=ex.leagues, help='League to backfill, repeatable (default: all)')
+    parser.add_argument('--first-season', type=int, default=FIRST_SEASON, help='Start year of the first season, e.g. 2010 for 2010-11')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--force', action='store_true', help='Download every season again')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for league, counts in backfill(args.leagues, args.first_season, args.workers, args.force).items():
+        print(f"{league}: {counts['downloaded']} downloaded, {counts['missing']} missing, {counts['failed']} failed, "
+              f"{counts['matches'] if counts['matches'] is not None else 'no new'} matches in history")
+    print(f"{time.perf_counter() - start:.2f}s")
@@ -0,0 +1,300 @@
+import argparse
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import extract as ex
+import predict as pr
+import registry
+import store
+
+OUTCOMES = ['H', 'D', 'A']
+CALIBRATION_BINS = 10
+
+
+# Per-row stats of a match seen from the home team and from the away team
+def team_perspectives(df):
+    """
+    :param df: A league frame, sorted by date.
+    :return: Two lists (home, away) with one tuple per row:
+             (result, goals_for, goals_against, btts, shots_on_target_for, shots_on_target_against,
+              corners_for, corners_against, cards_for, cards_against).
+    """
+    ftr = df['FTR'].to_numpy()
+    fthg, ftag = df['FTHG'].tolist(), df['FTAG'].tolist()
+    hst, ast = df['HST'].tolist(), df['AST'].tolist()
+    hc, ac = df['HC'].tolist(), df['AC'].tolist()
+    hcards, acards = (df['HY'] + df['HR']).tolist(), (df['AY'] + df['AR']).tolist()
+    btts = ((df['FTHG'] > 0) & (df['FTAG'] > 0)).astype(int).tolist()
+    home_results = np.select([ftr == 'H', ftr == 'A'], ["Win", "Lose"], "Draw").tolist()
+    away_results = np.select([ftr == 'A', ftr == 'H'], ["Win", "Lose"], "Draw").tolist()
+
+    home = list(zip(home_results, fthg, ftag, btts, hst, ast, hc, ac, hcards, acards))
+    away = list(zip(away_results, ftag, fthg, btts, ast, hst, ac, hc, acards, hcards))
+    return home, away
+
+
+# Same dict as predict.get_team_stats, from per-row perspective tuples
+def team_stats_from_rows(rows):
+    columns = list(zip(*rows)) if rows else [[]] * 10
+    results, goals_for, goals_against, btts, sot_for, sot_against, corners_for, corners_against, cards_for, cards_against = (
+        list(column) for column in columns)
+    return {
+        "results": results,
+        "goals_for": goals_for,
+        "goals_against": goals_against,
+        "goals": list(np.add(goals_for, goals_against)),
+        "btts": btts,
+        "shots_on_target_for": sot_for,
+        "shots_on_target_against": sot_against,
+        "corners_for": corners_for,
+        "corners_against": corners_against,
+        "corners": list(np.add(corners_for, corners_against)),
+        "cards_for": cards_for,
+        "cards_against": cards_against,
+        "cards": list(np.add(cards_for, cards_against)),
+    }
+
+
+# Same dict as predict.get_h2h_stats, from the home team's perspective tuples
+def h2h_stats_from_rows(home_team, away_team, rows):
+    stats = team_stats_from_rows(rows)
+    home_team_name = registry.slug(home_team)
+    away_team_name = registry.slug(away_team)
+    outcome = {"Win": home_team + " Win", "Lose": away_team + " Win", "Draw": "Draw"}
+    return {
+        "results": [outcome[result] for result in stats["results"]],
+        f"{home_team_name}_goals": stats["goals_for"],
+        f"{away_team_name}_goals": stats["goals_against"],
+        "goals": stats["goals"],
+        "btts": stats["btts"],
+        f"{home_team_name}_shots_on_target": stats["shots_on_target_for"],
+        f"{away_team_name}_shots_on_target": stats["shots_on_target_against"],
+        f"{home_team_name}_corners": stats["corners_for"],
+        f"{away_team_name}_corners": stats["corners_against"],
+        "corners": stats["corners"],
+        f"{home_team_name}_cards": stats["cards_for"],
+        f"{away_team_name}_cards": stats["cards_against"],
+        "cards": stats["cards"],
+    }
+
+
+# Walk through a league in date order with rolling windows of the latest games
+def walk_forward(df, num_games=5, h2h_games=2):
+    """
+    Yield the pre-match stats of every match, computed only from the matches played
+    on earlier dates. The windows are updated incrementally after each matchday,
+    so the whole league is replayed in one pass.
+
+    :param df: A league frame, sorted by date.
+    :return: Generator of (row position, prematch_stats) with prematch_stats in the
+             format of predict.create_prematch_stats.
+    """
+    home_rows, away_rows = team_perspectives(df)
+    home_teams, away_teams = df['HomeTeam'].tolist(), df['AwayTeam'].tolist()
+    dates = df['Date'].to_numpy()
+
+    overall, at_home, away = {}, {}, {}
+    pairs, fixtures = {}, {}
+
+    def window(windows, key, size):
+        if key not in windows:
+            windows[key] = deque(maxlen=size)
+        return windows[key]
+
+    start = 0
+    while start < len(df):
+        end = start
+        while end < len(df) and dates[end] == dates[start]:
+            end += 1
+
+        for position in range(start, end):
+            home_team, away_team = home_teams[position], away_teams[position]
+            # Latest first, like the sorted lookups in predict
+            h2h = [rows[0] if home_team == rows[1] else rows[2] for rows in reversed(window(pairs, tuple(sorted((home_team, away_team))), h2h_games))]
+            fixture = [rows[0] for rows in reversed(window(fixtures, (home_team, away_team), h2h_games))]
+            yield position, [
+                team_stats_from_rows(list(reversed(window(overall, home_team, num_games)))),
+                team_stats_from_rows(list(reversed(window(overall, away_team, num_games)))),
+                team_stats_from_rows(list(reversed(window(at_home, home_team, num_games)))),
+                team_stats_from_rows(list(reversed(window(away, away_team, num_games)))),
+                h2h_stats_from_rows(home_team, away_team, h2h),
+                h2h_stats_from_rows(home_team, away_team, fixture),
+            ]
+
+        for position in range(start, end):
+            home_team, away_team = home_teams[position], away_teams[position]
+            window(overall, home_team, num_games).append(home_rows[position])
+            window(overall, away_team, num_games).append(away_rows[position])
+            window(at_home, home_team, num_games).append(home_rows[position])
+            window(away, away_team, num_games).append(away_rows[position])
+            window(pairs, tuple(sorted((home_team, away_team))), h2h_games).append(
+                (home_rows[position], home_team, away_rows[position]))
+            window(fixtures, (home_team, away_team), h2h_games).append((home_rows[position],))
+        start = end
+
+
+# Replay a league and collect the predictions next to the actual outcomes
+def replay(df, num_games=5, h2h_games=2):
+    """
+    :return: A dict of numpy arrays, one entry per predicted match, and the number
+             of `skipped` matches that could not be predicted (no earlier games).
+    """
+    predicted = {'probs': [], 'btts_prob': [], 'expected_total_goals': [], 'outcome': [], 'btts': [], 'total_goals': []}
+    skipped = 0
+    ftr, fthg, ftag = df['FTR'].tolist(), df['FTHG'].tolist(), df['FTAG'].tolist()
+    home_teams, away_teams = df['HomeTeam'].tolist(), df['AwayTeam'].tolist()
+
+    for position, prematch_stats in walk_forward(df, num_games, h2h_games):
+        if ftr[position] not in OUTCOMES:
+            continue
+        try:
+            predictions = pr.predict_from_prematch_stats(home_teams[position], away_teams[position], prematch_stats)
+        except ZeroDivisionError:
+            skipped += 1
+            continue
+        predicted['probs'].append([predictions['home_win_prob'], predictions['draw_prob'], predictions['away_win_prob']])
+        predicted['btts_prob'].append(predictions['btts_prob'])
+        predicted['expected_total_goals'].append(predictions['expected_total_goals'])
+        predicted['outcome'].append(OUTCOMES.index(ftr[position]))
+        predicted['btts'].append(int(fthg[position] > 0 and ftag[position] > 0))
+        predicted['total_goals'].append(fthg[position] + ftag[position])
+
+    replayed = {key: np.array(values, dtype=float) for key, values in predicted.items()}
+    replayed['probs'] = replayed['probs'].reshape(-1, 3) / 100
+    replayed['btts_prob'] /= 100
+    replayed['outcome'] = replayed['outcome'].astype(int)
+    replayed['skipped'] = skipped
+    return replayed
+
+
+def calibration(probs, actual, bins=CALIBRATION_BINS):
+    """
+    :return: One entry per non-empty probability bin with the number of predictions,
+             their mean probability and the observed frequency.
+    """
+    edges = np.minimum((probs * bins).astype(int), bins - 1)
+    table = []
+    for b in range(bins):
+        mask = edges == b
+        if mask.any():
+            table.append({
+                'bin': [b / bins, (b + 1) / bins],
+                'count': int(mask.sum()),
+                'predicted': float(probs[mask].mean()),
+                'observed': float(actual[mask].mean()),
+            })
+    return table
+
+
+def binary_scores(probs, actual, eps=1e-15):
+    clipped = np.clip(probs, eps, 1 - eps)
+    return {
+        'brier': float(np.mean((probs - actual) ** 2)),
+        'log_loss': float(-np.mean(actual * np.log(clipped) + (1 - actual) * np.log(1 - clipped))),
+        'accuracy': float(np.mean((probs >= 0.5) == (actual == 1))),
+        'calibration': calibration(probs, actual),
+    }
+
+
+# Probability of more than 2.5 goals when the total is Poisson with the expected total as mean
+def over_2_5_prob(expected_total_goals):
+    lam = np.maximum(expected_total_goals, 0)
+    return 1 - np.exp(-lam) * (1 + lam + lam ** 2 / 2)
+
+
+# Score the replayed predictions
+def evaluate(replayed, eps=1e-15):
+    n = len(replayed['outcome'])
+    report = {'matches': n, 'skipped': replayed['skipped']}
+    if n == 0:
+        return report
+
+    probs, outcome = replayed['probs'], replayed['outcome']
+    actual = np.eye(3)[outcome]
+    report['result'] = {
+        'brier': float(np.mean(np.sum((probs - actual) ** 2, axis=1))),
+        'log_loss': float(-np.mean(np.log(np.clip(probs[np.arange(n), outcome], eps, 1)))),
+        'accuracy': float(np.mean(np.argmax(probs, axis=1) == outcome)),
+        'calibration': {name: calibration(probs[:, i], actual[:, i]) for i, name in enumerate(['home', 'draw', 'away'])},
+    }
+    report['btts'] = binary_scores(replayed['btts_prob'], replayed['btts'])
+
+    errors = replayed['expected_total_goals'] - replayed['total_goals']
+    report['total_goals'] = dict(
+        binary_scores(over_2_5_prob(replayed['expected_total_goals']), (replayed['total_goals'] > 2.5).astype(float)),
+        mae=float(np.mean(np.abs(errors))),
+        rmse=float(math.sqrt(np.mean(errors ** 2))),
+    )
+    return report
+
+
+def _merge(replays):
+    merged = {key: np.concatenate([replayed[key] for replayed in replays]) for key in replays[0] if key != 'skipped'}
+    merged['outcome'] = merged['outcome'].astype(int)
+    merged['skipped'] = sum(replayed['skipped'] for replayed in replays)
+    return merged
+
+
+def _replay_league(league, num_games, h2h_games):
+    return replay(store.build_league_frame(store.league_files(league)), num_games, h2h_games)
+
+
+# Backtest several leagues, optionally on a process pool, and score them together as well
+def backtest(leagues=None, workers=1, num_games=5, h2h_games=2):
+    leagues = leagues or ex.leagues
+    start = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            replays = list(pool.map(_replay_league, leagues, [num_games] * len(leagues), [h2h_games] * len(leagues)))
+    else:
+        replays = [_replay_league(league, num_games, h2h_games) for league in leagues]
+
+    report = {'leagues': {league: evaluate(replayed) for league, replayed in zip(leagues, replays)}}
+    report['overall'] = evaluate(_merge(replays))
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def _print_summary(name, report):
+    if not report.get('matches'):
+        print(f"{name:<26} no predictable matches")
+        return
+    print(f"{name:<26} {report['matches']:>6} {report['skipped']:>7}"
+          f" {report['result']['brier']:>7.4f} {report['result']['log_loss']:>7.4f} {report['result']['accuracy']:>6.3f}"
+          f" {report['btts']['brier']:>7.4f} {report['btts']['accuracy']:>6.3f}"
+          f" {report['total_goals']['brier']:>7.4f} {report['total_goals']['mae']:>6.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of aggregate_team_specific_predictions.')
+    parser.add_argument('--data', help='Dataset directory written by synthetic.py (default: resources/)')
+    parser.add_argument('--league', action='append', dest='leagues', help='League to replay, repeatable (default: all)')
+    parser.add_argument('--workers', type=int, default=1, help='Replay leagues on a process pool of this size')
+    parser.add_argument('--num-games', type=int, default=5, help='Size of the last games windows')
+    parser.add_argument('--h2h-games', type=int, default=2, help='Size of the H2H windows')
+    parser.add_argument('--json', help='Write the full report, with calibration tables, to this file')
+    args = parser.parse_args()
+
+    if args.data:
+        ex.use_dataset(args.data)
+    unknown = set(args.leagues or []) - set(ex.leagues)
+    if unknown:
+        parser.error(f"unknown leagues: {', '.join(sorted(unknown))}")
+
+    report = backtest(args.leagues, args.workers, args.num_games, args.h2h_games)
+
+    print(f"{'league':<26} {'n':>6} {'skipped':>7} {'1x2 bs':>7} {'1x2 ll':>7} {'1x2 acc':>6}"
+          f" {'btts bs':>7} {'btts acc':>6} {'o2.5 bs':>7} {'tg mae':>6}")
+    for league, league_report in report['leagues'].items():
+        _print_summary(league, league_report)
+    _print_summary('overall', report['overall'])
+    print(f"{report['seconds']:.2f}s")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
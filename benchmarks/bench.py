@@ -0,0 +1,229 @@
+"""
+Offline benchmarks of the prediction path, run against the csv files in resources/
+or a dataset generated by synthetic.py.
+
+The upstream fetch is replaced by a stub and the background refresher is off, so
+runs only depend on the bundled data:
+
+    python benchmarks/bench.py --output bench.json
+    python benchmarks/bench.py --compare bench.json --threshold 0.2
+    python benchmarks/bench.py --data /tmp/big --league "Synthetic League 00"
+
+Metric names ending in `_ms` are latencies and `_mb` memory (lower is better),
+names ending in `_per_s` are throughputs (higher is better). Comparing fails when a
+metric is worse than the baseline by more than the threshold.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ['REFRESH_INTERVAL'] = '0'
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import cache  # noqa: E402
+import extract as ex  # noqa: E402
+import matrix as mx  # noqa: E402
+import predict as pr  # noqa: E402
+import refresh as rf  # noqa: E402
+import registry  # noqa: E402
+import store  # noqa: E402
+import team_index as ti  # noqa: E402
+
+CONCURRENCY = (1, 4, 16)
+
+
+# Keep benchmarks offline and on the scoring path
+def stub_network(use_matrix=False):
+    rf.refresh_league = lambda code, force=False, ttl=None, notify=True: 'not_modified'
+    if not use_matrix:
+        mx.lookup = lambda league, home_team, away_team, version: None
+
+
+def fixtures(league, limit=None):
+    pairs = list(itertools.permutations(ex.get_teams(league), 2))
+    return pairs[:limit] if limit else pairs
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 4)
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    try:
+        function(*args)
+    except Exception:
+        # Fixtures without enough data still cost a full attempt
+        pass
+    return time.perf_counter() - start
+
+
+# Latency of get_stats from an empty store, with the league loaded, and from the cache
+def bench_get_stats(league, pairs, repeat):
+    cold = []
+    for home_team, away_team in pairs[:repeat]:
+        store.clear()
+        cache.clear()
+        cold.append(_timed(pr.get_stats, league, home_team, away_team))
+
+    warm = []
+    for home_team, away_team in pairs:
+        cache.clear()
+        warm.append(_timed(pr.get_stats, league, home_team, away_team))
+
+    for home_team, away_team in pairs:
+        _timed(pr.get_stats, league, home_team, away_team)
+    cached = [_timed(pr.get_stats, league, home_team, away_team) for home_team, away_team in pairs]
+    return {
+        'cold_get_stats_ms': _ms(statistics.median(cold)),
+        'warm_get_stats_ms': _ms(statistics.median(warm)),
+        'warm_get_stats_p95_ms': _ms(sorted(warm)[int(len(warm) * 0.95)]),
+        'cached_get_stats_ms': _ms(statistics.median(cached)),
+    }
+
+
+# Throughput of create_prematch_stats and the cost of its parts per fixture
+def bench_stages(league, pairs):
+    data = store.get_league(league)
+    df, index = data['df'], data['index']
+
+    start = time.perf_counter()
+    prematch = []
+    for home_team, away_team in pairs:
+        prematch.append(pr.create_prematch_stats(home_team, away_team, df, index))
+    prematch_seconds = time.perf_counter() - start
+
+    games = [(home_team, ti.latest_games(index, df, registry.lookup(home_team), num_games=5)) for home_team, _ in pairs]
+    start = time.perf_counter()
+    for team, team_games in games:
+        pr.get_team_stats(team, team_games)
+    team_stats_seconds = time.perf_counter() - start
+
+    aggregate_seconds = sum(_timed(pr.predict_from_prematch_stats, home_team, away_team, stats)
+                            for (home_team, away_team), stats in zip(pairs, prematch))
+    return {
+        'create_prematch_stats_per_s': round(len(pairs) / prematch_seconds, 1),
+        'get_team_stats_ms': _ms(team_stats_seconds / len(pairs)),
+        'aggregate_ms': _ms(aggregate_seconds / len(pairs)),
+    }
+
+
+# End-to-end /get_stats through the Flask test client at several concurrency levels
+def bench_http(pairs_by_league, requests_per_level, levels=CONCURRENCY):
+    import app
+
+    client = app.app.test_client()
+    # Alternate between leagues, like real traffic
+    longest = max(len(pairs) for pairs in pairs_by_league.values())
+    work = [(league, *pairs[i]) for i in range(longest) for league, pairs in pairs_by_league.items() if i < len(pairs)]
+    work = list(itertools.islice(itertools.cycle(work), requests_per_level))
+
+    def call(fixture):
+        league, home_team, away_team = fixture
+        start = time.perf_counter()
+        client.post('/get_stats', json={'league': league, 'home_team': home_team, 'away_team': away_team})
+        return time.perf_counter() - start
+
+    results = {}
+    for level in levels:
+        cache.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            latencies = sorted(pool.map(call, work))
+        elapsed = time.perf_counter() - start
+        results[f'http_c{level}'] = {
+            'requests_per_s': round(len(work) / elapsed, 1),
+            'p50_ms': _ms(latencies[len(latencies) // 2]),
+            'p95_ms': _ms(latencies[int(len(latencies) * 0.95)]),
+        }
+    return results
+
+
+def run(leagues, fixtures_per_league, cold_repeat, requests_per_level):
+    results = {}
+    pairs_by_league = {}
+    for league in leagues:
+        pairs = fixtures(league, fixtures_per_league)
+        pairs_by_league[league] = pairs
+        results[league] = dict(bench_get_stats(league, pairs, cold_repeat), **bench_stages(league, pairs))
+    if requests_per_level:
+        results.update(bench_http(pairs_by_league, requests_per_level))
+    # Peak resident memory of the whole run, in kilobytes on Linux
+    results['memory'] = {'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'data': ex.resources_dir,
+            'rows': {league: len(store.get_league_frame(league)) for league in leagues},
+        },
+        'results': results,
+    }
+
+
+# Metrics worse than the baseline by more than `threshold` (0.2 = 20%)
+def compare(current, baseline, threshold):
+    """
+    :return: A list of (group, metric, baseline value, current value, relative change).
+    """
+    regressions = []
+    for group, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            base = baseline['results'].get(group, {}).get(metric)
+            if not base:
+                continue
+            change = (value - base) / base
+            worse = change > threshold if metric.endswith(('_ms', '_mb')) else change < -threshold
+            if worse:
+                regressions.append((group, metric, base, value, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the prediction path offline.')
+    parser.add_argument('--data', help='Dataset directory written by synthetic.py (default: resources/)')
+    parser.add_argument('--league', action='append', dest='leagues', help='League to benchmark, repeatable (default: all)')
+    parser.add_argument('--fixtures', type=int, default=60, help='Fixtures per league (0: every pair of teams)')
+    parser.add_argument('--cold-repeat', type=int, default=5, help='Cold get_stats runs per league')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per concurrency level (0: skip the HTTP benchmark)')
+    parser.add_argument('--matrix', action='store_true', help='Serve from the prediction matrices when they are built')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.data:
+        ex.use_dataset(args.data)
+    unknown = set(args.leagues or []) - set(ex.leagues)
+    if unknown:
+        parser.error(f"unknown leagues: {', '.join(sorted(unknown))}")
+
+    stub_network(args.matrix)
+    report = run(args.leagues or ex.leagues, args.fixtures or None, args.cold_repeat, args.requests)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.threshold)
+        for group, metric, base, value, change in regressions:
+            print(f"REGRESSION {group} {metric}: {base} -> {value} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%}")
@@ -0,0 +1,58 @@
+"""
+Import time budget of a gunicorn worker.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter a few times and
+fails when the fastest run goes over the budget:
+
+    python benchmarks/import_time.py --budget-ms 900
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+DEFAULT_BUDGET_MS = int(os.environ.get('IMPORT_TIME_BUDGET_MS', 900))
+
+
+# Import a module in a fresh interpreter and parse the -X importtime report
+def measure(module='app'):
+    """
+    :return: A dict module -> cumulative microseconds, for every imported module.
+    """
+    env = dict(os.environ, REFRESH_INTERVAL='0')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fail when importing the app takes longer than a budget.')
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=3, help='Keep the fastest of this many runs')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest top-level imports to show')
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    fastest = min(runs, key=lambda run: run[args.module])
+    total_ms = fastest[args.module] / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, us in sorted(fastest.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    for heavy in ('matplotlib', 'plotly', 'seaborn', 'sklearn'):
+        if heavy in fastest:
+            print(f"{heavy} is imported by {args.module}")
+            sys.exit(1)
+    if total_ms > args.budget_ms:
+        print("Over budget")
+        sys.exit(1)
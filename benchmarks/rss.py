@@ -0,0 +1,130 @@
+"""
+Memory of the gunicorn workers with and without preloading the league data.
+
+Starts gunicorn with gunicorn.conf.py on a local port, sends requests for every
+league until each worker has served them, then reads the memory of every worker
+from /proc (Linux only):
+
+    python benchmarks/rss.py --workers 4
+    python benchmarks/rss.py --workers 4 --mode preload --output rss.json
+
+`rss_mb` counts shared pages in full in every process, `pss_mb` splits them between
+the processes sharing them, and `private_mb` is what the worker alone holds.
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import extract as ex  # noqa: E402
+
+MODES = {'on-demand': '0', 'preload': '1'}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(port, path, params):
+    url = f'http://127.0.0.1:{port}{path}?{urllib.parse.urlencode(params)}'
+    with urllib.request.urlopen(url, timeout=120) as response:
+        return json.loads(response.read())
+
+
+def _wait_ready(port, process, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited')
+        try:
+            return _get(port, '/get_teams', {'league': ex.leagues[0]})
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError('gunicorn did not start')
+
+
+# Memory of one process from /proc/<pid>/smaps_rollup, in megabytes
+def process_memory(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': round(fields['Rss'], 1),
+        'pss_mb': round(fields['Pss'], 1),
+        'private_mb': round(fields['Private_Clean'] + fields['Private_Dirty'], 1),
+    }
+
+
+def _children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        return [int(child) for child in file.read().split()]
+
+
+# Memory of the master and workers of one gunicorn run after serving every league
+def measure(mode, workers, requests_per_league):
+    port = _free_port()
+    env = dict(os.environ, PRELOAD_APP=MODES[mode], REFRESH_INTERVAL='0', WEB_CONCURRENCY=str(workers),
+               PORT=str(port))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn.conf.py'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        start = time.perf_counter()
+        _wait_ready(port, process)
+        ready_seconds = time.perf_counter() - start
+
+        work = []
+        for league in ex.leagues:
+            teams = _get(port, '/get_teams', {'league': league})['teams']
+            pairs = itertools.islice(itertools.cycle(itertools.permutations(teams, 2)), requests_per_league)
+            work += [{'league': league, 'home_team': home_team, 'away_team': away_team} for home_team, away_team in pairs]
+        # Concurrent requests spread over the workers, so every worker serves every league
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            list(pool.map(lambda params: _get(port, '/get_stats', params), work))
+
+        worker_memory = [process_memory(pid) for pid in _children(process.pid)]
+        summary = {
+            name: round(statistics.mean(memory[name] for memory in worker_memory), 1)
+            for name in ('rss_mb', 'pss_mb', 'private_mb')
+        }
+        return {
+            'ready_s': round(ready_seconds, 2),
+            'master': process_memory(process.pid),
+            'worker_mean': summary,
+            'workers': worker_memory,
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the memory of the gunicorn workers.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mode', choices=MODES, action='append', dest='modes', help='Serving mode, repeatable (default: both)')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per league')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    report = {mode: measure(mode, args.workers, args.requests) for mode in args.modes or MODES}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    print(text)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import refresh as rf
+
+# Maximum number of predictions kept in memory, per process
+MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_SIZE', 4096))
+# Optional directory shared by all workers, e.g. under /dev/shm to keep it in memory
+CACHE_DIR = os.environ.get('PREDICTION_CACHE_DIR')
+# Maximum number of predictions kept in the shared directory
+MAX_FILES = int(os.environ.get('PREDICTION_CACHE_FILES', 20000))
+
+_entries = OrderedDict()
+# League -> data version of the entries currently cached for it
+_versions = {}
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'shared_hits': 0}
+_puts_since_trim = 0
+
+
+# `version` is the league's data version, `variant` what else the prediction depends on
+# (engine, windows), so predictions of every variant of a version stay cached together
+def make_key(league, home_team, away_team, version, variant=''):
+    return (league, home_team, away_team, version, variant)
+
+
+def _file_path(key):
+    return os.path.join(CACHE_DIR, hashlib.sha1(json.dumps(key).encode()).hexdigest() + '.json')
+
+
+# Drop the entries of a league computed from an older data version
+def _invalidate(league, version):
+    if _versions.get(league) == version:
+        return
+    stale = [key for key in _entries if key[0] == league and key[3] != version]
+    for key in stale:
+        del _entries[key]
+    _counters['invalidations'] += len(stale)
+    _versions[league] = version
+
+
+# Move the entries of a league whose teams did not change over to a new data version
+def carry_over(league, old_version, new_version, changed_teams, keep=None):
+    """
+    :param changed_teams: Teams with added or corrected matches; entries of fixtures
+                          involving them are dropped, None drops every entry of the league.
+    :param keep: Called with the variant of an entry, False drops it whatever its teams
+                 (e.g. a model fitted on every match of the league).
+    """
+    with _lock:
+        if _versions.get(league) != old_version:
+            return
+        stale = [key for key in _entries if key[0] == league]
+        for key in stale:
+            predictions = _entries.pop(key)
+            if (changed_teams is not None and key[3] == old_version and key[1] not in changed_teams
+                    and key[2] not in changed_teams and (keep is None or keep(key[4]))):
+                _entries[make_key(league, key[1], key[2], new_version, key[4])] = predictions
+            else:
+                _counters['invalidations'] += 1
+        _versions[league] = new_version
+
+
+def _store(key, predictions):
+    _entries[key] = predictions
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _counters['evictions'] += 1
+
+
+def _read_file(key):
+    try:
+        with open(_file_path(key)) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('key') != list(key):
+        return None
+    # Mark as recently used for the shared eviction
+    try:
+        os.utime(_file_path(key))
+    except OSError:
+        pass
+    return cached['predictions']
+
+
+def _write_file(key, predictions):
+    global _puts_since_trim
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    rf.atomic_write(_file_path(key), json.dumps({'key': list(key), 'predictions': predictions}).encode())
+
+    _puts_since_trim += 1
+    if _puts_since_trim >= max(MAX_FILES // 10, 1):
+        _puts_since_trim = 0
+        _trim_files()
+
+
+# Remove the least recently used files once the shared directory is over MAX_FILES
+def _trim_files():
+    files = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith('.json'):
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    if len(files) <= MAX_FILES:
+        return
+    files.sort()
+    removed = 0
+    for _, path in files[:len(files) - MAX_FILES]:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    with _lock:
+        _counters['evictions'] += removed
+
+
+# Get a cached prediction
+def get(key):
+    """
+    :param key: A key from `make_key`.
+    :return: The cached predictions dict, or None. Treat it as read-only, it is shared.
+    """
+    with _lock:
+        _invalidate(key[0], key[3])
+        predictions = _entries.get(key)
+        if predictions is not None:
+            _entries.move_to_end(key)
+            _counters['hits'] += 1
+            return predictions
+
+    if CACHE_DIR:
+        predictions = _read_file(key)
+        if predictions is not None:
+            with _lock:
+                _store(key, predictions)
+                _counters['hits'] += 1
+                _counters['shared_hits'] += 1
+            return predictions
+
+    with _lock:
+        _counters['misses'] += 1
+    return None
+
+
+# Cache a prediction
+def put(key, predictions):
+    with _lock:
+        _invalidate(key[0], key[3])
+        _store(key, predictions)
+    if CACHE_DIR:
+        try:
+            _write_file(key, predictions)
+        except OSError as e:
+            print(f"Failed to write the prediction cache: {e}")
+
+
+# Hit/miss/eviction counters of this process
+def stats():
+    with _lock:
+        counters = dict(_counters, entries=len(_entries), max_entries=MAX_ENTRIES, shared=bool(CACHE_DIR))
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+    return counters
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _versions.clear()
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import extract as ex
+
+# Cache the merged league frames as typed .npy columns, memory-mapped on load
+ENABLED = os.environ.get('COLUMNAR_CACHE', '1') != '0'
+# Date column stored as int32 days since 1970-01-01, this marks a missing date
+NO_DATE = np.iinfo(np.int32).min
+
+
+def columnar_dir():
+    return os.path.join(ex.resources_dir, 'columnar')
+
+
+def league_dir(code, version):
+    return os.path.join(columnar_dir(), f'{code}-{version}')
+
+
+def _smallest_int(values):
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+    return values.dtype
+
+
+# Write a league frame as one .npy file per column
+def save_frame(df, directory):
+    """
+    Columns `Div` through `AR` only: dates as int32 day numbers, text columns
+    (team names, results, referees) as integer codes into a dictionary, and
+    integer stats in the smallest integer type that holds them.
+
+    :param df: A league frame from `store.build_league_frame`.
+    :param directory: Target directory, replaced atomically.
+    """
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        columns = []
+        for position, name in enumerate(df.columns):
+            series = df[name]
+            path = os.path.join(tmp_dir, f'{position}.npy')
+            if name == 'Date':
+                days = series.to_numpy().astype('datetime64[D]').astype(np.int64)
+                days[series.isna().to_numpy()] = NO_DATE
+                np.save(path, days.astype(np.int32))
+                columns.append({'name': name, 'kind': 'date'})
+            elif series.dtype == object:
+                codes, uniques = pd.factorize(series)
+                np.save(path, codes.astype(_smallest_int(codes)))
+                columns.append({'name': name, 'kind': 'dictionary', 'values': uniques.tolist()})
+            elif pd.api.types.is_integer_dtype(series.dtype):
+                values = series.to_numpy()
+                np.save(path, values.astype(_smallest_int(values)))
+                columns.append({'name': name, 'kind': 'numeric'})
+            else:
+                np.save(path, series.to_numpy())
+                columns.append({'name': name, 'kind': 'numeric'})
+
+        with open(os.path.join(tmp_dir, 'columns.json'), 'w') as file:
+            json.dump({'rows': len(df), 'columns': columns}, file)
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # Another worker wrote the same version first
+            if not os.path.exists(directory):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+# Load a league frame written by save_frame, memory-mapping the numeric columns
+def load_frame(directory):
+    with open(os.path.join(directory, 'columns.json')) as file:
+        meta = json.load(file)
+
+    data = {}
+    for position, column in enumerate(meta['columns']):
+        values = np.load(os.path.join(directory, f'{position}.npy'), mmap_mode='r')
+        if column['kind'] == 'date':
+            dates = values.astype(np.int64).astype('datetime64[D]').astype('datetime64[ns]')
+            dates[values == NO_DATE] = np.datetime64('NaT')
+            data[column['name']] = dates
+        elif column['kind'] == 'dictionary':
+            data[column['name']] = pd.Categorical.from_codes(values, column['values'])
+        else:
+            data[column['name']] = values
+    return pd.DataFrame(data, copy=False)
+
+
+# Get the cached frame of a league for a data version, or None
+def load_league(code, version):
+    directory = league_dir(code, version)
+    if not ENABLED or not os.path.exists(os.path.join(directory, 'columns.json')):
+        return None
+    try:
+        return load_frame(directory)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Failed to load {directory}: {e}")
+        return None
+
+
+# Cache the frame of a league for a data version and drop older versions
+def save_league(code, version, df):
+    if not ENABLED:
+        return
+    directory = league_dir(code, version)
+    try:
+        if not os.path.exists(directory):
+            save_frame(df, directory)
+        for name in os.listdir(columnar_dir()):
+            if name.startswith(f'{code}-') and name != os.path.basename(directory):
+                shutil.rmtree(os.path.join(columnar_dir(), name), ignore_errors=True)
+    except OSError as e:
+        print(f"Failed to write {directory}: {e}")
+
+
+if __name__ == '__main__':
+    import store
+
+    # Building a league through the store writes its columnar files
+    for league in ex.leagues:
+        data = store.get_league(league)
+        print(league, league_dir(ex.league_codes[league][0], data['version']))
@@ -0,0 +1,131 @@
+"""
+Exponentially time-decayed form of every team, over all of its matches.
+
+For each team, scope (every match, home matches, away matches) and half-life the
+aggregate keeps a weight W and per-stat sums S, updated per match in O(1):
+
+    S = S * exp(-rate * days since the team's previous match) + x
+    W = W * exp(-rate * days since the team's previous match) + 1
+
+S / W is the decayed average of a stat, and does not depend on the day it is read.
+Aggregates follow the league store: rows appended since the last update are
+folded in, anything else rebuilds them.
+"""
+import os
+import threading
+
+import numpy as np
+
+# Half-lives in days of the maintained aggregates, a request picks one of them
+HALF_LIVES = [int(days) for days in os.environ.get('DECAY_HALF_LIVES', '90,180,365').split(',')]
+# Per-match values from a team's point of view, in the order of the sums
+STATS = ['win', 'draw', 'lose', 'goals_for', 'goals_against', 'btts', 'shots_on_target_for',
+         'shots_on_target_against', 'corners_for', 'corners_against', 'cards_for', 'cards_against']
+
+# League name -> {'version', 'rows', 'teams': {team: {scope: aggregate}}}
+_states = {}
+_lock = threading.Lock()
+
+
+def _rates():
+    return np.log(2) / np.array(HALF_LIVES, dtype=float)
+
+
+# Per-match values of the home and away teams of a set of rows
+def match_values(df):
+    """
+    :return: (days since the epoch, home team values, away team values), the values
+             with one column per entry of STATS.
+    """
+    def column(name):
+        return np.nan_to_num(df[name].to_numpy(dtype=float))
+
+    home_goals, away_goals = column('FTHG'), column('FTAG')
+    home_cards, away_cards = column('HY') + column('HR'), column('AY') + column('AR')
+    home_won, away_won = home_goals > away_goals, home_goals < away_goals
+    draw = ~home_won & ~away_won
+    btts = (home_goals > 0) & (away_goals > 0)
+
+    home = np.column_stack([home_won, draw, away_won, home_goals, away_goals, btts, column('HST'), column('AST'),
+                            column('HC'), column('AC'), home_cards, away_cards]).astype(float)
+    away = np.column_stack([away_won, draw, home_won, away_goals, home_goals, btts, column('AST'), column('HST'),
+                            column('AC'), column('HC'), away_cards, home_cards]).astype(float)
+    days = df['Date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    return days, home, away
+
+
+def _updated(aggregate, day, values, rates):
+    if aggregate is None:
+        return {'day': day, 'weight': np.ones(len(rates)), 'sums': np.tile(values, (len(rates), 1))}
+    decay = np.exp(-rates * (day - aggregate['day']))
+    return {
+        'day': day,
+        'weight': aggregate['weight'] * decay + 1,
+        'sums': aggregate['sums'] * decay[:, None] + values,
+    }
+
+
+# Fold the rows of a league frame from `start` on into the aggregates of its teams
+def update(teams, df, start=0):
+    """
+    :param teams: team -> {scope: aggregate}, updated in place; aggregates are
+                  replaced rather than modified, so readers of a copy of `teams`
+                  are not affected.
+    """
+    rows = df.iloc[start:]
+    days, home_values, away_values = match_values(rows)
+    rates = _rates()
+    for day, home_team, away_team, home, away in zip(days.tolist(), rows['HomeTeam'].tolist(), rows['AwayTeam'].tolist(),
+                                                     home_values, away_values):
+        for team, scope, values in ((home_team, 'home', home), (away_team, 'away', away)):
+            aggregates = teams[team] = dict(teams.get(team, {}))
+            aggregates['overall'] = _updated(aggregates.get('overall'), day, values, rates)
+            aggregates[scope] = _updated(aggregates.get(scope), day, values, rates)
+    return teams
+
+
+# Get the aggregates of a league's current data
+def get_state(data):
+    """
+    :param data: League data from `store.get_league`.
+    """
+    league = data['league']
+    state = _states.get(league)
+    if state is not None and state['version'] == data['version']:
+        return state
+    with _lock:
+        state = _states.get(league)
+        if state is None or state['version'] != data['version']:
+            if (state is not None and data['previous_version'] == state['version']
+                    and data['unchanged_rows'] >= state['rows']):
+                teams = update(dict(state['teams']), data['df'], state['rows'])
+            else:
+                teams = update({}, data['df'])
+            state = {'version': data['version'], 'rows': len(data['df']), 'teams': teams}
+            _states[league] = state
+    return state
+
+
+# Decayed form of a team, in the format of predict.get_team_stats
+def team_stats(data, team, half_life, scope='overall'):
+    """
+    :param half_life: One of HALF_LIVES, in days.
+    :param scope: 'overall', 'home' or 'away' matches.
+    :return: A stats dict whose `results` holds the decayed shares of wins, draws and
+             losses, and whose other entries hold the decayed average as a one-item list.
+    """
+    aggregate = get_state(data)['teams'].get(team, {}).get(scope)
+    if aggregate is None:
+        raise KeyError(f"No {scope} matches of {team}")
+    i = HALF_LIVES.index(half_life)
+    averages = dict(zip(STATS, (aggregate['sums'][i] / aggregate['weight'][i]).tolist()))
+
+    stats = {'results': {'Win': averages['win'], 'Draw': averages['draw'], 'Lose': averages['lose']}}
+    for name in ('goals', 'shots_on_target', 'corners', 'cards'):
+        stats[f'{name}_for'] = [averages[f'{name}_for']]
+        stats[f'{name}_against'] = [averages[f'{name}_against']]
+    stats['goals'] = [averages['goals_for'] + averages['goals_against']]
+    stats['btts'] = [averages['btts']]
+    stats['corners'] = [averages['corners_for'] + averages['corners_against']]
+    stats['cards'] = [averages['cards_for'] + averages['cards_against']]
+    return stats
@@ -1,50 +1,35 @@
+import json
+import os
+
+# Directory holding the league csv files
+resources_dir = os.environ.get('RESOURCES_DIR', 'resources')
+# Written next to generated datasets (see synthetic.py), lists their leagues
+MANIFEST = 'manifest.json'
+
 leagues = ['English Premier League', 'LaLiga', 'Serie A', 'Bundesliga', 'Ligue 1', 'Scottish Premier League', 'Championship']
-teams = {
-    'English Premier League': sorted([
-        'Arsenal', 'Bournemouth', 'Brighton', 'Everton', 
-        'Newcastle', 'Brentford', 'Chelsea', 'Man United', "Nott'm Forest", 'Fulham',
-        'Liverpool', 'Wolves', 'Tottenham', 'Man City', 'Aston Villa', 'West Ham',
-        'Crystal Palace', 'Ipswich', 'Leicester', 'Southampton'
-    ]),
-    'Scottish Premier League': sorted([
-        'Celtic', 'Dundee', 'St Johnstone', 'Kilmarnock', 'Hibernian',
-        'Rangers', 'Ross County', 'St Mirren', 'Aberdeen', 'Hearts', 'Motherwell',
-        'Dundee United'
-    ]),
-    'Serie A': sorted([
-        'Empoli', 'Genoa', 'Inter', 'Roma', 'Lecce', 'Udinese',
-        'Torino', 'Bologna', 'Monza', 'Milan', 'Verona', 'Fiorentina', 'Juventus',
-        'Lazio', 'Napoli', 'Cagliari', 'Atalanta', 'Parma', 'Venezia',
-        'Como'
-    ]),
-    'Bundesliga': sorted([
-        'Werder Bremen', 'Augsburg', 'Hoffenheim', 'Leverkusen', 'Stuttgart', 'Wolfsburg', 
-        'Dortmund', 'Union Berlin', 'Ein Frankfurt', 'RB Leipzig', 
-        'Freiburg', 'Heidenheim', "M'gladbach", 'Mainz', 'Bayern Munich', 'St Pauli', 
-        'Holstein Kiel'
-    ]),
-    'LaLiga': sorted([
-        'Sevilla', 'Sociedad', 'Las Palmas', 'Ath Bilbao', 'Celta', 'Villarreal', 
-        'Getafe', 'Ath Madrid', 'Mallorca', 'Valencia', 'Osasuna', 'Girona', 'Barcelona', 
-        'Betis', 'Alaves', 'Vallecano', 'Real Madrid', 'Valladolid', 'Espanol', 'Leganes'
-    ]),
-    'Ligue 1': sorted([
-        'Nice', 'Marseille', 'Paris SG', 'Brest', 'Montpellier', 'Nantes', 'Rennes', 
-        'Strasbourg', 'Lyon', 'Toulouse', 'Lille', 'Le Havre', 'Reims', 'Monaco', 
-        'Lens', 'Auxerre', 'Angers', 'St Etienne'
-    ]),
-    'Championship': sorted([
-        'Sheffield Weds', 'Blackburn', 'Bristol City', 'Middlesbrough', 'Norwich', 'Plymouth', 'Stoke', 
-        'Swansea', 'Watford', 'Leicester', 'Leeds', 'Sunderland', 'Coventry', 'Cardiff', 
-        'Hull', 'Ipswich', 'Millwall', 'Preston', 'Southampton', 'West Brom', 
-        'QPR', 'Oxford', 'Luton', 'Derby', 'Portsmouth', 'Burnley', 'Sheffield United'
-    ])
-}
+# League name -> [football-data.co.uk code (current season file), historic file]
+league_codes = {"English Premier League": ['E0', 'epl'], "Scottish Premier League": ['SC0', 'spl'], "Serie A": ['I1', 'sa'], "Bundesliga": ['D1', 'bdl'], "LaLiga": ['SP1', 'llg'], "Ligue 1": ['F1', 'l1'], "Championship": ['E1', 'c']}
+
+
+# Use the leagues of a dataset directory with a manifest instead of the bundled ones
+def use_dataset(directory):
+    global resources_dir
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    resources_dir = directory
+    leagues[:] = list(manifest['leagues'])
+    league_codes.clear()
+    league_codes.update({league: spec['codes'] for league, spec in manifest['leagues'].items()})
+
 
+if os.path.exists(os.path.join(resources_dir, MANIFEST)):
+    use_dataset(resources_dir)
 
 
 def get_leagues():
     return leagues
 
+# Teams of a league's latest season, derived from its matches
 def get_teams(league):
-    return teams[league]
\ No newline at end of file
+    import store
+    return store.league_teams(league)
@@ -0,0 +1,212 @@
+"""
+Point-in-time team form: the last-N aggregates of every team at every match date.
+
+One vectorized pass over a league frame computes, after each match, the rolling
+means of the last `num_games` overall, home and away games of its teams and of
+the last `h2h_games` meetings of the pair (either venue) and of the fixture (same
+home team). The rows of each team, pair or fixture are contiguous and in date
+order, so the form "as of" a date is a binary search on the match days, instead
+of filtering the frame for the matches played before it.
+
+The means give the same predictions as the current form (predict.py) because
+every stat of the predictions is a mean over the games of its window.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics as mt
+import registry
+
+# Per-match values from one team's point of view, `goals`, `corners` and `cards`
+# being the match totals, so their means add up like in predict.get_team_stats
+STATS = ['win', 'draw', 'lose', 'goals_for', 'goals_against', 'goals', 'btts', 'shots_on_target_for',
+         'shots_on_target_against', 'corners_for', 'corners_against', 'corners', 'cards_for',
+         'cards_against', 'cards']
+# Pair and fixture codes are lower ID * ID_BASE + higher ID, and home ID * ID_BASE + away ID
+ID_BASE = 1 << 20
+# Stores kept in memory, one per league and windows, least recently used dropped first
+MAX_STORES = int(os.environ.get('FEATURE_STORES', 16))
+
+# (league, num_games, h2h_games) -> {'version', 'overall', 'home', 'away', 'pair', 'fixture'}
+_stores = OrderedDict()
+_lock = threading.Lock()
+
+
+# Per-match values of the home and away teams of a league frame
+def match_values(df):
+    """
+    Missing stats stay NaN, and so do the means of the windows containing them.
+
+    :return: (home team values, away team values), one column per entry of STATS.
+    """
+    def column(name):
+        return df[name].to_numpy(dtype=float)
+
+    result = df['FTR'].to_numpy(dtype=object)
+    home_won, away_won = result == 'H', result == 'A'
+    draw = ~home_won & ~away_won
+    home_goals, away_goals = column('FTHG'), column('FTAG')
+    btts = (home_goals > 0) & (away_goals > 0)
+    home_shots, away_shots = column('HST'), column('AST')
+    home_corners, away_corners = column('HC'), column('AC')
+    home_cards, away_cards = column('HY') + column('HR'), column('AY') + column('AR')
+    goals, corners, cards = home_goals + away_goals, home_corners + away_corners, home_cards + away_cards
+
+    home = np.column_stack([home_won, draw, away_won, home_goals, away_goals, goals, btts, home_shots, away_shots,
+                            home_corners, away_corners, corners, home_cards, away_cards, cards]).astype(float)
+    away = np.column_stack([away_won, draw, home_won, away_goals, home_goals, goals, btts, away_shots, home_shots,
+                            away_corners, home_corners, corners, away_cards, home_cards, cards]).astype(float)
+    return home, away
+
+
+# Rolling means of the last `window` rows of every key
+def rolling(keys, positions, days, values, window):
+    """
+    :param keys: Integer key of every row (team ID, pair or fixture code).
+    :param positions: Row position in the league frame, the order within a key.
+    :param values: (rows x STATS) values.
+    :return: A dict with `days`, `means` and `counts` (the games in the window after
+             each row) sorted by key then position, and `spans`, key -> (start, stop)
+             of its rows.
+    """
+    order = np.lexsort((positions, keys))
+    keys, days, values = keys[order], days[order], values[order]
+    size = len(keys)
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if size else np.empty(0, dtype=np.int64)
+    stops = np.r_[starts[1:], size].astype(np.int64)
+    group_start = np.repeat(starts, stops - starts)
+    rows = np.arange(size)
+    window_start = np.maximum(group_start, rows - window + 1)
+
+    # Window sums are differences of running sums, NaNs counted separately
+    missing = np.isnan(values)
+    sums = np.vstack([np.zeros(values.shape[1]), np.cumsum(np.where(missing, 0, values), axis=0)])
+    nans = np.vstack([np.zeros(values.shape[1], dtype=np.int64), np.cumsum(missing, axis=0)])
+    counts = rows + 1 - window_start
+    means = (sums[rows + 1] - sums[window_start]) / counts[:, None]
+    means[(nans[rows + 1] - nans[window_start]) > 0] = np.nan
+
+    return {
+        'days': days,
+        'means': means,
+        'counts': counts,
+        'spans': dict(zip(keys[starts].tolist(), zip(starts.tolist(), stops.tolist()))),
+    }
+
+
+# Build the feature store of a league frame
+def build(df, num_games=5, h2h_games=2):
+    home_ids = np.array(registry.ids(df['HomeTeam'].tolist()), dtype=np.int64)
+    away_ids = np.array(registry.ids(df['AwayTeam'].tolist()), dtype=np.int64)
+    positions = np.arange(len(df), dtype=np.int64)
+    days = df['Date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    home, away = match_values(df)
+
+    # The pair rows take the point of view of the team with the lower ID
+    home_lower = (home_ids < away_ids)[:, None]
+    return {
+        'overall': rolling(np.r_[home_ids, away_ids], np.r_[positions, positions], np.r_[days, days],
+                           np.vstack([home, away]), num_games),
+        'home': rolling(home_ids, positions, days, home, num_games),
+        'away': rolling(away_ids, positions, days, away, num_games),
+        'pair': rolling(np.minimum(home_ids, away_ids) * ID_BASE + np.maximum(home_ids, away_ids), positions, days,
+                        np.where(home_lower, home, away), h2h_games),
+        'fixture': rolling(home_ids * ID_BASE + away_ids, positions, days, home, h2h_games),
+    }
+
+
+# Get the feature store of a league's current data
+def get_store(data, num_games=5, h2h_games=2):
+    """
+    :param data: League data from `store.get_league`.
+    """
+    key = (data['league'], num_games, h2h_games)
+    with _lock:
+        features = _stores.get(key)
+        if features is None or features['version'] != data['version']:
+            with mt.span('feature_store'):
+                features = dict(build(data['df'], num_games, h2h_games), version=data['version'])
+            _stores[key] = features
+        _stores.move_to_end(key)
+        while len(_stores) > MAX_STORES:
+            _stores.popitem(last=False)
+    return features
+
+
+# Means of the last window of `key` before `day`
+def _lookup(table, key, day):
+    """
+    :param day: Days since the epoch; matches on that day are not counted.
+    :return: A dict stat -> mean, or None when `key` has no match before `day`.
+    """
+    start, stop = table['spans'].get(key, (0, 0))
+    row = start + int(np.searchsorted(table['days'][start:stop], day, side='left')) - 1
+    if row < start:
+        return None
+    return dict(zip(STATS, table['means'][row].tolist()))
+
+
+# Team stats dict in the format of predict.get_team_stats
+def _team_stats(means):
+    stats = {'results': {'Win': means['win'], 'Draw': means['draw'], 'Lose': means['lose']}}
+    for name in STATS[3:]:
+        stats[name] = [means[name]]
+    return stats
+
+
+# H2H stats dict in the format of predict.get_h2h_stats, from the home team's point of view
+def _h2h_stats(home_team, away_team, means):
+    if means is None:
+        return {'results': {}}
+    home_name, away_name = registry.slug(home_team), registry.slug(away_team)
+    stats = {
+        'results': {f"{home_team} Win": means['win'], 'Draw': means['draw'], f"{away_team} Win": means['lose']},
+        'goals': [means['goals']],
+        'btts': [means['btts']],
+        'corners': [means['corners']],
+        'cards': [means['cards']],
+    }
+    for name in ('goals', 'shots_on_target', 'corners', 'cards'):
+        stats[f"{home_name}_{name}"] = [means[f'{name}_for']]
+        stats[f"{away_name}_{name}"] = [means[f'{name}_against']]
+    return stats
+
+
+def _flipped(means):
+    if means is None:
+        return None
+    flipped = dict(means)
+    flipped['win'], flipped['lose'] = means['lose'], means['win']
+    for name in ('goals', 'shots_on_target', 'corners', 'cards'):
+        flipped[f'{name}_for'], flipped[f'{name}_against'] = means[f'{name}_against'], means[f'{name}_for']
+    return flipped
+
+
+# Pre-match stats of a fixture as they were before a date, in the format of predict.create_prematch_stats
+def prematch_stats(home_team, away_team, data, as_of, num_games=5, h2h_games=2):
+    """
+    :param as_of: Date (anything numpy.datetime64 takes); only matches played
+                  before that day are counted.
+    :raise KeyError: When a team has no matches, overall or at its venue, before `as_of`.
+    """
+    features = get_store(data, num_games, h2h_games)
+    day = int(np.datetime64(as_of, 'D').astype(np.int64))
+    home_id, away_id = registry.lookup(home_team), registry.lookup(away_team)
+
+    team_stats = []
+    for scope, team, team_id in (('overall', home_team, home_id), ('overall', away_team, away_id),
+                                 ('home', home_team, home_id), ('away', away_team, away_id)):
+        means = _lookup(features[scope], team_id, day)
+        if means is None:
+            raise KeyError(f"No {scope} matches of {team} before {as_of}")
+        team_stats.append(_team_stats(means))
+
+    h2h = _lookup(features['pair'], min(home_id, away_id) * ID_BASE + max(home_id, away_id), day)
+    if away_id < home_id:
+        h2h = _flipped(h2h)
+    fixture = _lookup(features['fixture'], home_id * ID_BASE + away_id, day)
+    return team_stats + [_h2h_stats(home_team, away_team, h2h), _h2h_stats(home_team, away_team, fixture)]
@@ -0,0 +1,49 @@
+"""
+gunicorn settings, read from the working directory: gunicorn app:app
+
+With PRELOAD_APP=1 (the default here) the master imports the app and loads every
+league before forking, so the workers share the data instead of each building its
+own copy. `kill -USR2 <master pid>` reloads the data in the master and every
+worker in place; it replaces gunicorn's binary upgrade on that signal.
+"""
+import os
+import signal
+
+os.environ.setdefault('PRELOAD_APP', '1')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = os.environ['PRELOAD_APP'] == '1'
+
+
+def when_ready(server):
+    if preload_app:
+        import preload
+
+        seconds = preload.load_all()
+        preload.freeze()
+        server.log.info(f"Preloaded the league data in {seconds:.2f}s")
+
+    def handle_usr2():
+        if preload_app:
+            server.log.info(f"Reloaded the league data in {preload.reload_master():.2f}s")
+        server.kill_workers(signal.SIGUSR2)
+
+    server.handle_usr2 = handle_usr2
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import preload
+        import refresh as rf
+
+        # The refresher thread of a preloaded app starts in the workers, not the master,
+        # and a worker that downloaded new data has every process reload it
+        rf.add_listener(preload.request_reload)
+        rf.start_refresher()
+
+
+def post_worker_init(worker):
+    import preload
+
+    preload.install_reload_handler()
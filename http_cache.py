@@ -0,0 +1,142 @@
+"""
+HTTP caching of the GET endpoints: strong ETags, Cache-Control and pre-compressed bodies.
+
+A response body is compressed once per data version and kept with its ETag, so
+revalidations are answered with 304 without scoring anything, and repeated
+requests are served from the stored gzip/brotli bytes. Team lists are encoded
+by the refresh listener, predictions the first time they are requested.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+import extract as ex
+import store
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content encodings of the stored bodies besides identity, in order of preference
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# Seconds browsers and shared caches may reuse a response without revalidating it
+MAX_AGE = int(os.environ.get('HTTP_MAX_AGE', 60))
+# Encoded prediction bodies kept in memory, least recently used dropped first
+MAX_BODIES = int(os.environ.get('HTTP_BODY_CACHE_SIZE', 4096))
+
+# League name -> (data version, bodies) of its team list
+_teams = {}
+# (league, home team, away team, version) -> bodies of a prediction response
+_bodies = OrderedDict()
+_lock = threading.Lock()
+
+
+# Compact JSON with sorted keys, so a payload always gives the same bytes
+def dumps(payload):
+    return json.dumps(payload, separators=(',', ':'), sort_keys=True)
+
+
+# Body of a response in every encoding we can serve
+def encode(payload):
+    """
+    :return: A dict encoding -> bytes, with 'identity' and every entry of ENCODINGS.
+             The bytes only depend on `payload`, so a strong ETag per encoding
+             stays valid across workers.
+    """
+    body = dumps(payload).encode()
+    bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        bodies['br'] = brotli.compress(body)
+    return bodies
+
+
+def _etag(version, encoding):
+    return f'"{version}"' if encoding == 'identity' else f'"{version}-{encoding}"'
+
+
+def _matches(if_none_match, version):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Any encoding of the same version is the same content
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return any(_etag(version, encoding) in tags for encoding in ('identity', 'gzip', 'br'))
+
+
+def _encoding(request):
+    return request.accept_encodings.best_match(ENCODINGS + ['identity'], default='identity')
+
+
+def _headers(version, encoding):
+    headers = {
+        'ETag': _etag(version, encoding),
+        'Cache-Control': f'public, max-age={MAX_AGE}',
+        'Vary': 'Accept-Encoding',
+    }
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return headers
+
+
+# 304 when the client already holds this version, else None
+def not_modified(request, version):
+    if _matches(request.headers.get('If-None-Match'), version):
+        return Response(status=304, headers=_headers(version, _encoding(request)))
+    return None
+
+
+# Response with the best encoding the client accepts
+def respond(request, version, bodies):
+    encoding = _encoding(request)
+    return Response(bodies[encoding], mimetype='application/json', headers=_headers(version, encoding))
+
+
+# Team list of a league, encoded once per data version
+def teams_bodies(league):
+    """
+    :return: (data version, bodies).
+    """
+    version = store.data_version(league)
+    cached = _teams.get(league)
+    if cached is None or cached[0] != version:
+        cached = _teams[league] = (version, encode({'teams': ex.get_teams(league)}))
+    return cached
+
+
+# Encoded body of a prediction response, built by `payload` on the first request
+def stats_bodies(key, payload):
+    """
+    :param key: Identifies the response, including the version in its ETag.
+    :param payload: Called without arguments when the body is not cached yet.
+    """
+    with _lock:
+        bodies = _bodies.get(key)
+        if bodies is not None:
+            _bodies.move_to_end(key)
+            return bodies
+    bodies = encode(payload())
+    with _lock:
+        _bodies[key] = bodies
+        while len(_bodies) > MAX_BODIES:
+            _bodies.popitem(last=False)
+    return bodies
+
+
+# Refresh listener encoding the team lists of the updated leagues, off the request path
+def on_refresh(codes):
+    for league, (code, _) in ex.league_codes.items():
+        if code in codes:
+            teams_bodies(league)
+
+
+def clear():
+    _teams.clear()
+    with _lock:
+        _bodies.clear()
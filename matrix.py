@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import extract as ex
+import predict as pr
+import refresh as rf
+import store
+
+# Rebuild the matrices after each data refresh
+ENABLED = os.environ.get('PREDICTION_MATRIX', '1') != '0'
+# Processes building the matrices in the `python matrix.py` build step
+WORKERS = int(os.environ.get('MATRIX_WORKERS', os.cpu_count() or 1))
+
+# League code -> {'mtime', 'artifact'} of the loaded prediction matrices
+_loaded = {}
+_lock = threading.Lock()
+
+
+def matrix_path(league):
+    return os.path.join(ex.resources_dir, 'predictions', f'{ex.league_codes[league][0]}.json')
+
+
+# Fingerprint of every team's matches, to find the teams that played since the last build
+def team_fingerprints(df, teams):
+    """
+    :return: A dict team -> hex digest of the sum of the row hashes of its matches.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    fingerprints = {}
+    for team in teams:
+        rows = row_hashes[((df['HomeTeam'] == team) | (df['AwayTeam'] == team)).to_numpy()]
+        fingerprints[team] = format(int(rows.sum(dtype=np.uint64)), 'x') + f'-{len(rows)}'
+    return fingerprints
+
+
+def read_matrix(league):
+    try:
+        with open(matrix_path(league)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Predict every ordered pair of teams of a league
+def build_league(league, previous=None):
+    """
+    Pairs whose two teams have the same match fingerprints as in `previous`
+    (built with the same weights) are copied from it, everything else is recomputed.
+
+    :param previous: The artifact of the last build, read from disk when not given.
+    :return: (artifact, number of recomputed pairs).
+    """
+    previous = read_matrix(league) if previous is None else previous
+    data = store.get_league(league)
+    teams = ex.get_teams(league)
+    fingerprints = team_fingerprints(data['df'], teams)
+
+    reusable = previous is not None and previous.get('weights') == pr.WEIGHTS_VERSION
+    unchanged = {team for team in teams if reusable and previous['teams'].get(team) == fingerprints[team]}
+
+    predictions, recomputed = {}, 0
+    for home_team in teams:
+        predictions[home_team] = {}
+        for away_team in teams:
+            if home_team == away_team:
+                continue
+            if home_team in unchanged and away_team in unchanged and away_team in previous['predictions'].get(home_team, {}):
+                predictions[home_team][away_team] = previous['predictions'][home_team][away_team]
+                continue
+            try:
+                predictions[home_team][away_team] = pr.predict_fixture(home_team, away_team, data)
+            except Exception:
+                # Stored as missing, get_stats then computes it and reports the error
+                predictions[home_team][away_team] = None
+            recomputed += 1
+
+    artifact = {
+        'version': pr.prediction_version(data),
+        'weights': pr.WEIGHTS_VERSION,
+        'built': time.time(),
+        'teams': fingerprints,
+        'predictions': predictions,
+    }
+    return artifact, recomputed
+
+
+# Build and write the prediction matrix of a league
+def write_league(league):
+    artifact, recomputed = build_league(league)
+    path = matrix_path(league)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rf.atomic_write(path, json.dumps(artifact, separators=(',', ':')).encode())
+    return recomputed
+
+
+# Build the prediction matrices of several leagues, optionally on a process pool
+def write_all(leagues=None, workers=1):
+    """
+    :return: A dict league -> number of recomputed pairs.
+    """
+    leagues = leagues or ex.leagues
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(leagues, pool.map(write_league, leagues)))
+    return {league: write_league(league) for league in leagues}
+
+
+# Refresh listener rebuilding the matrices of the updated leagues
+def on_refresh(codes):
+    """
+    Runs on the listener thread of a serving worker, so the leagues are built one
+    after the other in this process: forking it (refresher, service loop and request
+    threads) could deadlock on inherited locks, and a pool would take every core
+    from the requests. Only changed fixtures are recomputed (see build_league).
+    """
+    if not ENABLED:
+        return
+    leagues = [league for league, (code, _) in ex.league_codes.items() if code in codes]
+    for league, recomputed in write_all(leagues).items():
+        print(f"Prediction matrix of {league}: {recomputed} pairs recomputed")
+
+
+# Get the prediction matrix of a league, read again when its file changed
+def load(league):
+    code = ex.league_codes[league][0]
+    try:
+        mtime = os.stat(matrix_path(league)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    loaded = _loaded.get(code)
+    if loaded is None or loaded['mtime'] != mtime:
+        with _lock:
+            loaded = _loaded.get(code)
+            if loaded is None or loaded['mtime'] != mtime:
+                loaded = {'mtime': mtime, 'artifact': read_matrix(league)}
+                _loaded[code] = loaded
+    return loaded['artifact']
+
+
+# Look a fixture up in the prediction matrix of its league
+def lookup(league, home_team, away_team, version):
+    """
+    :param version: Current prediction version (predict.prediction_version), the
+                    lookup misses when the matrix was built from other data or weights.
+    :return: The predictions dict, or None.
+    """
+    artifact = load(league)
+    if artifact is None or artifact.get('version') != version:
+        return None
+    return artifact['predictions'].get(home_team, {}).get(away_team)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the predictions of every fixture of every league.')
+    parser.add_argument('--league', action='append', dest='leagues', choices=ex.leagues, help='League to build, repeatable (default: all)')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Build leagues on a process pool of this size')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for league, recomputed in write_all(args.leagues, args.workers).items():
+        print(f"{league}: {recomputed} pairs recomputed")
+    print(f"{time.perf_counter() - start:.2f}s")
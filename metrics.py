@@ -0,0 +1,159 @@
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter_ns
+
+# Record stage timings and counters, METRICS_ENABLED=0 turns every span into a no-op
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+PREFIX = 'football_'
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_BUCKETS_NS = [int(bound * 1e9) for bound in BUCKETS]
+
+# (stage, league) -> [count per bucket..., count over the last bucket, total ns, count]
+_histograms = {}
+# (name, sorted label items) -> value
+_counters = {}
+_lock = threading.Lock()
+# League of the work running on this thread, the default label of its spans
+_local = threading.local()
+
+
+# Add one duration to the histogram of a stage
+def observe(stage, duration_ns, league=None):
+    if league is None:
+        league = getattr(_local, 'league', '')
+    bucket = bisect_left(_BUCKETS_NS, duration_ns)
+    key = (stage, league)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        histogram[bucket] += 1
+        histogram[-2] += duration_ns
+        histogram[-1] += 1
+
+
+class _Span:
+    __slots__ = ('stage', 'league', 'start')
+
+    def __init__(self, stage, league):
+        self.stage = stage
+        self.league = league
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, perf_counter_ns() - self.start, self.league)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+# Time the body of a with statement into the histogram of a stage
+def span(stage, league=None):
+    """
+    :param stage: Stage name, e.g. 'csv_parse' or 'aggregate'.
+    :param league: League label, by default the one set with `league_context` on this thread.
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(stage, league)
+
+
+class _LeagueContext:
+    __slots__ = ('league', 'previous')
+
+    def __init__(self, league):
+        self.league = league
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'league', '')
+        _local.league = self.league
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.league = self.previous
+
+
+# Label the spans of the body of a with statement with a league
+def league_context(league):
+    if not ENABLED:
+        return _NO_SPAN
+    return _LeagueContext(league)
+
+
+# Increment a counter, e.g. count('errors_total', type='KeyError')
+def count(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(items):
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+
+# All metrics in the Prometheus text exposition format
+def render(gauges=()):
+    """
+    :param gauges: Extra (name, type, help, value) samples read at scrape time,
+                   e.g. the prediction cache counters.
+    :return: The text body of the /metrics endpoint.
+    """
+    with _lock:
+        histograms = {key: list(histogram) for key, histogram in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    name = PREFIX + 'stage_seconds'
+    lines.append(f'# HELP {name} Time spent in each stage of loading data and scoring predictions.')
+    lines.append(f'# TYPE {name} histogram')
+    for (stage, league), histogram in sorted(histograms.items()):
+        labels = [('stage', stage), ('league', league)]
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, histogram):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_labels(labels + [("le", repr(bound))])} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels + [("le", "+Inf")])} {histogram[-1]}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram[-2] / 1e9}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram[-1]}')
+
+    for counter in sorted({key[0] for key in counters}):
+        lines.append(f'# TYPE {PREFIX}{counter} counter')
+        for (name, labels), value in sorted(counters.items()):
+            if name == counter:
+                lines.append(f'{PREFIX}{name}{_labels(labels)} {value}')
+
+    for name, kind, description, value in gauges:
+        lines.append(f'# HELP {PREFIX}{name} {description}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        lines.append(f'{PREFIX}{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
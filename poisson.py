@@ -0,0 +1,221 @@
+"""
+Dixon-Coles goal model, the 'poisson' prediction engine.
+
+Home goals are Poisson with rate exp(intercept + home + attack[home] + defence[away]),
+away goals with rate exp(intercept + attack[away] + defence[home]), and the four
+low scores are corrected by the Dixon-Coles dependence parameter rho. Matches are
+weighted by exp(-DECAY * days before the league's latest match).
+
+Win, draw, BTTS, over 2.5 and expected goals all come from one scoreline
+probability matrix, so they cannot contradict each other. Shots on target,
+corners and cards still come from the form engine in predict.py.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+import extract as ex
+import metrics as mt
+import predict as pr
+import store
+
+# Weight decay per day of age of a match, 0.0019 halves the weight in about a year
+DECAY = float(os.environ.get('POISSON_DECAY', 0.0019))
+# Scorelines up to this many goals per team are in the probability matrix
+MAX_GOALS = 10
+# Keeps the attack and defence parameters centred on zero
+CENTRING_PENALTY = 100.0
+RHO_BOUNDS = (-0.2, 0.2)
+
+# League name -> fitted model of its latest data version
+_models = {}
+_lock = threading.Lock()
+
+
+def _match_arrays(df):
+    df = df.dropna(subset=['FTHG', 'FTAG'])
+    teams = sorted(set(df['HomeTeam'].tolist()) | set(df['AwayTeam'].tolist()))
+    positions = {team: i for i, team in enumerate(teams)}
+    home = np.array([positions[team] for team in df['HomeTeam'].tolist()], dtype=np.int64)
+    away = np.array([positions[team] for team in df['AwayTeam'].tolist()], dtype=np.int64)
+    dates = df['Date'].to_numpy()
+    age_days = (dates.max() - dates) / np.timedelta64(1, 'D')
+    weights = np.exp(-DECAY * age_days.astype(float))
+    return teams, home, away, df['FTHG'].to_numpy(dtype=float), df['FTAG'].to_numpy(dtype=float), weights
+
+
+# Weighted negative log-likelihood of the independent Poisson part, and its gradient
+def _poisson_loss(params, home, away, home_goals, away_goals, weights, num_teams):
+    attack, defence = params[:num_teams], params[num_teams:2 * num_teams]
+    intercept, home_advantage = params[-2], params[-1]
+    home_log_rate = intercept + home_advantage + attack[home] + defence[away]
+    away_log_rate = intercept + attack[away] + defence[home]
+    home_rate, away_rate = np.exp(home_log_rate), np.exp(away_log_rate)
+
+    loss = np.sum(weights * (home_rate - home_goals * home_log_rate + away_rate - away_goals * away_log_rate))
+    loss += CENTRING_PENALTY * (attack.sum() ** 2 + defence.sum() ** 2)
+
+    # Derivatives with respect to the log rates, summed into the team parameters
+    home_residual = weights * (home_rate - home_goals)
+    away_residual = weights * (away_rate - away_goals)
+    gradient = np.empty_like(params)
+    gradient[:num_teams] = (np.bincount(home, home_residual, num_teams) + np.bincount(away, away_residual, num_teams)
+                            + 2 * CENTRING_PENALTY * attack.sum())
+    gradient[num_teams:2 * num_teams] = (np.bincount(away, home_residual, num_teams) + np.bincount(home, away_residual, num_teams)
+                                         + 2 * CENTRING_PENALTY * defence.sum())
+    gradient[-2] = home_residual.sum() + away_residual.sum()
+    gradient[-1] = home_residual.sum()
+    return loss, gradient
+
+
+def _tau(home_goals, away_goals, home_rate, away_rate, rho):
+    tau = np.ones_like(home_rate)
+    tau = np.where((home_goals == 0) & (away_goals == 0), 1 - home_rate * away_rate * rho, tau)
+    tau = np.where((home_goals == 0) & (away_goals == 1), 1 + home_rate * rho, tau)
+    tau = np.where((home_goals == 1) & (away_goals == 0), 1 + away_rate * rho, tau)
+    return np.where((home_goals == 1) & (away_goals == 1), 1 - rho, tau)
+
+
+# Fit the model to a league frame
+def fit(df, previous=None):
+    """
+    :param df: A league frame from the store.
+    :param previous: A model fitted to earlier data of the league, its parameters
+                     are the starting point so a refit after new results takes a few
+                     iterations.
+    :return: The model dict, used by `scoreline_matrix`.
+    """
+    from scipy.optimize import minimize, minimize_scalar
+
+    start = time.perf_counter()
+    teams, home, away, home_goals, away_goals, weights = _match_arrays(df)
+    num_teams = len(teams)
+
+    params = np.zeros(2 * num_teams + 2)
+    params[-2] = np.log(max(away_goals.mean(), 0.1))
+    params[-1] = 0.2
+    if previous is not None:
+        for i, team in enumerate(teams):
+            position = previous['teams'].get(team)
+            if position is not None:
+                params[i] = previous['attack'][position]
+                params[num_teams + i] = previous['defence'][position]
+        params[-2], params[-1] = previous['intercept'], previous['home']
+
+    result = minimize(_poisson_loss, params, args=(home, away, home_goals, away_goals, weights, num_teams),
+                      jac=True, method='L-BFGS-B')
+    params = result.x
+    attack, defence = params[:num_teams], params[num_teams:2 * num_teams]
+    intercept, home_advantage = params[-2], params[-1]
+
+    # Dependence of the low scores, fitted with the rates held fixed
+    home_rate = np.exp(intercept + home_advantage + attack[home] + defence[away])
+    away_rate = np.exp(intercept + attack[away] + defence[home])
+    low = (home_goals <= 1) & (away_goals <= 1)
+
+    def rho_loss(rho):
+        tau = _tau(home_goals[low], away_goals[low], home_rate[low], away_rate[low], rho)
+        return np.inf if np.any(tau <= 0) else -np.sum(weights[low] * np.log(tau))
+
+    rho = minimize_scalar(rho_loss, bounds=RHO_BOUNDS, method='bounded').x
+
+    return {
+        'teams': {team: i for i, team in enumerate(teams)},
+        'attack': attack,
+        'defence': defence,
+        'intercept': float(intercept),
+        'home': float(home_advantage),
+        'rho': float(rho),
+        'iterations': int(result.nit),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+# Get the model of a league's current data, refitting it when the data changed
+def get_model(league, data):
+    """
+    :param data: League data from `store.get_league`.
+    """
+    model = _models.get(league)
+    if model is not None and model['version'] == data['version']:
+        return model
+    with _lock:
+        model = _models.get(league)
+        if model is None or model['version'] != data['version']:
+            with mt.span('poisson_fit', league):
+                model = dict(fit(data['df'], previous=model), version=data['version'])
+            _models[league] = model
+    return model
+
+
+# Refresh listener refitting the models of the updated leagues, off the request path
+def on_refresh(codes):
+    for league, (code, _) in ex.league_codes.items():
+        if code in codes:
+            get_model(league, store.get_league(league))
+
+
+# Probability of every scoreline up to MAX_GOALS goals per team
+def scoreline_matrix(model, home_team, away_team):
+    """
+    :return: A (MAX_GOALS + 1) x (MAX_GOALS + 1) array, rows are home goals and
+             columns away goals, summing to 1.
+    """
+    home, away = model['teams'][home_team], model['teams'][away_team]
+    home_rate = np.exp(model['intercept'] + model['home'] + model['attack'][home] + model['defence'][away])
+    away_rate = np.exp(model['intercept'] + model['attack'][away] + model['defence'][home])
+
+    goals = np.arange(MAX_GOALS + 1)
+    log_factorials = np.cumsum(np.log(np.maximum(goals, 1)))
+    home_pmf = np.exp(goals * np.log(home_rate) - home_rate - log_factorials)
+    away_pmf = np.exp(goals * np.log(away_rate) - away_rate - log_factorials)
+    matrix = np.outer(home_pmf, away_pmf)
+    rows, columns = np.indices(matrix.shape)
+    matrix *= _tau(rows, columns, home_rate, away_rate, model['rho'])
+    return matrix / matrix.sum()
+
+
+# Markets of one scoreline matrix
+def markets(matrix):
+    """
+    :return: A dict of probabilities (0-1) and expected goals.
+    """
+    rows, columns = np.indices(matrix.shape)
+    return {
+        'home_win': float(matrix[rows > columns].sum()),
+        'draw': float(np.trace(matrix)),
+        'away_win': float(matrix[rows < columns].sum()),
+        'btts': float(matrix[1:, 1:].sum()),
+        'over_2_5': float(matrix[rows + columns > 2].sum()),
+        'home_goals': float((matrix.sum(axis=1) * rows[:, 0]).sum()),
+        'away_goals': float((matrix.sum(axis=0) * columns[0]).sum()),
+    }
+
+
+# Predict one fixture, in the format of predict.aggregate_team_specific_predictions
+def predict_fixture(league, home_team, away_team, data, windows=None):
+    """
+    :param data: League data from `store.get_league`.
+    :param windows: Form windows of the non-goal stats, see predict.parse_windows.
+    :return: The predictions dict of the form engine with every goal market taken from
+             the scoreline matrix, plus `over_2_5_prob`.
+    """
+    model = get_model(league, data)
+    goal_markets = markets(scoreline_matrix(model, home_team, away_team))
+
+    predictions = pr.predict_fixture(home_team, away_team, data, windows)
+    home_team_stats = dict(predictions['home_team_stats'], expected_goals=goal_markets['home_goals'])
+    away_team_stats = dict(predictions['away_team_stats'], expected_goals=goal_markets['away_goals'])
+    return dict(
+        predictions,
+        home_win_prob=goal_markets['home_win'] * 100,
+        away_win_prob=goal_markets['away_win'] * 100,
+        draw_prob=goal_markets['draw'] * 100,
+        btts_prob=goal_markets['btts'] * 100,
+        over_2_5_prob=goal_markets['over_2_5'] * 100,
+        expected_total_goals=goal_markets['home_goals'] + goal_markets['away_goals'],
+        home_team_stats=home_team_stats,
+        away_team_stats=away_team_stats,
+    )
@@ -1,13 +1,91 @@
-import pandas as pd
-import numpy as np
-import numpy as np
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import math
-import requests
+import datetime
+import hashlib
+import json
 import os
 
+import numpy as np
+import pandas as pd
+
+import cache
+import decay
+import features
+import matrix as mx
+import metrics as mt
+import poisson
+import registry
+import singleflight as sf
+import store
+import team_index as ti
+
+SAME_TEAMS_ERROR = "Home and Away teams must be different!"
+NOT_ENOUGH_DATA_ERROR = "Not enough data to make a prediction for recently promoted team(s)!"
+# 'form' weighs recent results (this module), 'poisson' fits a goal model (poisson.py)
+ENGINES = ['form', 'poisson']
+# Last games of each team and H2H games the form is computed from; with a half-life
+# (days, one of decay.HALF_LIVES) the team form covers every match, weighted by age;
+# with an `as_of` date (YYYY-MM-DD) it is the form before that day (see features.py)
+DEFAULT_WINDOWS = {'num_games': 5, 'h2h_games': 2, 'half_life': None, 'as_of': None}
+MAX_NUM_GAMES = 38
+MAX_H2H_GAMES = 10
+INVALID_WINDOWS_ERROR = (f"num_games must be 1-{MAX_NUM_GAMES}, h2h_games 1-{MAX_H2H_GAMES} "
+                         f"and half_life one of {', '.join(map(str, decay.HALF_LIVES))} days!")
+INVALID_AS_OF_ERROR = "as_of must be a date (YYYY-MM-DD), with the form engine and without half_life!"
+
+# Weights of each stat type in aggregate_team_specific_predictions,
+# overridden by the file written by tune.py when it exists
+WEIGHTS_FILE = os.environ.get('PREDICT_WEIGHTS', 'weights.json')
+DEFAULT_WEIGHTS = {
+    'base': {
+        'home_away_form': 0.25,
+        'overall_form': 0.20,
+        'opposition_form': 0.20,
+        'h2h': 0.15,
+        'home_away_h2h': 0.20
+    },
+    'draw': {
+        'home_away_form': 0.30,
+        'overall_form': 0.35,
+        'h2h': 0.15,
+        'home_away_h2h': 0.20
+    },
+    'btts': {
+        'home_away_form': 0.40,  # Increased from 0.20 each
+        'overall_form': 0.30,    # Increased from 0.15 each
+        'h2h': 0.15,
+        'home_away_h2h': 0.15
+    },
+    'team_stats': {
+        'home_away_form': 0.30,
+        'overall_form': 0.25,
+        'h2h': 0.20,
+        'home_away_h2h': 0.25
+    },
+    'total_goals': {
+        'home_away_form': 0.25,
+        'overall_form': 0.25,
+        'h2h': 0.20,
+        'home_away_h2h': 0.30
+    },
+}
+
+
+# Load the weights file, falling back to the defaults for anything it does not set
+def load_weights(path=WEIGHTS_FILE):
+    weights = {group: dict(values) for group, values in DEFAULT_WEIGHTS.items()}
+    if path and os.path.exists(path):
+        with open(path) as file:
+            tuned = json.load(file)
+        for group, values in weights.items():
+            for key in values:
+                if key in tuned.get(group, {}):
+                    values[key] = float(tuned[group][key])
+    return weights
+
+
+WEIGHTS = load_weights()
+# Part of the prediction cache keys, so predictions made with other weights are not reused
+WEIGHTS_VERSION = hashlib.sha1(json.dumps(WEIGHTS, sort_keys=True).encode()).hexdigest()[:8]
+
 # Get last 5 games
 def get_latest_games(team, trimmed_df, num_games=5):
     # Filter matches where the team is either home or away
@@ -96,6 +174,23 @@ def get_last_2_h2h_home_or_away_games(team1, team2, trimmed_df):
     return last_2_h2h_games
 
 
+# Columns of a set of games as arrays, shared by the stat extractors below
+def _game_columns(games):
+    return {
+        'HomeTeam': games['HomeTeam'].to_numpy(),
+        'AwayTeam': games['AwayTeam'].to_numpy(),
+        'FTR': games['FTR'].to_numpy(),
+        'FTHG': games['FTHG'].to_numpy(),
+        'FTAG': games['FTAG'].to_numpy(),
+        'HST': games['HST'].to_numpy(),
+        'AST': games['AST'].to_numpy(),
+        'HC': games['HC'].to_numpy(),
+        'AC': games['AC'].to_numpy(),
+        'HCards': (games['HY'] + games['HR']).to_numpy(),
+        'ACards': (games['AY'] + games['AR']).to_numpy(),
+    }
+
+
 # Function to calculate the last 5 match statistics for a given team.
 def get_team_stats(team, latest_5_games):
     """
@@ -106,73 +201,33 @@ def get_team_stats(team, latest_5_games):
     Returns:
     - dict: A dictionary with calculated statistics for the team.
     """
-    results = [
-        "Win" if (row['HomeTeam'] == team and row['FTR'] == 'H') or 
-                 (row['AwayTeam'] == team and row['FTR'] == 'A') 
-        else "Lose" if (row['HomeTeam'] == team and row['FTR'] == 'A') or 
-                      (row['AwayTeam'] == team and row['FTR'] == 'H') 
-        else "Draw"
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    goals_for = [
-        row['FTHG'] if (row['HomeTeam'] == team) 
-        else row['FTAG']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    goals_against = [
-        row['FTAG'] if (row['HomeTeam'] == team) 
-        else row['FTHG']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
+    games = _game_columns(latest_5_games)
+    is_home = games['HomeTeam'] == team
+    is_away = games['AwayTeam'] == team
+    home_won = games['FTR'] == 'H'
+    away_won = games['FTR'] == 'A'
+
+    results = np.select(
+        [(is_home & home_won) | (is_away & away_won), (is_home & away_won) | (is_away & home_won)],
+        ["Win", "Lose"],
+        "Draw"
+    ).tolist()
+
+    goals_for = np.where(is_home, games['FTHG'], games['FTAG']).tolist()
+    goals_against = np.where(is_home, games['FTAG'], games['FTHG']).tolist()
     goals = list(np.add(goals_for, goals_against))
-    
-    btts = [
-        1 if (row['FTHG'] > 0 and row['FTAG'] > 0)
-        else 0
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    shots_on_target_for = [
-        row['HST'] if (row['HomeTeam'] == team) 
-        else row['AST']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    shots_on_target_against = [
-        row['AST'] if (row['HomeTeam'] == team) 
-        else row['HST']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    corners_for = [
-        row['HC'] if (row['HomeTeam'] == team) 
-        else row['AC']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    corners_against = [
-        row['AC'] if (row['HomeTeam'] == team) 
-        else row['HC']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
+
+    btts = ((games['FTHG'] > 0) & (games['FTAG'] > 0)).astype(int).tolist()
+
+    shots_on_target_for = np.where(is_home, games['HST'], games['AST']).tolist()
+    shots_on_target_against = np.where(is_home, games['AST'], games['HST']).tolist()
+
+    corners_for = np.where(is_home, games['HC'], games['AC']).tolist()
+    corners_against = np.where(is_home, games['AC'], games['HC']).tolist()
     corners = list(np.add(corners_for, corners_against))
-    
-    cards_for = [
-        row['HY'] + row['HR'] if (row['HomeTeam'] == team) 
-        else row['AY'] + row['AR']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
-    cards_against = [
-        row['AY'] + row['AR'] if (row['HomeTeam'] == team) 
-        else row['HY'] + row['HR']
-        for _, row in latest_5_games.iterrows()
-    ]
-    
+
+    cards_for = np.where(is_home, games['HCards'], games['ACards']).tolist()
+    cards_against = np.where(is_home, games['ACards'], games['HCards']).tolist()
     cards = list(np.add(cards_for, cards_against))
 
     # Returning the dictionary of stats
@@ -205,78 +260,39 @@ def get_h2h_stats(home_team, away_team, latest_games):
     Returns:
     - dict: A dictionary with calculated statistics for the team.
     """
-    results = [
-        home_team + " Win" if (row['HomeTeam'] == home_team and row['FTR'] == 'H') or 
-                 (row['AwayTeam'] == home_team and row['FTR'] == 'A') 
-        else away_team + " Win" if (row['HomeTeam'] == home_team and row['FTR'] == 'A') or 
-                      (row['AwayTeam'] == home_team and row['FTR'] == 'H') 
-        else "Draw"
-        for _, row in latest_games.iterrows()
-    ]
-    
-    home_goals = [
-        row['FTHG'] if (row['HomeTeam'] == home_team) 
-        else row['FTAG']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    away_goals = [
-        row['FTHG'] if (row['HomeTeam'] == away_team) 
-        else row['FTAG']
-        for _, row in latest_games.iterrows()
-    ]
-    
+    games = _game_columns(latest_games)
+    home_at_home = games['HomeTeam'] == home_team
+    home_away = games['AwayTeam'] == home_team
+    away_at_home = games['HomeTeam'] == away_team
+    home_won = games['FTR'] == 'H'
+    away_won = games['FTR'] == 'A'
+
+    results = np.select(
+        [(home_at_home & home_won) | (home_away & away_won), (home_at_home & away_won) | (home_away & home_won)],
+        [home_team + " Win", away_team + " Win"],
+        "Draw"
+    ).tolist()
+
+    home_goals = np.where(home_at_home, games['FTHG'], games['FTAG']).tolist()
+    away_goals = np.where(away_at_home, games['FTHG'], games['FTAG']).tolist()
     goals = list(np.add(home_goals, away_goals))
-    
-    btts = [
-        1 if (row['FTHG'] > 0 and row['FTAG'] > 0)
-        else 0
-        for _, row in latest_games.iterrows()
-    ]
-    
-    shots_on_target_for = [
-        row['HST'] if (row['HomeTeam'] == home_team) 
-        else row['AST']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    shots_on_target_against = [
-        row['HST'] if (row['HomeTeam'] == away_team) 
-        else row['AST']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    corners_for = [
-        row['HC'] if (row['HomeTeam'] == home_team) 
-        else row['AC']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    corners_against = [
-        row['HC'] if (row['HomeTeam'] == away_team) 
-        else row['AC']
-        for _, row in latest_games.iterrows()
-    ]
-    
+
+    btts = ((games['FTHG'] > 0) & (games['FTAG'] > 0)).astype(int).tolist()
+
+    shots_on_target_for = np.where(home_at_home, games['HST'], games['AST']).tolist()
+    shots_on_target_against = np.where(away_at_home, games['HST'], games['AST']).tolist()
+
+    corners_for = np.where(home_at_home, games['HC'], games['AC']).tolist()
+    corners_against = np.where(away_at_home, games['HC'], games['AC']).tolist()
     corners = list(np.add(corners_for, corners_against))
-    
-    cards_for = [
-        row['HY'] + row['HR'] if (row['HomeTeam'] == home_team) 
-        else row['AY'] + row['AR']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    cards_against = [
-        row['HY'] + row['HR'] if (row['HomeTeam'] == away_team) 
-        else row['AY'] + row['AR']
-        for _, row in latest_games.iterrows()
-    ]
-    
+
+    cards_for = np.where(home_at_home, games['HCards'], games['ACards']).tolist()
+    cards_against = np.where(away_at_home, games['HCards'], games['ACards']).tolist()
     cards = list(np.add(cards_for, cards_against))
 
     # Returning the dictionary of stats
-    home_team_name = home_team.lower().replace(' ', '_')
-    away_team_name = away_team.lower().replace(' ', '_')
+    home_team_name = registry.slug(home_team)
+    away_team_name = registry.slug(away_team)
     h2h_stats = {
         "results": results,
         f"{home_team_name}_goals": home_goals,
@@ -306,68 +322,34 @@ def get_h2h_home_or_away_stats(home_team, away_team, latest_games):
     Returns:
     - dict: A dictionary with calculated statistics for the team.
     """
-    results = [
-        home_team + " Win" if (row['FTR'] == 'H')
-        else away_team + " Win" if (row['FTR'] == 'A')
-        else "Draw"
-        for _, row in latest_games.iterrows()
-    ]
-    
-    home_goals = [
-        row['FTHG']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    away_goals = [
-        row['FTAG']
-        for _, row in latest_games.iterrows()
-    ]
-    
+    games = _game_columns(latest_games)
+
+    results = np.select(
+        [games['FTR'] == 'H', games['FTR'] == 'A'],
+        [home_team + " Win", away_team + " Win"],
+        "Draw"
+    ).tolist()
+
+    home_goals = games['FTHG'].tolist()
+    away_goals = games['FTAG'].tolist()
     goals = list(np.add(home_goals, away_goals))
-    
-    btts = [
-        1 if (row['FTHG'] > 0 and row['FTAG'] > 0)
-        else 0
-        for _, row in latest_games.iterrows()
-    ]
-    
-    shots_on_target_for = [
-        row['HST']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    shots_on_target_against = [
-        row['AST']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    corners_for = [
-        row['HC']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    corners_against = [
-        row['AC']
-        for _, row in latest_games.iterrows()
-    ]
-    
+
+    btts = ((games['FTHG'] > 0) & (games['FTAG'] > 0)).astype(int).tolist()
+
+    shots_on_target_for = games['HST'].tolist()
+    shots_on_target_against = games['AST'].tolist()
+
+    corners_for = games['HC'].tolist()
+    corners_against = games['AC'].tolist()
     corners = list(np.add(corners_for, corners_against))
-    
-    cards_for = [
-        row['HY'] + row['HR']
-        for _, row in latest_games.iterrows()
-    ]
-    
-    cards_against = [
-        row['AY'] + row['AR']
-        for _, row in latest_games.iterrows()
-    ]
-    
+
+    cards_for = games['HCards'].tolist()
+    cards_against = games['ACards'].tolist()
     cards = list(np.add(cards_for, cards_against))
 
     # Returning the dictionary of stats
-    home_team_name = home_team.lower().replace(' ', '_')
-    away_team_name = away_team.lower().replace(' ', '_')
+    home_team_name = registry.slug(home_team)
+    away_team_name = registry.slug(away_team)
     h2h_stats = {
         "results": results,
         f"{home_team_name}_goals": home_goals,
@@ -388,7 +370,19 @@ def get_h2h_home_or_away_stats(home_team, away_team, latest_games):
 
 
 # Function to create pre-match stats dataset
-def create_prematch_stats(home_team, away_team, df):
+def create_prematch_stats(home_team, away_team, df, index=None, num_games=5, h2h_games=2, league=None):
+    """
+    :param index: Optional lookup index of `df` (see team_index.py). When given the
+                  last-N and H2H games are sliced from it instead of filtering `df`.
+    :param num_games: Size of the last games windows.
+    :param h2h_games: Size of the H2H windows.
+    :param league: League of `df`, with an index; a team with fewer than `num_games`
+                   games in it is topped up with its games in the other leagues.
+    """
+    if index is None and (num_games, h2h_games) != (5, 2):
+        index = ti.build_index(df)
+    if index is not None:
+        return create_prematch_stats_indexed(home_team, away_team, df, index, num_games, h2h_games, league)
 
     # home team last 5 games
     home_latest_5_games = get_latest_games(home_team, df, num_games=5)
@@ -417,44 +411,223 @@ def create_prematch_stats(home_team, away_team, df):
     return list((home_team_stats, away_team_stats, home_team_home_stats, away_team_away_stats, h2h_stats, h2h_home_or_away_stats))
 
 
-# Main
-def get_stats(league, home_team, away_team):
+# Same as create_prematch_stats, using the precomputed lookup index of the league
+def create_prematch_stats_indexed(home_team, away_team, df, index, num_games=5, h2h_games=2, league=None):
+    home_id, away_id = registry.lookup(home_team), registry.lookup(away_team)
+    with mt.span('home_team_stats'):
+        home_team_stats = get_team_stats(home_team, _latest_games(league, index, df, home_id, num_games))
+    with mt.span('away_team_stats'):
+        away_team_stats = get_team_stats(away_team, _latest_games(league, index, df, away_id, num_games))
+    with mt.span('home_team_home_stats'):
+        home_team_home_stats = get_team_stats(home_team, _latest_games(league, index, df, home_id, num_games, location='home'))
+    with mt.span('away_team_away_stats'):
+        away_team_away_stats = get_team_stats(away_team, _latest_games(league, index, df, away_id, num_games, location='away'))
+    h2h_stats, h2h_home_or_away_stats = _h2h_prematch_stats(home_team, away_team, df, index, h2h_games)
 
-    leagues = {"English Premier League": ['E0', 'epl'], "Scottish Premier League": ['SC0', 'spl'], "Serie A": ['I1', 'sa'], "Bundesliga": ['D1', 'bdl'], "LaLiga": ['SP1', 'llg'], "Ligue 1": ['F1', 'l1'], "Championship": ['E1', 'c']}
+    return list((home_team_stats, away_team_stats, home_team_home_stats, away_team_away_stats, h2h_stats, h2h_home_or_away_stats))
 
-    # URL of the CSV file
-    url = f'https://www.football-data.co.uk/mmz4281/2425/{leagues[league][0]}.csv'
 
-    # Send a GET request to the URL
-    response = requests.get(url)
+# Last games of a team by ID, topped up with its games in other leagues (e.g. before
+# its promotion) when it plays in this league and has fewer than `num_games` in it
+def _latest_games(league, index, df, team_id, num_games, location=None):
+    games = ti.latest_games(index, df, team_id, num_games=num_games, location=location)
+    if league is None or team_id is None or len(games) >= num_games:
+        return games
 
-    # Check if the request was successful (status code 200)
-    if response.status_code == 200:
-        # Open a file in write-binary mode and save the content
-        with open(os.path.join('resources', f'{leagues[league][0]}.csv'), 'wb') as file:
-            file.write(response.content)
-    else:
-        print(f"Failed to retrieve the file. Status code: {response.status_code}")
+    frames = [games] if len(games) else []
+    for other in _top_up_leagues(league, team_id):
+        data = store.get_league(other)
+        other_games = ti.latest_games(data['index'], data['df'], team_id, num_games=num_games, location=location)
+        if len(other_games):
+            frames.append(other_games)
+    if len(frames) <= 1:
+        return frames[0] if frames else games
+    return pd.concat(frames, ignore_index=True).sort_values(by='Date', ascending=False, kind='stable').head(num_games)
+
+
+# Other leagues a team of a league's current season is topped up from
+def _top_up_leagues(league, team_id):
+    if registry.name(team_id) not in store.league_teams(league):
+        return []
+    return [other for other in store.leagues_of_team(team_id) if other != league]
+
+
+# Part of the version of predictions whose form is topped up from other leagues, so
+# they change with the data of those leagues too; '' when no team is topped up
+def top_up_version(data, teams, windows=None):
+    """
+    :param teams: Team names of the predictions, e.g. the two teams of a fixture.
+    """
+    windows = windows or DEFAULT_WINDOWS
+    if windows['as_of'] or windows['half_life']:
+        return ''
+    versions = set()
+    for team in teams:
+        team_id = registry.lookup(registry.canonical(team))
+        if team_id is None:
+            continue
+        # Cheap check first, the current teams of the league are only needed for short histories
+        counts = [len(data['index'][scope].get(team_id, ())) for scope in ('team', 'home', 'away')]
+        if min(counts) >= windows['num_games']:
+            continue
+        versions.update((other, store.data_version(other)) for other in _top_up_leagues(data['league'], team_id))
+    if not versions:
+        return ''
+    return '-t' + hashlib.sha1(repr(sorted(versions)).encode()).hexdigest()[:8]
+
+
+def _h2h_prematch_stats(home_team, away_team, df, index, h2h_games):
+    home_id, away_id = registry.lookup(home_team), registry.lookup(away_team)
+    with mt.span('h2h_stats'):
+        h2h_stats = get_h2h_stats(home_team, away_team, ti.latest_h2h_games(index, df, home_id, away_id, num_games=h2h_games))
+    with mt.span('h2h_home_or_away_stats'):
+        h2h_home_or_away_stats = get_h2h_home_or_away_stats(
+            home_team, away_team, ti.latest_fixture_games(index, df, home_id, away_id, num_games=h2h_games))
+    return h2h_stats, h2h_home_or_away_stats
+
+
+# Same as create_prematch_stats with the team form decayed over every match (see decay.py)
+def create_prematch_stats_decayed(home_team, away_team, data, half_life, h2h_games=2):
+    with mt.span('decayed_stats'):
+        home_team_stats = decay.team_stats(data, home_team, half_life)
+        away_team_stats = decay.team_stats(data, away_team, half_life)
+        home_team_home_stats = decay.team_stats(data, home_team, half_life, scope='home')
+        away_team_away_stats = decay.team_stats(data, away_team, half_life, scope='away')
+    h2h_stats, h2h_home_or_away_stats = _h2h_prematch_stats(home_team, away_team, data['df'], data['index'], h2h_games)
+
+    return list((home_team_stats, away_team_stats, home_team_home_stats, away_team_away_stats, h2h_stats, h2h_home_or_away_stats))
+
+
+# Same as create_prematch_stats with the form as it was before the `as_of` date (see features.py)
+def create_prematch_stats_as_of(home_team, away_team, data, as_of, num_games=5, h2h_games=2):
+    with mt.span('as_of_stats'):
+        return features.prematch_stats(home_team, away_team, data, as_of, num_games, h2h_games)
 
-    # Read old csv file
-    df = pd.read_csv(os.path.join('resources', f'{leagues[league][1]}.csv'))
-    # Find the index of the column 'DB'
-    col_index = df.columns.get_loc('AR')
-    # Trim the DataFrame to include columns up to 'DB'
-    trimmed_df = df.iloc[:, :col_index + 1]
 
-    # Read new csv file
-    new_df = pd.read_csv(os.path.join('resources', f'{leagues[league][0]}.csv'))
-    # Trim the DataFrame to include columns up to 'DB'
-    trimmed_new_df = new_df.iloc[:, :col_index + 1]
+# Version of the predictions made from a league's data with the loaded weights
+def prediction_version(data):
+    return f"{data['version']}-{WEIGHTS_VERSION}"
+
+
+# Version of the predictions of one engine and set of windows, changes with the league data
+def fixture_version(data, engine='form', windows=None, teams=()):
+    """
+    :param teams: Teams of the predictions, their versions change with the data of the
+                  leagues their form is topped up from (see top_up_version).
+    """
+    return prediction_version(data) + fixture_variant(engine, windows) + top_up_version(data, teams, windows)
+
+
+# What a prediction depends on besides the league data, '' for the default form predictions
+def fixture_variant(engine='form', windows=None):
+    return ('' if engine == 'form' else f"-{engine}") + _windows_suffix(windows)
+
+
+# Validate the windows of a request
+def parse_windows(params, engine='form'):
+    """
+    :param params: Request parameters, any of `num_games`, `h2h_games`, `half_life` and `as_of`.
+    :param engine: Engine of the request; the goal model of the others is fitted on
+                   every match, so they cannot predict as of a past date.
+    :return: A complete windows dict, see DEFAULT_WINDOWS.
+    :raise ValueError: With the error message of the request, when a window is not a
+                       number or out of range, or `as_of` is not a date or not supported.
+    """
+    windows = dict(DEFAULT_WINDOWS)
+    for name in ('num_games', 'h2h_games', 'half_life'):
+        if params.get(name) not in (None, ''):
+            try:
+                windows[name] = int(params[name])
+            except (TypeError, ValueError):
+                raise ValueError(INVALID_WINDOWS_ERROR)
+    if not (1 <= windows['num_games'] <= MAX_NUM_GAMES and 1 <= windows['h2h_games'] <= MAX_H2H_GAMES):
+        raise ValueError(INVALID_WINDOWS_ERROR)
+    if windows['half_life'] is not None and windows['half_life'] not in decay.HALF_LIVES:
+        raise ValueError(INVALID_WINDOWS_ERROR)
+    if params.get('as_of') not in (None, ''):
+        # strptime rather than date.fromisoformat, which also takes e.g. 20240101 from Python 3.11
+        if not isinstance(params['as_of'], str):
+            raise ValueError(INVALID_AS_OF_ERROR)
+        try:
+            windows['as_of'] = datetime.datetime.strptime(params['as_of'], '%Y-%m-%d').date().isoformat()
+        except ValueError:
+            raise ValueError(INVALID_AS_OF_ERROR)
+        if windows['half_life'] is not None or engine != 'form':
+            raise ValueError(INVALID_AS_OF_ERROR)
+    return windows
+
+
+def _windows_suffix(windows):
+    if windows is None or windows == DEFAULT_WINDOWS:
+        return ''
+    suffix = f"-n{windows['num_games']}-h{windows['h2h_games']}-d{windows['half_life']}"
+    if windows['as_of']:
+        suffix += f"-a{windows['as_of'].replace('-', '')}"
+    return suffix
+
+
+# Keep the cached predictions of fixtures whose teams have no new or corrected matches,
+# except those of the poisson engine, whose model is fitted on every match of the league
+def _on_league_update(league, old_version, new_version, changed_teams):
+    cache.carry_over(league, f"{old_version}-{WEIGHTS_VERSION}", f"{new_version}-{WEIGHTS_VERSION}", changed_teams,
+                     keep=lambda variant: not variant.startswith('-poisson'))
+
+
+store.subscribe(_on_league_update)
+
+
+# Predict one fixture from the data of its league, or get it from the precomputed
+# matrix (see matrix.py) or the prediction cache
+def cached_predict_fixture(league, home_team, away_team, data, engine='form', windows=None):
+    top_up = top_up_version(data, (home_team, away_team), windows)
+    # Matrix entries only follow this league's data
+    if engine == 'form' and not _windows_suffix(windows) and not top_up:
+        predictions = mx.lookup(league, home_team, away_team, prediction_version(data))
+        if predictions is not None:
+            return predictions
+    key = cache.make_key(league, home_team, away_team, prediction_version(data), fixture_variant(engine, windows) + top_up)
+    predictions = cache.get(key)
+    if predictions is None:
+        # Concurrent identical requests wait for one computation instead of repeating it
+        predictions = sf.do(key, lambda: _predict_and_cache(key, league, home_team, away_team, data, engine, windows))
+    return predictions
+
+
+def _predict_and_cache(key, league, home_team, away_team, data, engine, windows):
+    # Another worker holding the same lock file may have just cached it
+    predictions = cache.get(key) if sf.LOCK_DIR else None
+    if predictions is None:
+        if engine == 'poisson':
+            predictions = poisson.predict_fixture(league, home_team, away_team, data, windows)
+        else:
+            predictions = predict_fixture(home_team, away_team, data, windows)
+        cache.put(key, predictions)
+    return predictions
 
-    #Merge to find rows that are in df_new but not in df_old
-    df_combined = pd.concat([trimmed_df, trimmed_new_df]).drop_duplicates(keep='first', ignore_index=True)
-    # Convert 'Date' to datetime for sorting (if not already datetime)
-    df_combined['Date'] = pd.to_datetime(df_combined['Date'], dayfirst=True)
 
+# Predict one fixture from the data of its league
+def predict_fixture(home_team, away_team, data, windows=None):
+    """
+    :param data: League data from `store.get_league`.
+    :param windows: See parse_windows, DEFAULT_WINDOWS when not given.
+    :return: The predictions dict of `aggregate_team_specific_predictions`.
+    """
+    windows = windows or DEFAULT_WINDOWS
     # Extract stats
-    prematch_stats = create_prematch_stats(home_team, away_team, df_combined)
+    if windows['as_of']:
+        prematch_stats = create_prematch_stats_as_of(home_team, away_team, data, windows['as_of'],
+                                                     windows['num_games'], windows['h2h_games'])
+    elif windows['half_life']:
+        prematch_stats = create_prematch_stats_decayed(home_team, away_team, data, windows['half_life'], windows['h2h_games'])
+    else:
+        prematch_stats = create_prematch_stats(home_team, away_team, data['df'], data['index'],
+                                               windows['num_games'], windows['h2h_games'], data['league'])
+
+    return predict_from_prematch_stats(home_team, away_team, prematch_stats)
+
+
+# Predict one fixture from the output of create_prematch_stats
+def predict_from_prematch_stats(home_team, away_team, prematch_stats):
 
     # Data for last 5 games
     home_team_stats = prematch_stats[0]
@@ -476,21 +649,63 @@ def get_stats(league, home_team, away_team):
     else:
         home_away_h2h_stats = prematch_stats[5]
 
-    predictions = aggregate_team_specific_predictions(home_team, away_team, home_team_home_stats, away_team_away_stats, 
-                                                      home_team_stats, away_team_stats, h2h_stats, home_away_h2h_stats)
+    with mt.span('aggregate'):
+        predictions = aggregate_team_specific_predictions(home_team, away_team, home_team_home_stats, away_team_away_stats, 
+                                                          home_team_stats, away_team_stats, h2h_stats, home_away_h2h_stats)
 
     return predictions
 
+
+# Main
+def get_stats(league, home_team, away_team, engine='form', windows=None):
+
+    with mt.league_context(league):
+        # Merged, date sorted and indexed league data, only rebuilt when its csv files change
+        data = store.get_league(league)
+
+        return cached_predict_fixture(league, registry.canonical(home_team), registry.canonical(away_team), data, engine, windows)
+
+
+# Score a list of fixtures of one league, loading and indexing the league once
+def get_stats_batch(league, fixtures, engine='form', windows=None):
+    """
+    :param league: League name as in `extract.leagues`.
+    :param fixtures: List of (home_team, away_team) pairs.
+    :param engine: One of ENGINES.
+    :param windows: See parse_windows.
+    :return: One dict per fixture, in order, with `home_team`, `away_team` and either
+             `stats` (the predictions) or `error` when that fixture could not be scored.
+    """
+    with mt.league_context(league):
+        data = store.get_league(league)
+
+        results = []
+        for home_team, away_team in fixtures:
+            result = {"home_team": home_team, "away_team": away_team}
+            if home_team == away_team:
+                result["error"] = SAME_TEAMS_ERROR
+            else:
+                try:
+                    result["stats"] = cached_predict_fixture(league, registry.canonical(home_team), registry.canonical(away_team),
+                                                             data, engine, windows)
+                except Exception as e:
+                    mt.count('errors_total', type=type(e).__name__)
+                    result["error"] = NOT_ENOUGH_DATA_ERROR
+            results.append(result)
+
+    return results
+
+# Share of `results` equal to `value`, decayed stats (decay.py) hold the shares directly
+def _share(results, value):
+    if isinstance(results, dict):
+        return results.get(value, 0.0)
+    return results.count(value) / len(results)
+
+
 def aggregate_team_specific_predictions(home_team, away_team, home_team_home_stats, away_team_away_stats, 
                                      home_team_stats, away_team_stats, h2h_stats, home_away_h2h_stats):
     # Define base weights
-    base_weights = {
-        'home_away_form': 0.25,
-        'overall_form': 0.20,
-        'opposition_form': 0.20,
-        'h2h': 0.15,
-        'home_away_h2h': 0.20
-    }
+    base_weights = WEIGHTS['base']
     
     # Adjust weights if h2h stats are missing
     def redistribute_weights(weights, missing_keys):
@@ -510,51 +725,46 @@ def aggregate_team_specific_predictions(home_team, away_team, home_team_home_sta
     # Calculate result probabilities with available stat types
     home_win_prob = 0
     if 'home_away_form' in weights:
-        home_win_prob += (home_team_home_stats["results"].count("Win") / len(home_team_home_stats["results"])) * weights['home_away_form']
+        home_win_prob += _share(home_team_home_stats["results"], "Win") * weights['home_away_form']
     if 'overall_form' in weights:
-        home_win_prob += (home_team_stats["results"].count("Win") / len(home_team_stats["results"])) * weights['overall_form']
+        home_win_prob += _share(home_team_stats["results"], "Win") * weights['overall_form']
     if 'opposition_form' in weights:
-        home_win_prob += (away_team_away_stats["results"].count("Lose") / len(away_team_away_stats["results"])) * weights['opposition_form']
+        home_win_prob += _share(away_team_away_stats["results"], "Lose") * weights['opposition_form']
     if 'h2h' in weights and h2h_stats:
-        home_win_prob += (h2h_stats["results"].count(f"{home_team} Win") / len(h2h_stats["results"])) * weights['h2h']
+        home_win_prob += _share(h2h_stats["results"], f"{home_team} Win") * weights['h2h']
     if 'home_away_h2h' in weights and home_away_h2h_stats:
-        home_win_prob += (home_away_h2h_stats["results"].count(f"{home_team} Win") / len(home_away_h2h_stats["results"])) * weights['home_away_h2h']
+        home_win_prob += _share(home_away_h2h_stats["results"], f"{home_team} Win") * weights['home_away_h2h']
     home_win_prob *= 100
 
     # Away win probability with adjusted weights
     away_win_prob = 0
     if 'home_away_form' in weights:
-        away_win_prob += (away_team_away_stats["results"].count("Win") / len(away_team_away_stats["results"])) * weights['home_away_form']
+        away_win_prob += _share(away_team_away_stats["results"], "Win") * weights['home_away_form']
     if 'overall_form' in weights:
-        away_win_prob += (away_team_stats["results"].count("Win") / len(away_team_stats["results"])) * weights['overall_form']
+        away_win_prob += _share(away_team_stats["results"], "Win") * weights['overall_form']
     if 'opposition_form' in weights:
-        away_win_prob += (home_team_home_stats["results"].count("Lose") / len(home_team_home_stats["results"])) * weights['opposition_form']
+        away_win_prob += _share(home_team_home_stats["results"], "Lose") * weights['opposition_form']
     if 'h2h' in weights and h2h_stats:
-        away_win_prob += (h2h_stats["results"].count(f"{away_team} Win") / len(h2h_stats["results"])) * weights['h2h']
+        away_win_prob += _share(h2h_stats["results"], f"{away_team} Win") * weights['h2h']
     if 'home_away_h2h' in weights and home_away_h2h_stats:
-        away_win_prob += (home_away_h2h_stats["results"].count(f"{away_team} Win") / len(home_away_h2h_stats["results"])) * weights['home_away_h2h']
+        away_win_prob += _share(home_away_h2h_stats["results"], f"{away_team} Win") * weights['home_away_h2h']
     away_win_prob *= 100
 
     # Draw probability with adjusted weights for missing h2h stats
-    draw_weights = {
-        'home_away_form': 0.30,
-        'overall_form': 0.35,
-        'h2h': 0.15,
-        'home_away_h2h': 0.20
-    }
+    draw_weights = WEIGHTS['draw']
     draw_weights = redistribute_weights(draw_weights, missing_stats)
     
     draw_prob = 0
     if 'home_away_form' in draw_weights:
-        draw_prob += ((home_team_home_stats["results"].count("Draw") / len(home_team_home_stats["results"]) +
-                      away_team_away_stats["results"].count("Draw") / len(away_team_away_stats["results"])) / 2) * draw_weights['home_away_form']
+        draw_prob += ((_share(home_team_home_stats["results"], "Draw") +
+                      _share(away_team_away_stats["results"], "Draw")) / 2) * draw_weights['home_away_form']
     if 'overall_form' in draw_weights:
-        draw_prob += ((home_team_stats["results"].count("Draw") / len(home_team_stats["results"]) +
-                      away_team_stats["results"].count("Draw") / len(away_team_stats["results"])) / 2) * draw_weights['overall_form']
+        draw_prob += ((_share(home_team_stats["results"], "Draw") +
+                      _share(away_team_stats["results"], "Draw")) / 2) * draw_weights['overall_form']
     if 'h2h' in draw_weights and h2h_stats:
-        draw_prob += (h2h_stats["results"].count("Draw") / len(h2h_stats["results"])) * draw_weights['h2h']
+        draw_prob += _share(h2h_stats["results"], "Draw") * draw_weights['h2h']
     if 'home_away_h2h' in draw_weights and home_away_h2h_stats:
-        draw_prob += (home_away_h2h_stats["results"].count("Draw") / len(home_away_h2h_stats["results"])) * draw_weights['home_away_h2h']
+        draw_prob += _share(home_away_h2h_stats["results"], "Draw") * draw_weights['home_away_h2h']
     draw_prob *= 100
 
     # Normalize probabilities to sum to 100%
@@ -564,12 +774,7 @@ def aggregate_team_specific_predictions(home_team, away_team, home_team_home_sta
     draw_prob = (draw_prob / total_prob) * 100
 
     # BTTS probability with adjusted weights
-    btts_weights = {
-        'home_away_form': 0.40,  # Increased from 0.20 each
-        'overall_form': 0.30,    # Increased from 0.15 each
-        'h2h': 0.15,
-        'home_away_h2h': 0.15
-    }
+    btts_weights = WEIGHTS['btts']
     btts_weights = redistribute_weights(btts_weights, missing_stats)
     
     btts_prob = 0
@@ -585,15 +790,10 @@ def aggregate_team_specific_predictions(home_team, away_team, home_team_home_sta
 
     # Helper function for team-specific stats calculation
     def calculate_team_stats(team, team_home_away_stats, team_stats, stat_name):
-        weights = {
-            'home_away_form': 0.30,
-            'overall_form': 0.25,
-            'h2h': 0.20,
-            'home_away_h2h': 0.25
-        }
+        weights = WEIGHTS['team_stats']
         weights = redistribute_weights(weights, missing_stats)
         
-        team_name_formatted = team.lower().replace(' ', '_')
+        team_name_formatted = registry.slug(team)
         result = 0
         
         if 'home_away_form' in weights:
@@ -620,12 +820,7 @@ def aggregate_team_specific_predictions(home_team, away_team, home_team_home_sta
     }
 
     # Calculate expected total goals with adjusted weights
-    total_goals_weights = {
-        'home_away_form': 0.25,
-        'overall_form': 0.25,
-        'h2h': 0.20,
-        'home_away_h2h': 0.30
-    }
+    total_goals_weights = WEIGHTS['total_goals']
     total_goals_weights = redistribute_weights(total_goals_weights, missing_stats)
     
     expected_total_goals = 0
@@ -0,0 +1,69 @@
+"""
+Load every league once in the gunicorn master, before it forks the workers (see gunicorn.conf.py).
+
+The league frames are memory-mapped from their columnar copies (typed .npy columns,
+see columnar.py) and indexed into NumPy position arrays, so the data is flat buffers
+rather than per-row Python objects. The workers share those pages with the master
+and with each other: copy-on-write for what the master built, through the page
+cache for the mapped files. SIGUSR2 reloads the data without restarting anything.
+"""
+import gc
+import os
+import signal
+import threading
+import time
+
+import extract as ex
+import matrix as mx
+import store
+
+# Set by gunicorn.conf.py; the master then loads the data and the workers refresh it
+ENABLED = os.environ.get('PRELOAD_APP') == '1'
+
+_reload_lock = threading.Lock()
+
+
+# Load and index every league, and the prediction matrices
+def load_all(leagues=None):
+    """
+    :return: Seconds taken.
+    """
+    start = time.perf_counter()
+    for league in leagues or ex.leagues:
+        try:
+            store.reload(league)
+            mx.load(league)
+        except Exception as e:
+            print(f"Preloading {league} failed: {e}")
+    return time.perf_counter() - start
+
+
+# Keep the collector of the workers off the pages of the master's objects
+def freeze():
+    gc.collect()
+    gc.freeze()
+
+
+# Reload in the master, so workers forked from now on start with the new data
+def reload_master():
+    gc.unfreeze()
+    seconds = load_all()
+    freeze()
+    return seconds
+
+
+def _reload_worker():
+    # A second signal during a reload waits for it rather than running alongside
+    with _reload_lock:
+        seconds = load_all()
+    print(f"Worker {os.getpid()} reloaded the league data in {seconds:.2f}s")
+
+
+# Reload the data of a worker on SIGUSR2, off the signal handler
+def install_reload_handler():
+    signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=_reload_worker, name='reload', daemon=True).start())
+
+
+# Refresh listener of a worker, asks the master to reload every process
+def request_reload(codes):
+    os.kill(os.getppid(), signal.SIGUSR2)
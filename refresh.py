@@ -0,0 +1,226 @@
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+import extract as ex
+import metrics as mt
+
+# Upstream feed, overridable so a local HTTP server can stand in for football-data.co.uk
+BASE_URL = os.environ.get('FOOTBALL_DATA_URL', 'https://www.football-data.co.uk/mmz4281')
+# Month the seasons start in, the feed of a new season is fetched from its first day
+SEASON_START_MONTH = 7
+
+# Seconds before a feed is checked upstream again (shared by all workers through the meta file)
+REFRESH_TTL = int(os.environ.get('REFRESH_TTL', 3600))
+# Seconds between two runs of the background refresher, 0 disables it
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', 900))
+REQUEST_TIMEOUT = 30
+
+_refresher = None
+_refresher_lock = threading.Lock()
+# Called with the list of updated league codes after a refresh run
+_listeners = []
+
+
+# Season code of the feeds for the season starting in `year`, e.g. '2425' for 2024
+def season_code(year):
+    return f'{year % 100:02d}{(year + 1) % 100:02d}'
+
+
+# Year the season of a date started in
+def season_year(date=None):
+    date = date or datetime.date.today()
+    return date.year if date.month >= SEASON_START_MONTH else date.year - 1
+
+
+# Season code of the feeds for a date, e.g. '2425' from July 2024 to June 2025
+def current_season(date=None):
+    return season_code(season_year(date))
+
+
+def feed_url(code, season=None):
+    return f'{BASE_URL}/{season or current_season()}/{code}.csv'
+
+
+def _meta_path(code):
+    return os.path.join(ex.resources_dir, f'.{code}.meta.json')
+
+
+# Read the ETag / Last-Modified validators and last check time of a feed
+def read_meta(code):
+    try:
+        with open(_meta_path(code)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Write a file via a temp file in the same directory and rename it into place,
+# so readers only ever see the old or the new content
+def atomic_write(path, content):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_meta(code, meta):
+    atomic_write(_meta_path(code), json.dumps(meta).encode())
+
+
+def _league_name(code):
+    return next((league for league, (league_code, _) in ex.league_codes.items() if league_code == code), code)
+
+
+# Season of a stored feed, from its matches when it was written before seasons were recorded
+def _file_season(path, meta):
+    if meta.get('season'):
+        return meta['season']
+    import store
+
+    dates = store.read_matches(path)['Date']
+    return current_season(dates.max().date()) if len(dates) else None
+
+
+# Refresh one league feed
+def refresh_league(code, force=False, ttl=None, notify=True):
+    """
+    Fetch the current season csv of a league with a conditional GET and store it
+    as `resources/<code>.csv`. Once the feed of a new season is out, the matches of
+    the previous one are moved into the league's historic file (see backfill.py).
+
+    :param code: football-data.co.uk league code, e.g. 'E0'.
+    :param force: Ignore the TTL and always ask upstream.
+    :param ttl: Seconds a previous check stays fresh, defaults to REFRESH_TTL.
+    :param notify: Have the listeners called on a background thread after an update,
+                   whoever fetched it (e.g. a request of the async serving mode).
+    :return: 'updated', 'not_modified', 'fresh', 'busy' or 'failed'.
+    """
+    # Imported here so worker startup does not pay for it
+    import requests
+
+    ttl = REFRESH_TTL if ttl is None else ttl
+    path = os.path.join(ex.resources_dir, f'{code}.csv')
+
+    # Only one process fetches a given feed at a time, the others skip it
+    with open(os.path.join(ex.resources_dir, f'.{code}.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 'busy'
+
+        meta = read_meta(code)
+        if not force and os.path.exists(path) and time.time() - meta.get('checked', 0) < ttl:
+            return 'fresh'
+
+        season = current_season()
+        file_season = _file_season(path, meta) if os.path.exists(path) else season
+        new_season = file_season != season
+
+        headers = {}
+        if os.path.exists(path) and not new_season:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            with mt.span('download', _league_name(code)):
+                response = requests.get(feed_url(code, season), headers=headers, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Failed to retrieve {code}: {e}")
+            mt.count('errors_total', type=type(e).__name__)
+            return 'failed'
+
+        if response.status_code == 304:
+            meta['checked'] = time.time()
+            meta['season'] = season
+            _write_meta(code, meta)
+            return 'not_modified'
+        if response.status_code != 200:
+            print(f"Failed to retrieve the file. Status code: {response.status_code}")
+            return 'failed'
+
+        if new_season:
+            # Imported here, it needs the store
+            import backfill
+
+            backfill.add_to_history(_league_name(code), [path])
+            # Only the season of the stored feed is merged, any later one is left to a backfill run
+            seasons = backfill.past_seasons()
+            skipped = seasons[seasons.index(file_season) + 1:] if file_season in seasons else []
+            if skipped:
+                print(f"Seasons {', '.join(skipped)} of {code} are missing from its history, "
+                      f"run `python backfill.py --league '{_league_name(code)}'` to add them")
+        atomic_write(path, response.content)
+        _write_meta(code, {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked': time.time(),
+            'season': season,
+        })
+    if notify:
+        threading.Thread(target=_notify, args=([code],), name='refresh-listeners', daemon=True).start()
+    return 'updated'
+
+
+# Get called with the codes of the leagues updated by each refresh run
+def add_listener(listener):
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def _notify(codes):
+    for listener in _listeners:
+        try:
+            listener(codes)
+        except Exception as e:
+            print(f"Refresh listener failed for {', '.join(codes)}: {e}")
+
+
+# Refresh every league feed, the listeners are called once with every updated league
+def refresh_all(force=False, ttl=None):
+    statuses = {code: refresh_league(code, force=force, ttl=ttl, notify=False) for code, _ in ex.league_codes.values()}
+    updated = [code for code, status in statuses.items() if status == 'updated']
+    if updated:
+        _notify(updated)
+    return statuses
+
+
+def _run_refresher(interval):
+    while True:
+        try:
+            refresh_all()
+        except Exception as e:
+            print(f"Refresh failed: {e}")
+        time.sleep(interval)
+
+
+# Start the background refresher thread once per process
+def start_refresher(interval=None):
+    global _refresher
+    interval = REFRESH_INTERVAL if interval is None else interval
+    if interval <= 0:
+        return None
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_run_refresher, args=(interval,), name='refresher', daemon=True)
+            _refresher.start()
+    return _refresher
+
+
+if __name__ == '__main__':
+    for code, status in refresh_all(force=True).items():
+        print(code, status)
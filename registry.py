@@ -0,0 +1,115 @@
+"""
+Team registry: canonical names, stable integer IDs and slugs.
+
+IDs are positions in `team_ids.json` next to the league csv files. The file is
+append-only, a team keeps its ID forever, and the same team gets the same ID in
+every league it played in, which links the history of promoted and relegated teams.
+"""
+import fcntl
+import json
+import os
+import threading
+
+import extract as ex
+import refresh as rf
+
+REGISTRY_FILE = 'team_ids.json'
+# Other spellings found in feeds and requests -> canonical football-data.co.uk name
+ALIASES = {
+    'Man Utd': 'Man United',
+    'Manchester United': 'Man United',
+    'Manchester City': 'Man City',
+    'Nottingham Forest': "Nott'm Forest",
+    'Nottm Forest': "Nott'm Forest",
+    'Wolverhampton': 'Wolves',
+    'Spurs': 'Tottenham',
+    'Sheffield Utd': 'Sheffield United',
+    'Sheff Utd': 'Sheffield United',
+    'Sheff Wed': 'Sheffield Weds',
+    'Atletico Madrid': 'Ath Madrid',
+    'Athletic Bilbao': 'Ath Bilbao',
+    'Koln': 'FC Koln',
+    'PSG': 'Paris SG',
+    'Inter Milan': 'Inter',
+    'AC Milan': 'Milan',
+}
+
+# ID -> canonical name, and canonical name -> ID
+_names = []
+_ids = {}
+_slugs = {}
+_lock = threading.Lock()
+
+
+def registry_path():
+    return os.path.join(ex.resources_dir, REGISTRY_FILE)
+
+
+def _read_names():
+    try:
+        with open(registry_path()) as file:
+            return json.load(file)['teams']
+    except FileNotFoundError:
+        return []
+
+
+def _load(names):
+    for team_id in range(len(_names), len(names)):
+        _names.append(names[team_id])
+        _ids[names[team_id]] = team_id
+
+
+def canonical(name):
+    return ALIASES.get(name, name)
+
+
+# IDs of a list of team names, registering the teams seen for the first time
+def ids(names):
+    """
+    :param names: Canonical team names, e.g. a HomeTeam column as a list.
+    :return: The list of their IDs.
+    """
+    new = {name for name in set(names) if name not in _ids}
+    if new:
+        with _lock:
+            if not _names:
+                _load(_read_names())
+            new = sorted(name for name in new if name not in _ids)
+            if new:
+                _register(new)
+    return [_ids[name] for name in names]
+
+
+def _register(new):
+    os.makedirs(ex.resources_dir, exist_ok=True)
+    # Workers registering at the same time append in turn to the same file
+    with open(os.path.join(ex.resources_dir, f'.{REGISTRY_FILE}.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        names = _read_names()
+        known = set(names)
+        names += [name for name in new if name not in known]
+        if len(names) > len(known):
+            rf.atomic_write(registry_path(), json.dumps({'teams': names}, indent=1).encode())
+        _load(names)
+
+
+# ID of a registered team, or None; does not register unknown names
+def lookup(name):
+    name = canonical(name)
+    if name not in _ids and not _names:
+        with _lock:
+            if not _names:
+                _load(_read_names())
+    return _ids.get(name)
+
+
+def name(team_id):
+    return _names[team_id]
+
+
+# Team name as used in stat keys, e.g. 'man_united'
+def slug(team):
+    team_slug = _slugs.get(team)
+    if team_slug is None:
+        team_slug = _slugs[team] = team.lower().replace(' ', '_')
+    return team_slug
@@ -0,0 +1,155 @@
+"""
+Async serving mode, enabled with SERVING_MODE=async.
+
+Feed refreshes run on an asyncio loop in a background thread. Concurrent requests
+for the same league share one in-flight fetch, and a request waits for a stale
+feed at most FETCH_TIMEOUT seconds before answering from the data on disk. Scoring
+runs on a bounded thread pool; when all workers are busy and the queue is full,
+requests are rejected with `Saturated` (503) instead of piling up.
+
+Pair it with threaded workers, e.g. `gunicorn app:app --worker-class gthread --threads 8`.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import extract as ex
+import predict as pr
+import refresh as rf
+import simulate as sim
+
+# Seconds a request waits for a stale feed before using the data already on disk
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 5))
+# Threads scoring predictions, and requests allowed to wait for one of them
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', 4))
+SCORING_QUEUE = int(os.environ.get('SCORING_QUEUE', 16))
+# Seconds before a failed feed is tried again from the request path
+RETRY_AFTER = float(os.environ.get('FETCH_RETRY_AFTER', 60))
+# Seconds before a request gives up on its result
+RESULT_TIMEOUT = float(os.environ.get('RESULT_TIMEOUT', 30))
+
+
+class Saturated(Exception):
+    """All scoring workers are busy and the queue is full."""
+
+
+class TimedOut(Exception):
+    """The result was not ready within RESULT_TIMEOUT seconds."""
+
+
+_loop = None
+_loop_lock = threading.Lock()
+# League code -> in-flight refresh and time of the last attempt, only touched from the loop thread
+_inflight = {}
+_attempted = {}
+_fetch_pool = ThreadPoolExecutor(max_workers=len(ex.league_codes), thread_name_prefix='fetch')
+_scoring_pool = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix='scoring')
+_slots = threading.BoundedSemaphore(SCORING_WORKERS + SCORING_QUEUE)
+_counters = {'fetches': 0, 'coalesced_fetches': 0, 'fetch_timeouts': 0, 'rejected': 0, 'result_timeouts': 0}
+
+
+# Start the event loop thread once per process
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='service-loop', daemon=True).start()
+    return _loop
+
+
+def _is_stale(code):
+    path = os.path.join(ex.resources_dir, f'{code}.csv')
+    return not os.path.exists(path) or time.time() - rf.read_meta(code).get('checked', 0) >= rf.REFRESH_TTL
+
+
+# Refresh a league feed, sharing the fetch with concurrent callers
+async def fetch_league(code):
+    """
+    :return: The status of rf.refresh_league, or 'timeout' when it did not finish
+             within FETCH_TIMEOUT (the fetch itself keeps going for later requests).
+    """
+    task = _inflight.get(code)
+    if task is None:
+        _counters['fetches'] += 1
+        task = asyncio.get_running_loop().run_in_executor(_fetch_pool, rf.refresh_league, code)
+        _inflight[code] = task
+        task.add_done_callback(lambda _: _inflight.pop(code, None))
+    else:
+        _counters['coalesced_fetches'] += 1
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), FETCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        _counters['fetch_timeouts'] += 1
+        return 'timeout'
+
+
+# Run a scoring function on the bounded pool
+async def score(function, *args):
+    if not _slots.acquire(blocking=False):
+        _counters['rejected'] += 1
+        raise Saturated()
+    try:
+        future = _scoring_pool.submit(function, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # The slot is held until the scoring thread is done, even when the request gave up on it
+    future.add_done_callback(lambda _: _slots.release())
+    return await asyncio.wrap_future(future)
+
+
+async def _ensure_fresh(league):
+    code = ex.league_codes[league][0]
+    if code in _inflight or (_is_stale(code) and time.time() - _attempted.get(code, 0) >= RETRY_AFTER):
+        _attempted[code] = time.time()
+        await fetch_league(code)
+
+
+async def get_stats_async(league, home_team, away_team, engine='form', windows=None):
+    await _ensure_fresh(league)
+    return await score(pr.get_stats, league, home_team, away_team, engine, windows)
+
+
+async def get_stats_batch_async(league, fixtures, engine='form', windows=None):
+    await _ensure_fresh(league)
+    return await score(pr.get_stats_batch, league, fixtures, engine, windows)
+
+
+async def simulate_league_async(league, seasons, engine='form'):
+    await _ensure_fresh(league)
+    return await score(sim.simulate_league, league, seasons, engine)
+
+
+def _run(coroutine):
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+    try:
+        return future.result(RESULT_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        # Drops the fetch wait or queued scoring of the request, a running scoring call finishes
+        future.cancel()
+        _counters['result_timeouts'] += 1
+        raise TimedOut()
+
+
+# Same as predict.get_stats, for the sync request handlers
+def get_stats(league, home_team, away_team, engine='form', windows=None):
+    return _run(get_stats_async(league, home_team, away_team, engine, windows))
+
+
+# Same as predict.get_stats_batch, for the sync request handlers
+def get_stats_batch(league, fixtures, engine='form', windows=None):
+    return _run(get_stats_batch_async(league, fixtures, engine, windows))
+
+
+# Same as simulate.simulate_league, for the sync request handlers
+def simulate_league(league, seasons, engine='form'):
+    return _run(simulate_league_async(league, seasons, engine))
+
+
+def stats():
+    return dict(_counters, inflight=len(_inflight), scoring_workers=SCORING_WORKERS, scoring_queue=SCORING_QUEUE)
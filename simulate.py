@@ -0,0 +1,242 @@
+"""
+Monte Carlo simulation of the rest of a league's season.
+
+The remaining fixtures are the home and away games of the current season's teams
+that have not been played yet, i.e. a double round robin (leagues with a split,
+like the Scottish Premiership, are simulated without it). Each fixture's result
+is drawn from its predicted win/draw/loss probabilities, and its winning margin
+from the Poisson goal distribution of its expected goals given that result. All
+seasons are simulated at once as NumPy arrays, in chunks that bound the memory.
+Ties on points are broken by goal difference, then at random.
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import extract as ex
+import metrics as mt
+import predict as pr
+import store
+
+SEASONS = 100000
+MAX_SEASONS = 1000000
+# Seasons simulated per chunk of arrays
+CHUNK = 20000
+# Winning margins above this are not drawn, goals per team above MAX_GOALS not counted
+MAX_MARGIN = 10
+MAX_GOALS = 2 * MAX_MARGIN
+TOP_PLACES = 4
+# Relegated places per league, 3 when not listed (play-off places count as staying up)
+RELEGATION_PLACES = {'Bundesliga': 2, 'Ligue 1': 2, 'Scottish Premier League': 1}
+
+
+# Points, goal difference and games played of every team in the matches so far
+def season_table(matches, teams):
+    """
+    :param teams: Team names, the positions of the returned arrays.
+    """
+    positions = {team: i for i, team in enumerate(teams)}
+    matches = matches.dropna(subset=['FTHG', 'FTAG'])
+    home = np.array([positions[team] for team in matches['HomeTeam'].tolist()], dtype=np.int64)
+    away = np.array([positions[team] for team in matches['AwayTeam'].tolist()], dtype=np.int64)
+    home_goals, away_goals = matches['FTHG'].to_numpy(dtype=float), matches['FTAG'].to_numpy(dtype=float)
+
+    home_points = np.select([home_goals > away_goals, home_goals == away_goals], [3, 1], 0)
+    away_points = np.select([away_goals > home_goals, home_goals == away_goals], [3, 1], 0)
+    num_teams = len(teams)
+    points = np.bincount(home, home_points, num_teams) + np.bincount(away, away_points, num_teams)
+    goal_difference = np.bincount(home, home_goals - away_goals, num_teams) + np.bincount(away, away_goals - home_goals, num_teams)
+    played = np.bincount(home, minlength=num_teams) + np.bincount(away, minlength=num_teams)
+    return points.astype(np.int64), goal_difference.astype(np.int64), played
+
+
+# Home and away team positions of the fixtures left in a double round robin
+def remaining_fixtures(matches, teams):
+    played = set(zip(matches['HomeTeam'].tolist(), matches['AwayTeam'].tolist()))
+    return [(i, j) for i, home_team in enumerate(teams) for j, away_team in enumerate(teams)
+            if i != j and (home_team, away_team) not in played]
+
+
+# Result probabilities and expected goals of the remaining fixtures
+def fixture_predictions(league, teams, fixtures, data, engine='form'):
+    """
+    A fixture that cannot be scored gets the league's home win, draw and away win
+    shares and average goals.
+
+    :return: (probabilities (fixtures x 3, home win, draw, away win), home expected
+             goals, away expected goals).
+    """
+    matches = data['df'].dropna(subset=['FTHG', 'FTAG'])
+    home_goals, away_goals = matches['FTHG'].to_numpy(dtype=float), matches['FTAG'].to_numpy(dtype=float)
+    default = ([np.mean(home_goals > away_goals), np.mean(home_goals == away_goals), np.mean(home_goals < away_goals)],
+               home_goals.mean(), away_goals.mean())
+
+    probabilities = np.empty((len(fixtures), 3))
+    home_xg, away_xg = np.empty(len(fixtures)), np.empty(len(fixtures))
+    for f, (i, j) in enumerate(fixtures):
+        try:
+            predictions = pr.cached_predict_fixture(league, teams[i], teams[j], data, engine)
+            probabilities[f] = [predictions['home_win_prob'], predictions['draw_prob'], predictions['away_win_prob']]
+            home_xg[f] = predictions['home_team_stats']['expected_goals']
+            away_xg[f] = predictions['away_team_stats']['expected_goals']
+        except Exception:
+            probabilities[f], home_xg[f], away_xg[f] = default
+    probabilities = np.nan_to_num(probabilities.clip(min=0), nan=1.0)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    return probabilities, np.nan_to_num(home_xg, nan=default[1]), np.nan_to_num(away_xg, nan=default[2])
+
+
+# Distribution of the winning margin given a home win and given an away win
+def margin_cdfs(home_xg, away_xg):
+    """
+    :return: Two (fixtures x MAX_MARGIN) arrays, the cumulative probabilities of
+             margins 1 to MAX_MARGIN under independent Poisson goals.
+    """
+    goals = np.arange(MAX_GOALS + 1)
+    log_factorials = np.cumsum(np.log(np.maximum(goals, 1)))
+
+    def pmf(rates):
+        rates = np.maximum(rates, 0.05)[:, None]
+        return np.exp(goals * np.log(rates) - rates - log_factorials)
+
+    scores = pmf(home_xg)[:, :, None] * pmf(away_xg)[:, None, :]
+    margins = np.arange(1, MAX_MARGIN + 1)
+    home = np.stack([np.trace(scores, offset=-k, axis1=1, axis2=2) for k in margins], axis=1)
+    away = np.stack([np.trace(scores, offset=k, axis1=1, axis2=2) for k in margins], axis=1)
+    return (np.cumsum(home, axis=1) / home.sum(axis=1, keepdims=True),
+            np.cumsum(away, axis=1) / away.sum(axis=1, keepdims=True))
+
+
+# Simulate the remaining fixtures of a number of seasons
+def simulate(points, goal_difference, fixtures, probabilities, home_cdf, away_cdf, seasons, rng):
+    """
+    :param points: Current points of every team, with its `goal_difference`.
+    :param fixtures: (home position, away position) of the remaining fixtures.
+    :return: (counts of every team finishing in every position (teams x teams),
+             sum of every team's final points over the seasons).
+    """
+    num_teams, num_fixtures = len(points), len(fixtures)
+    home = np.array([i for i, _ in fixtures], dtype=np.int64)
+    away = np.array([j for _, j in fixtures], dtype=np.int64)
+    # Team -> fixture incidence, summing a (fixtures x seasons) array into teams is a matmul
+    home_incidence = np.zeros((num_teams, num_fixtures), dtype=np.float32)
+    away_incidence = np.zeros((num_teams, num_fixtures), dtype=np.float32)
+    home_incidence[home, np.arange(num_fixtures)] = 1
+    away_incidence[away, np.arange(num_fixtures)] = 1
+    home_win_limit = probabilities[:, 0]
+    draw_limit = probabilities[:, 0] + probabilities[:, 1]
+    home_thresholds = home_win_limit[:, None] * home_cdf
+    away_thresholds = draw_limit[:, None] + (1 - draw_limit[:, None]) * away_cdf
+
+    position_counts = np.zeros((num_teams, num_teams), dtype=np.int64)
+    points_sum = np.zeros(num_teams)
+    for start in range(0, seasons, CHUNK):
+        n = min(CHUNK, seasons - start)
+        # One row of draws per fixture
+        draws = rng.random((num_fixtures, n))
+        home_won = draws < home_win_limit[:, None]
+        away_won = draws >= draw_limit[:, None]
+        drawn = ~home_won & ~away_won
+
+        # Within a result the draw is uniform again, so comparing it with the margin
+        # distribution scaled into the result's range picks the winning margin
+        home_margin = np.ones((num_fixtures, n), dtype=np.int8)
+        away_margin = np.ones((num_fixtures, n), dtype=np.int8)
+        for k in range(MAX_MARGIN - 1):
+            home_margin += draws >= home_thresholds[:, k:k + 1]
+            away_margin += draws >= away_thresholds[:, k:k + 1]
+        margin = np.where(home_won, home_margin, np.where(away_won, -away_margin, 0)).astype(np.float32)
+
+        final_points = (points[:, None] + home_incidence @ (3 * home_won + drawn).astype(np.float32)
+                        + away_incidence @ (3 * away_won + drawn).astype(np.float32))
+        final_goal_difference = goal_difference[:, None] + (home_incidence - away_incidence) @ margin
+        # Points first, then goal difference (|GD| < 1000), then a random draw
+        key = (final_points * 1000 + final_goal_difference).T + rng.random((n, num_teams))
+        order = np.argsort(-key, axis=1)
+
+        for position in range(num_teams):
+            position_counts[:, position] += np.bincount(order[:, position], minlength=num_teams)
+        points_sum += final_points.sum(axis=1)
+    return position_counts, points_sum
+
+
+# Simulate the rest of a league's current season
+def simulate_league(league, seasons=SEASONS, engine='form', seed=None):
+    """
+    :param engine: Prediction engine of the fixture probabilities, one of predict.ENGINES.
+    :param seed: Random seed, by default derived from the data version so the same
+                 data always gives the same answer.
+    :return: A dict with the league, the number of `seasons`, `played` and `remaining`
+             fixtures, and per team (ordered by expected finishing position) its
+             current table, `expected_points`, the probability in % of each final
+             `positions` (1st first), `title_prob`, `top_4_prob` and `relegation_prob`.
+    """
+    with mt.league_context(league):
+        data = store.get_league(league)
+        matches = store.season_matches(league)
+        teams = store.league_teams(league)
+        points, goal_difference, played = season_table(matches, teams)
+        fixtures = remaining_fixtures(matches, teams)
+        with mt.span('simulate_predictions'):
+            probabilities, home_xg, away_xg = fixture_predictions(league, teams, fixtures, data, engine)
+        home_cdf, away_cdf = margin_cdfs(home_xg, away_xg)
+
+        version = pr.fixture_version(data, engine, teams=teams)
+        rng = np.random.default_rng(int(version[:16], 16) if seed is None else seed)
+        with mt.span('simulate'):
+            position_counts, points_sum = simulate(points, goal_difference, fixtures, probabilities,
+                                                   home_cdf, away_cdf, seasons, rng)
+
+    shares = position_counts / seasons * 100
+    relegated = RELEGATION_PLACES.get(league, 3)
+    expected_position = shares @ np.arange(1, len(teams) + 1)
+    table = []
+    for i in np.argsort(expected_position, kind='stable'):
+        table.append({
+            'team': teams[i],
+            'points': int(points[i]),
+            'goal_difference': int(goal_difference[i]),
+            'played': int(played[i]),
+            'expected_points': float(points_sum[i] / seasons),
+            'positions': shares[i].tolist(),
+            'title_prob': float(shares[i, 0]),
+            'top_4_prob': float(shares[i, :TOP_PLACES].sum()),
+            'relegation_prob': float(shares[i, len(teams) - relegated:].sum()),
+        })
+    return {
+        'league': league,
+        'version': version,
+        'seasons': seasons,
+        'played': int(played.sum() // 2),
+        'remaining': len(fixtures),
+        'teams': table,
+    }
+
+
+# Simulate several leagues, optionally one per process
+def simulate_all(leagues=None, seasons=SEASONS, engine='form', workers=1):
+    leagues = leagues or ex.leagues
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(leagues, pool.map(simulate_league, leagues, [seasons] * len(leagues), [engine] * len(leagues))))
+    return {league: simulate_league(league, seasons, engine) for league in leagues}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate the rest of the current season of every league.')
+    parser.add_argument('--league', action='append', dest='leagues', choices=ex.leagues, help='League to simulate, repeatable (default: all)')
+    parser.add_argument('--seasons', type=int, default=SEASONS)
+    parser.add_argument('--engine', choices=pr.ENGINES, default='form')
+    parser.add_argument('--workers', type=int, default=1, help='Simulate leagues on a process pool of this size')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for league, result in simulate_all(args.leagues, args.seasons, args.engine, args.workers).items():
+        print(f"{league}: {result['remaining']} fixtures left")
+        for row in result['teams']:
+            print(f"  {row['team']:<20} {row['points']:>3} pts  xPts {row['expected_points']:6.1f}  "
+                  f"title {row['title_prob']:5.1f}%  top {TOP_PLACES} {row['top_4_prob']:5.1f}%  "
+                  f"relegation {row['relegation_prob']:5.1f}%")
+    print(f"{time.perf_counter() - start:.2f}s")
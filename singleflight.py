@@ -0,0 +1,67 @@
+import fcntl
+import hashlib
+import os
+import threading
+
+# Optional directory for lock files, so duplicate calls also wait across gunicorn workers
+LOCK_DIR = os.environ.get('SINGLEFLIGHT_LOCK_DIR')
+
+# Key -> in-flight call {'done', 'result' or 'error'}
+_calls = {}
+_lock = threading.Lock()
+_counters = {'calls': 0, 'coalesced': 0}
+
+
+def _with_file_lock(key, function):
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    path = os.path.join(LOCK_DIR, hashlib.sha1(repr(key).encode()).hexdigest() + '.lock')
+    with open(path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return function()
+
+
+# Run a function once for concurrent callers with the same key
+def do(key, function):
+    """
+    The first caller runs `function`; callers arriving with the same key while it
+    runs wait for it and get the same result (or exception).
+
+    With LOCK_DIR set, the call also holds a lock file for the key, so a duplicate
+    in another worker waits for it; `function` should then look in a cache shared
+    by the workers before computing.
+
+    :param key: Hashable key of the call.
+    :param function: Called without arguments.
+    :return: The result of `function`.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = {'done': threading.Event()}
+            _calls[key] = call
+            _counters['calls'] += 1
+        else:
+            _counters['coalesced'] += 1
+
+    if not leader:
+        call['done'].wait()
+        if 'error' in call:
+            raise call['error']
+        return call['result']
+
+    try:
+        call['result'] = _with_file_lock(key, function) if LOCK_DIR else function()
+        return call['result']
+    except BaseException as e:
+        call['error'] = e
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call['done'].set()
+
+
+def stats():
+    with _lock:
+        return dict(_counters, inflight=len(_calls))
@@ -0,0 +1,374 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import extract as ex
+import metrics as mt
+import refresh as rf
+import registry
+import team_index as ti
+
+# A match is identified by these columns, a newer row with the same key replaces the older one
+KEY_COLUMNS = ['Div', 'Date', 'HomeTeam', 'AwayTeam']
+
+# League name -> {'league', 'df', 'index', 'keys', 'high_water', 'signature', 'version',
+#                  'previous_version', 'unchanged_rows'}; `keys` is built on the first ingest
+_leagues = {}
+_locks = {}
+_locks_guard = threading.Lock()
+# Called with (league, old version, new version, changed teams) after a league is updated
+_subscribers = []
+# League name -> team IDs of its frame, and team ID -> leagues with its matches, both
+# for the leagues loaded in this process; replaced, never changed in place
+_league_team_ids = {}
+_team_leagues = {}
+
+
+# Paths of the historic and current season csv of a league
+def league_files(league):
+    code, historic = ex.league_codes[league]
+    return [os.path.join(ex.resources_dir, f'{historic}.csv'), os.path.join(ex.resources_dir, f'{code}.csv')]
+
+
+def _signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+def _version(signature):
+    return hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+
+def _league_lock(league):
+    with _locks_guard:
+        return _locks.setdefault(league, threading.Lock())
+
+
+# Register a function called whenever the data of a league changes
+def subscribe(subscriber):
+    """
+    :param subscriber: Called as subscriber(league, old_version, new_version, changed_teams)
+                       from the thread that noticed the change. `changed_teams` is the set
+                       of teams whose matches were added or corrected (empty when a file
+                       was rewritten with the same matches), or None when the league was
+                       rebuilt from scratch and any team may have changed.
+    """
+    _subscribers.append(subscriber)
+
+
+def _notify(league, old_version, new_version, changed_teams):
+    for subscriber in _subscribers:
+        try:
+            subscriber(league, old_version, new_version, changed_teams)
+        except Exception as e:
+            print(f"Store subscriber failed for {league}: {e}")
+
+
+# Read the matches of one csv file
+def read_matches(path, columns=None):
+    """
+    :param columns: Columns to keep, by default `Div` through `AR` of the file itself.
+    :return: A dataframe with parsed dates, without the blank trailing lines of the feeds.
+    """
+    with mt.span('csv_parse'):
+        df = pd.read_csv(path)
+    if columns is None:
+        # Trim the DataFrame to include columns up to 'AR'
+        columns = df.columns[:df.columns.get_loc('AR') + 1]
+    df = df.reindex(columns=columns)
+    # Blank trailing lines in the feeds come through as rows without teams
+    df = df.dropna(subset=['HomeTeam', 'AwayTeam'])
+    # One name per team across feeds and leagues
+    df[['HomeTeam', 'AwayTeam']] = df[['HomeTeam', 'AwayTeam']].replace(registry.ALIASES)
+    with mt.span('date_parse'):
+        df['Date'] = pd.to_datetime(df['Date'], dayfirst=True)
+    return df
+
+
+# Read, trim, merge and date sort the csv files of a league
+def build_league_frame(paths):
+    """
+    Build the merged match frame of a league.
+
+    :param paths: Historic csv first, then the current season csv (may not exist yet).
+                  A match found in several files is taken from the last one.
+    :return: A dataframe with the columns `Div` through `AR`, parsed dates, sorted by date.
+    """
+    frames = [read_matches(paths[0])]
+    # New csv files, kept up to date in the background by refresh.py
+    for path in paths[1:]:
+        if os.path.exists(path):
+            frames.append(read_matches(path, frames[0].columns))
+
+    with mt.span('merge'):
+        df_combined = pd.concat(frames, ignore_index=True).drop_duplicates(subset=KEY_COLUMNS, keep='last')
+        return df_combined.sort_values(by='Date', kind='stable', ignore_index=True)
+
+
+def _match_keys(df):
+    return list(zip(*(df[column].tolist() for column in KEY_COLUMNS)))
+
+
+# Key -> row position of every match of a frame
+def key_positions(df):
+    return {key: position for position, key in enumerate(_match_keys(df))}
+
+
+def _teams(df):
+    return set(df['HomeTeam'].tolist()) | set(df['AwayTeam'].tolist())
+
+
+# Copy of a frame with some rows replaced, leaving the original untouched
+def _replace_rows(df, positions, rows):
+    columns = {}
+    for column in df.columns:
+        current = df[column].to_numpy()
+        values = rows[column].to_numpy()
+        if current.dtype == values.dtype:
+            dtype = current.dtype
+        elif current.dtype == object or values.dtype == object:
+            dtype = object
+        else:
+            dtype = np.result_type(current.dtype, values.dtype)
+        updated = current.astype(dtype, copy=True)
+        updated[positions] = values
+        columns[column] = updated
+    return pd.DataFrame(columns)
+
+
+# Upsert the matches of a current season file into a league's frame
+def ingest(df, index, keys, path):
+    """
+    Only rows with a new key, or whose values differ from the stored match with the
+    same key, touch the frame. Appending matches played on or after the high-water
+    mark (the latest date in the frame) keeps every row position, so the index is
+    extended rather than rebuilt.
+
+    :param df: The stored frame of the league, with its `index` and `keys` (key_positions).
+    :return: (df, index, keys, changed teams, number of leading rows left as they were);
+             the given objects when nothing changed.
+    """
+    new = read_matches(path, df.columns).reset_index(drop=True)
+    with mt.span('merge'):
+        return _upsert(df, index, keys, new)
+
+
+def _upsert(df, index, keys, new):
+    new_keys = _match_keys(new)
+    positions = [keys.get(key) for key in new_keys]
+
+    known = [i for i, position in enumerate(positions) if position is not None]
+    added = [i for i, position in enumerate(positions) if position is None]
+
+    # Corrections to stored matches, compared value by value with missing values equal
+    old_rows = df.iloc[[positions[i] for i in known]].astype(object).reset_index(drop=True)
+    new_rows = new.iloc[known].astype(object).reset_index(drop=True)
+    same = (old_rows == new_rows) | (old_rows.isna() & new_rows.isna())
+    corrected = [known[i] for i in np.flatnonzero(~same.all(axis=1).to_numpy())]
+
+    if not corrected and not added:
+        return df, index, keys, set(), len(df)
+
+    changed_teams = _teams(new.iloc[corrected + added])
+    unchanged_rows = len(df)
+    if corrected:
+        # Keys include the teams and date, so positions and the index stay valid
+        unchanged_rows = min(positions[i] for i in corrected)
+        df = _replace_rows(df, [positions[i] for i in corrected], new.iloc[corrected])
+    if added:
+        additions = new.iloc[added].drop_duplicates(subset=KEY_COLUMNS, keep='last')
+        additions = additions.sort_values(by='Date', kind='stable')
+        start = len(df)
+        appended = start == 0 or additions['Date'].min() >= df['Date'].max()
+        df = pd.concat([df, additions], ignore_index=True)
+        if appended:
+            index = ti.extend_index(ti.copy_index(index), df)
+            keys = dict(keys)
+            keys.update((key, start + i) for i, key in enumerate(_match_keys(additions)))
+        else:
+            # A match from before the high-water mark, rows have to be re-sorted
+            df = df.sort_values(by='Date', kind='stable', ignore_index=True)
+            index = ti.build_index(df)
+            keys = key_positions(df)
+            unchanged_rows = 0
+    return df, index, keys, changed_teams, unchanged_rows
+
+
+# Frame of a league's files, from the columnar copy of their version when there is one
+def _load_frame(league, paths, version):
+    code = ex.league_codes[league][0]
+    df = columnar.load_league(code, version)
+    if df is None:
+        df = build_league_frame(paths)
+        columnar.save_league(code, version, df)
+        # Serve the memory-mapped copy, its pages are shared by every process mapping it
+        mapped = columnar.load_league(code, version)
+        if mapped is not None:
+            df = mapped
+    return df
+
+
+# Record the teams of a league's new index, read by leagues_of_team
+def _map_teams(league, index):
+    global _team_leagues
+    with _locks_guard:
+        _league_team_ids[league] = frozenset(index['team'])
+        team_leagues = {}
+        for name in ex.leagues:
+            for team_id in _league_team_ids.get(name, ()):
+                team_leagues.setdefault(team_id, []).append(name)
+        _team_leagues = team_leagues
+
+
+def _entry(league, df, index, keys, signature, version, previous_version, unchanged_rows):
+    return {
+        'league': league,
+        'df': df,
+        'index': index,
+        'keys': keys,
+        'high_water': df['Date'].max() if len(df) else None,
+        'signature': signature,
+        'version': version,
+        'previous_version': previous_version,
+        'unchanged_rows': unchanged_rows,
+    }
+
+
+# Get the cached data of a league, rebuilt only when its files changed
+def get_league(league):
+    """
+    :param league: League name as in `extract.leagues`.
+    :return: A dict with the merged frame `df`, its lookup `index` (see team_index.py),
+             the `high_water` date of its latest match and the data `version` it was
+             built from. `unchanged_rows` leading rows of `df` are the same as in the
+             `previous_version`, so consumers kept up to date incrementally only have
+             to process the rows after them.
+    """
+    paths = league_files(league)
+    signature = _signature(paths)
+    entry = _leagues.get(league)
+    if entry is not None and entry['signature'] == signature:
+        return entry
+
+    with _league_lock(league), mt.league_context(league):
+        entry = _leagues.get(league)
+        if entry is None or entry['signature'] != signature:
+            old_version = entry['version'] if entry is not None else None
+            version = _version(signature)
+            code = ex.league_codes[league][0]
+            changed_teams = None
+
+            if entry is not None and entry['signature'][0] == signature[0] and all(os.path.exists(path) for path in paths[1:]):
+                # Only the current season file changed
+                df, index, keys = entry['df'], entry['index'], entry['keys']
+                if keys is None:
+                    keys = key_positions(df)
+                changed_teams = set()
+                unchanged_rows = len(df)
+                for path, old, new in zip(paths[1:], entry['signature'][1:], signature[1:]):
+                    if old != new:
+                        df, index, keys, teams, unchanged = ingest(df, index, keys, path)
+                        changed_teams |= teams
+                        unchanged_rows = min(unchanged_rows, unchanged)
+                columnar.save_league(code, version, df)
+            else:
+                # Memory-map the columnar copy of this version when a worker already wrote it
+                df = _load_frame(league, paths, version)
+                index = ti.build_index(df)
+                keys = None
+                unchanged_rows = 0
+
+            entry = _entry(league, df, index, keys, signature, version, old_version, unchanged_rows)
+            _leagues[league] = entry
+            _map_teams(league, index)
+            if old_version is not None:
+                _notify(league, old_version, version, changed_teams)
+    return entry
+
+
+# Reload a league from the columnar copy of its current files
+def reload(league):
+    """
+    Unlike get_league, which folds new matches into the frame it holds, this swaps
+    in the memory-mapped frame of the current version with a fresh index, so the
+    process shares its pages with the others again (see preload.py).
+
+    :return: The new league data.
+    """
+    paths = league_files(league)
+    with _league_lock(league), mt.league_context(league):
+        signature = _signature(paths)
+        version = _version(signature)
+        old = _leagues.get(league)
+        df = _load_frame(league, paths, version)
+        if old is not None and old['version'] == version:
+            # Same matches, consumers of the current version stay valid
+            entry = _entry(league, df, ti.build_index(df), None, signature, version,
+                           old['previous_version'], old['unchanged_rows'])
+        else:
+            entry = _entry(league, df, ti.build_index(df), None, signature, version,
+                           old['version'] if old is not None else None, 0)
+        _leagues[league] = entry
+        _map_teams(league, entry['index'])
+        if old is not None and old['version'] != version:
+            _notify(league, old['version'], version, None)
+    return entry
+
+
+def get_league_frame(league):
+    return get_league(league)['df']
+
+
+# Version of the data a league's predictions are computed from
+def data_version(league):
+    return get_league(league)['version']
+
+
+# Date of the latest match stored for a league
+def high_water(league):
+    return get_league(league)['high_water']
+
+
+# Start of the season a date falls in, the first day of its feed (see refresh.py)
+def season_start(date):
+    return pd.Timestamp(rf.season_year(date), rf.SEASON_START_MONTH, 1)
+
+
+# Matches of a league's latest season
+def season_matches(league):
+    data = get_league(league)
+    if data['high_water'] is None:
+        return data['df'].iloc[:0]
+    return data['df'][data['df']['Date'] >= season_start(data['high_water'])]
+
+
+# Teams of a league's latest season
+def league_teams(league):
+    return sorted(_teams(season_matches(league)))
+
+
+# Leagues with matches of a team, by registry ID
+def leagues_of_team(team_id):
+    """
+    Only the leagues already loaded in this process are looked at, none is loaded
+    for it; a preloading master (see preload.py) loads all of them.
+    """
+    return list(_team_leagues.get(team_id, ()))
+
+
+def clear():
+    global _team_leagues
+    _leagues.clear()
+    with _locks_guard:
+        _league_team_ids.clear()
+        _team_leagues = {}
@@ -0,0 +1,196 @@
+import argparse
+import json
+import math
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import extract as ex
+
+# Columns `Div` through `AR` read by the store, in football-data.co.uk order
+MATCH_COLUMNS = ['Div', 'Date', 'Time', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR', 'HTHG', 'HTAG', 'HTR',
+                 'Referee', 'HS', 'AS', 'HST', 'AST', 'HF', 'AF', 'HC', 'AC', 'HY', 'AY', 'HR', 'AR']
+# Bookmaker prefix -> margin of its 1X2 odds
+BOOKMAKERS = {'B365': 0.050, 'BW': 0.055, 'PS': 0.025, 'WH': 0.060}
+# Log of the average away goals, home advantage and spread of team strengths
+BASE_RATE = math.log(1.4)
+HOME_ADVANTAGE = 0.15
+STRENGTH_SD = 0.25
+# Change of a team's strengths from one season to the next
+SEASON_DRIFT_SD = 0.08
+MAX_GOALS = 10
+REFEREES = ['A Taylor', 'M Oliver', 'C Pawson', 'S Attwell', 'P Tierney', 'R Jones', 'J Gillett', 'D Coote',
+            'T Robinson', 'S Hooper', 'J Brooks', 'T Bramall', 'C Kavanagh', 'A Madley', 'D England']
+
+
+# Double round robin of a season, one list of (home, away) team positions per round
+def round_robin(num_teams):
+    players = list(range(num_teams)) + ([None] if num_teams % 2 else [])
+    half = len(players) // 2
+    rounds = []
+    for r in range(len(players) - 1):
+        pairs = [(players[i], players[-1 - i]) for i in range(half)]
+        # Alternate who plays at home so no team stays home all season
+        rounds.append([(a, b) if (r + i) % 2 else (b, a) for i, (a, b) in enumerate(pairs) if a is not None and b is not None])
+        players = [players[0]] + [players[-1]] + players[1:-1]
+    return rounds + [[(b, a) for a, b in fixtures] for fixtures in rounds]
+
+
+def _poisson_pmf(rates):
+    goals = np.arange(MAX_GOALS + 1)
+    log_factorials = np.array([math.lgamma(k + 1) for k in goals])
+    return np.exp(goals * np.log(rates)[:, None] - rates[:, None] - log_factorials)
+
+
+# Home win, draw, away win and over 2.5 goals probabilities of independent Poisson scores
+def market_probabilities(home_rates, away_rates):
+    scores = _poisson_pmf(home_rates)[:, :, None] * _poisson_pmf(away_rates)[:, None, :]
+    home_goals, away_goals = np.indices(scores.shape[1:])
+    home = (scores * (home_goals > away_goals)).sum(axis=(1, 2))
+    draw = (scores * (home_goals == away_goals)).sum(axis=(1, 2))
+    over = (scores * (home_goals + away_goals > 2)).sum(axis=(1, 2))
+    return home, draw, 1 - home - draw, over
+
+
+def _odds(probabilities, margin, rng):
+    noisy = probabilities * (1 + margin) * rng.normal(1, 0.02, len(probabilities))
+    return np.round(1 / np.clip(noisy, 0.01, 0.99), 2)
+
+
+# Generate the matches of one league
+def generate_league(code, team_names, seasons, last_season_start, rng):
+    """
+    Scores are Poisson with per-team attack and defence strengths that drift
+    between seasons; shots, corners, fouls and cards are drawn around them.
+
+    :param seasons: Number of seasons, the last one starting in `last_season_start`.
+    :return: A dataframe in the football-data.co.uk schema, with odds columns, and
+             the season start year of every row.
+    """
+    num_teams = len(team_names)
+    attack = rng.normal(0, STRENGTH_SD, num_teams)
+    defence = rng.normal(0, STRENGTH_SD * 0.8, num_teams)
+    rounds = round_robin(num_teams)
+
+    dates, homes, aways, seasons_of_rows = [], [], [], []
+    season_attack, season_defence = [], []
+    for season in range(seasons):
+        start = date(last_season_start - seasons + 1 + season, 8, 10)
+        # First Saturday on or after 10 August
+        start += timedelta(days=(5 - start.weekday()) % 7)
+        attack = attack + rng.normal(0, SEASON_DRIFT_SD, num_teams)
+        defence = defence + rng.normal(0, SEASON_DRIFT_SD, num_teams)
+        season_attack.append(attack)
+        season_defence.append(defence)
+        for r, fixtures in enumerate(rounds):
+            for home, away in fixtures:
+                # About a third of each round is played on the Sunday
+                dates.append(start + timedelta(days=7 * r + int(rng.random() < 0.3)))
+                homes.append(home)
+                aways.append(away)
+                seasons_of_rows.append(season)
+
+    homes, aways, seasons_of_rows = np.array(homes), np.array(aways), np.array(seasons_of_rows)
+    attack, defence = np.array(season_attack), np.array(season_defence)
+    home_rates = np.exp(BASE_RATE + HOME_ADVANTAGE + attack[seasons_of_rows, homes] - defence[seasons_of_rows, aways])
+    away_rates = np.exp(BASE_RATE + attack[seasons_of_rows, aways] - defence[seasons_of_rows, homes])
+    years = last_season_start - seasons + 1 + seasons_of_rows
+
+    n = len(homes)
+    fthg, ftag = rng.poisson(home_rates), rng.poisson(away_rates)
+    hthg, htag = rng.binomial(fthg, 0.45), rng.binomial(ftag, 0.45)
+    hs, as_ = rng.poisson(6 + 4 * home_rates), rng.poisson(6 + 4 * away_rates)
+    hst = np.maximum(rng.binomial(hs, 0.35), fthg)
+    ast = np.maximum(rng.binomial(as_, 0.35), ftag)
+    hs, as_ = np.maximum(hs, hst), np.maximum(as_, ast)
+
+    df = pd.DataFrame({
+        'Div': code,
+        'Date': [d.strftime('%d/%m/%Y') for d in dates],
+        'Time': rng.choice(['12:30', '15:00', '17:30', '20:00'], n, p=[0.15, 0.55, 0.15, 0.15]),
+        'HomeTeam': np.array(team_names)[homes],
+        'AwayTeam': np.array(team_names)[aways],
+        'FTHG': fthg,
+        'FTAG': ftag,
+        'FTR': np.select([fthg > ftag, fthg < ftag], ['H', 'A'], 'D'),
+        'HTHG': hthg,
+        'HTAG': htag,
+        'HTR': np.select([hthg > htag, hthg < htag], ['H', 'A'], 'D'),
+        'Referee': rng.choice(REFEREES, n),
+        'HS': hs,
+        'AS': as_,
+        'HST': hst,
+        'AST': ast,
+        'HF': rng.poisson(11, n),
+        'AF': rng.poisson(11.5, n),
+        'HC': rng.poisson(3 + 1.5 * home_rates),
+        'AC': rng.poisson(3 + 1.5 * away_rates),
+        'HY': rng.poisson(1.6, n),
+        'AY': rng.poisson(1.9, n),
+        'HR': rng.binomial(1, 0.04, n),
+        'AR': rng.binomial(1, 0.05, n),
+    }, columns=MATCH_COLUMNS)
+
+    home, draw, away, over = market_probabilities(home_rates, away_rates)
+    odds = {}
+    for bookmaker, margin in BOOKMAKERS.items():
+        for outcome, probabilities in zip('HDA', (home, draw, away)):
+            odds[f'{bookmaker}{outcome}'] = _odds(probabilities, margin, rng)
+    for outcome in 'HDA':
+        prices = np.stack([odds[f'{bookmaker}{outcome}'] for bookmaker in BOOKMAKERS])
+        odds[f'Max{outcome}'] = prices.max(axis=0)
+        odds[f'Avg{outcome}'] = np.round(prices.mean(axis=0), 2)
+    for prefix, margin in (('B365', 0.05), ('P', 0.025), ('Max', 0.015), ('Avg', 0.04)):
+        odds[f'{prefix}>2.5'] = _odds(over, margin, rng)
+        odds[f'{prefix}<2.5'] = _odds(1 - over, margin, rng)
+    return pd.concat([df, pd.DataFrame(odds)], axis=1), years
+
+
+# Write a dataset of several leagues with a manifest for extract.use_dataset
+def generate(directory, num_leagues=7, num_teams=20, seasons=2, last_season_start=2024, seed=0):
+    """
+    Each league gets a historic file with every season but the last and a current
+    season file, like the bundled resources.
+
+    :return: The manifest.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        'generator': {'leagues': num_leagues, 'teams': num_teams, 'seasons': seasons,
+                      'last_season_start': last_season_start, 'seed': seed},
+        'leagues': {},
+    }
+    for i in range(num_leagues):
+        code, historic = f'L{i:02d}', f'l{i:02d}h'
+        team_names = [f'{code} Team {j:02d}' for j in range(num_teams)]
+        df, years = generate_league(code, team_names, seasons, last_season_start, rng)
+        current = years == last_season_start
+        df[~current].to_csv(os.path.join(directory, f'{historic}.csv'), index=False)
+        df[current].to_csv(os.path.join(directory, f'{code}.csv'), index=False)
+        manifest['leagues'][f'Synthetic League {i:02d}'] = {'codes': [code, historic], 'teams': team_names, 'rows': len(df)}
+
+    with open(os.path.join(directory, ex.MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate football-data.co.uk style csv files for scaling tests.')
+    parser.add_argument('output', help='Dataset directory, use it with --data or RESOURCES_DIR')
+    parser.add_argument('--leagues', type=int, default=7)
+    parser.add_argument('--teams', type=int, default=20, help='Teams per league')
+    parser.add_argument('--seasons', type=int, default=2, help='Seasons per league, the last one is the current season')
+    parser.add_argument('--last-season-start', type=int, default=2024, help='Year the current season starts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.seasons < 2 or args.teams < 2:
+        parser.error('need at least 2 seasons and 2 teams')
+
+    start = time.perf_counter()
+    manifest = generate(args.output, args.leagues, args.teams, args.seasons, args.last_season_start, args.seed)
+    rows = sum(league['rows'] for league in manifest['leagues'].values())
+    print(f"{len(manifest['leagues'])} leagues, {rows} matches in {args.output} ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,104 @@
+import numpy as np
+
+import registry
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _group_positions(keys, offset=0):
+    """
+    Group row positions by key.
+
+    :param keys: One key per row.
+    :param offset: Position of the first row in the league frame.
+    :return: A dict key -> ascending row positions.
+    """
+    groups = {}
+    for position, key in enumerate(keys, start=offset):
+        groups.setdefault(key, []).append(position)
+    return {key: np.array(positions, dtype=np.int64) for key, positions in groups.items()}
+
+
+def _merge(target, groups):
+    for key, positions in groups.items():
+        if key in target:
+            target[key] = np.concatenate([target[key], positions])
+        else:
+            target[key] = positions
+
+
+# Build the lookup index of a date sorted league frame
+def build_index(df):
+    """
+    Map teams and fixtures to their row positions in a league frame.
+
+    Positions are in ascending date order because the frame is sorted by date,
+    so the latest games of a team are a slice off the end of its array. Teams are
+    keyed by their registry ID (see registry.py).
+
+    :param df: The league frame, sorted by date.
+    :return: A dict with 'home', 'away' and 'team' (team ID -> positions),
+             'pair' (sorted ID pair -> positions), 'fixture' ((home ID, away ID) -> positions)
+             and 'size', the number of indexed rows.
+    """
+    index = {'home': {}, 'away': {}, 'team': {}, 'pair': {}, 'fixture': {}, 'size': 0}
+    return extend_index(index, df, 0)
+
+
+# Copy an index so it can be extended while readers still use the original
+def copy_index(index):
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in index.items()}
+
+
+# Add the rows appended to a league frame since the index was built
+def extend_index(index, df, start=None):
+    """
+    :param index: An index returned by `build_index`.
+    :param df: The league frame, whose first `index['size']` rows are unchanged
+               and whose new rows are not older than the indexed ones.
+    :param start: First row to index, defaults to `index['size']`.
+    :return: The updated index.
+    """
+    start = index['size'] if start is None else start
+    home_teams = registry.ids(df['HomeTeam'].iloc[start:].tolist())
+    away_teams = registry.ids(df['AwayTeam'].iloc[start:].tolist())
+
+    home = _group_positions(home_teams, start)
+    away = _group_positions(away_teams, start)
+    _merge(index['home'], home)
+    _merge(index['away'], away)
+    for team in set(home) | set(away):
+        index['team'][team] = np.union1d(index['home'].get(team, _EMPTY), index['away'].get(team, _EMPTY))
+
+    pairs = [(min(fixture), max(fixture)) for fixture in zip(home_teams, away_teams)]
+    _merge(index['pair'], _group_positions(pairs, start))
+    _merge(index['fixture'], _group_positions(list(zip(home_teams, away_teams)), start))
+
+    index['size'] = len(df)
+    return index
+
+
+def _latest(df, positions, num_games):
+    # Most recent first, like sort_values(by='Date', ascending=False).head(num_games)
+    return df.iloc[positions[::-1][:num_games]]
+
+
+# Get last `num_games` games of a team (by ID), optionally only its home or away games
+def latest_games(index, df, team, num_games=5, location=None):
+    if location is None:
+        positions = index['team'].get(team, _EMPTY)
+    elif location in ('home', 'away'):
+        positions = index[location].get(team, _EMPTY)
+    else:
+        raise ValueError("Invalid location. Use 'home' or 'away'.")
+    return _latest(df, positions, num_games)
+
+
+# Get last `num_games` H2H games between two teams, at either venue
+def latest_h2h_games(index, df, team1, team2, num_games=2):
+    return _latest(df, index['pair'].get((min(team1, team2), max(team1, team2)), _EMPTY), num_games)
+
+
+# Get last `num_games` H2H games with `home_team` at home
+def latest_fixture_games(index, df, home_team, away_team, num_games=2):
+    return _latest(df, index['fixture'].get((home_team, away_team), _EMPTY), num_games)
@@ -0,0 +1,89 @@
+"""
+Fixtures shared by the tests: a temporary resources directory standing in for
+RESOURCES_DIR, and a local `http.server` standing in for FOOTBALL_DATA_URL.
+"""
+import functools
+import http.server
+import os
+import shutil
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ['REFRESH_INTERVAL'] = '0'
+sys.path.insert(0, ROOT)
+
+import extract as ex  # noqa: E402
+import refresh as rf  # noqa: E402
+import registry  # noqa: E402
+import store  # noqa: E402
+
+
+# Serves the files of a directory, with the 5xx answers a test asks for
+class FeedHandler(http.server.SimpleHTTPRequestHandler):
+    def do_GET(self):
+        feed = self.server.feed
+        with feed.lock:
+            feed.requests.append((self.path, dict(self.headers)))
+            failures = feed.failures.get(self.path, 0)
+            if failures:
+                feed.failures[self.path] = failures - 1
+        if failures:
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class Feed:
+    def __init__(self, directory, url):
+        self.directory = directory
+        self.url = url
+        self.lock = threading.Lock()
+        # (path, headers) of every request
+        self.requests = []
+        # Path -> number of 503 answers before the file is served
+        self.failures = {}
+
+    # Put a file at <season>/<code>.csv
+    def publish(self, season, code, content):
+        path = os.path.join(self.directory, season, f'{code}.csv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def paths(self):
+        with self.lock:
+            return [path for path, _ in self.requests]
+
+
+# Local feed server on a free port, used by refresh.py and backfill.py for the test
+@pytest.fixture
+def feed(tmp_path, monkeypatch):
+    directory = tmp_path / 'feed'
+    directory.mkdir()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(FeedHandler, directory=str(directory)))
+    server.feed = Feed(str(directory), f'http://127.0.0.1:{server.server_port}')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(rf, 'BASE_URL', server.feed.url)
+    yield server.feed
+    server.shutdown()
+    server.server_close()
+
+
+# Empty resources directory with the team registry of the bundled one
+@pytest.fixture
+def resources(tmp_path, monkeypatch):
+    directory = tmp_path / 'resources'
+    directory.mkdir()
+    shutil.copy(os.path.join(ROOT, 'resources', registry.REGISTRY_FILE), directory)
+    monkeypatch.setattr(ex, 'resources_dir', str(directory))
+    store.clear()
+    yield str(directory)
+    store.clear()
@@ -0,0 +1,162 @@
+"""
+backfill.py against a local feed server (see conftest.py):
+
+    python -m pytest tests/test_backfill.py
+"""
+import pandas as pd
+import pytest
+
+import backfill
+import refresh as rf
+
+EPL = 'English Premier League'
+
+
+def csv_bytes(header, rows, encoding='utf-8'):
+    return ''.join(','.join(str(value) for value in line) + '\n' for line in [header] + rows).encode(encoding)
+
+
+# A season file in the current format, `rows` as (date, home team, away team, home goals, away goals)
+def season_csv(code, rows, extra=None):
+    header = backfill.COLUMNS + list(extra or {})
+    lines = []
+    for date, home_team, away_team, home_goals, away_goals in rows:
+        result = 'H' if home_goals > away_goals else 'A' if home_goals < away_goals else 'D'
+        values = dict.fromkeys(backfill.COLUMNS, 1)
+        values.update(Div=code, Date=date, Time='15:00', HomeTeam=home_team, AwayTeam=away_team, FTHG=home_goals,
+                      FTAG=away_goals, FTR=result, HTR=result, Referee='M Dean', **(extra or {}))
+        lines.append([values[column] for column in header])
+    return csv_bytes(header, lines)
+
+
+# Code of the one season before the current one
+@pytest.fixture
+def last_season():
+    return rf.season_code(rf.season_year() - 1)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(backfill, 'BACKOFF', 0)
+
+
+def test_read_season_cuts_rows_longer_than_the_header(tmp_path):
+    # The first data row has one field too many, it must not become an index column
+    path = tmp_path / 'E0.csv'
+    path.write_bytes(csv_bytes(['Div', 'Date', 'HT', 'AT', 'FTHG', 'FTAG', 'FTR'], [
+        ['E0', '12/08/00', 'Charlton', 'Man City', 4, 0, 'H', 'extra'],
+        ['E0', '19/08/00', 'Chelsea', 'West Ham', 4, 2, 'H'],
+    ]))
+    df = backfill.read_season(str(path), EPL)
+    assert df['Div'].tolist() == ['E0', 'E0']
+    assert df['Date'].tolist() == [pd.Timestamp(2000, 8, 12), pd.Timestamp(2000, 8, 19)]
+    assert df['HomeTeam'].tolist() == ['Charlton', 'Chelsea']
+    assert df['AwayTeam'].tolist() == ['Man City', 'West Ham']
+    assert df['FTR'].tolist() == ['H', 'H']
+
+
+def test_a_league_failing_to_merge_does_not_stop_the_others(feed, resources, last_season):
+    feed.publish(last_season, 'E0', csv_bytes(['Div', 'Date', 'HomeTeam', 'AwayTeam'], [['E0', 'not a date', 'Arsenal', 'Chelsea']]))
+    feed.publish(last_season, 'E1', season_csv('E1', [('10/08/2024', 'Leeds', 'Burnley', 2, 1)]))
+
+    summary = backfill.backfill([EPL, 'Championship'], first=rf.season_year() - 1, workers=2)
+    assert summary[EPL]['matches'] is None
+    assert summary['Championship']['matches'] == 1
+    assert backfill.read_progress() == {'E0': {last_season: 'downloaded'}, 'E1': {last_season: 'merged'}}
+    assert pd.read_csv(f'{resources}/c.csv')['HomeTeam'].tolist() == ['Leeds']
+
+
+def test_missing_seasons_are_recorded_and_a_resumed_run_skips_recorded_seasons(feed, resources):
+    first = rf.season_year() - 2
+    seasons = backfill.past_seasons(first)
+    feed.publish(seasons[1], 'E0', season_csv('E0', [('10/08/2024', 'Arsenal', 'Chelsea', 2, 1)]))
+
+    summary = backfill.backfill([EPL], first=first, workers=2)
+    assert (summary[EPL]['downloaded'], summary[EPL]['missing'], summary[EPL]['failed']) == (1, 1, 0)
+    assert backfill.read_progress() == {'E0': {seasons[0]: 'missing', seasons[1]: 'merged'}}
+
+    requests = len(feed.paths())
+    summary = backfill.backfill([EPL], first=first, workers=2)
+    assert len(feed.paths()) == requests
+    assert summary[EPL] == {'downloaded': 0, 'missing': 0, 'failed': 0, 'matches': None}
+
+
+def test_server_errors_are_retried(feed, resources, last_season):
+    feed.publish(last_season, 'E0', season_csv('E0', [('10/08/2024', 'Arsenal', 'Chelsea', 2, 1)]))
+    feed.failures[f'/{last_season}/E0.csv'] = 2
+
+    summary = backfill.backfill([EPL], first=rf.season_year() - 1)
+    assert summary[EPL]['downloaded'] == 1
+    assert feed.paths().count(f'/{last_season}/E0.csv') == 3
+    assert backfill.read_progress() == {'E0': {last_season: 'merged'}}
+
+
+def test_a_failed_season_is_downloaded_again_by_the_next_run(feed, resources, last_season, monkeypatch):
+    monkeypatch.setattr(backfill, 'RETRIES', 0)
+    feed.publish(last_season, 'E0', season_csv('E0', [('10/08/2024', 'Arsenal', 'Chelsea', 2, 1)]))
+    feed.failures[f'/{last_season}/E0.csv'] = 1
+
+    assert backfill.backfill([EPL], first=rf.season_year() - 1)[EPL]['failed'] == 1
+    assert backfill.read_progress() == {}
+    assert backfill.backfill([EPL], first=rf.season_year() - 1)[EPL]['downloaded'] == 1
+
+
+def test_read_season_normalizes_old_files(tmp_path):
+    # latin-1, no Div column, HT/AT team columns, two-digit years and team aliases
+    path = tmp_path / 'SP1.csv'
+    path.write_bytes(csv_bytes(['Date', 'HT', 'AT', 'FTHG', 'FTAG', 'FTR', 'Referee'], [
+        ['26/08/01', 'Atletico Madrid', 'Málaga', 1, 1, 'D', 'Iturralde González'],
+        ['02/09/01', 'Athletic Bilbao', 'Alavés', 0, 2, 'A', ''],
+        [''] * 7,
+    ], encoding='latin-1'))
+    df = backfill.read_season(str(path), 'LaLiga')
+    assert df['Div'].tolist() == ['SP1', 'SP1']
+    assert df['Date'].tolist() == [pd.Timestamp(2001, 8, 26), pd.Timestamp(2001, 9, 2)]
+    assert df['HomeTeam'].tolist() == ['Ath Madrid', 'Ath Bilbao']
+    assert df['AwayTeam'].tolist() == ['Málaga', 'Alavés']
+    assert df['Referee'].tolist()[0] == 'Iturralde González'
+
+
+def test_add_to_history_keeps_cells_as_written_and_replaces_matches_by_key(tmp_path, resources):
+    history = f'{resources}/epl.csv'
+    with open(history, 'wb') as file:
+        file.write(season_csv('E0', [('10/08/2024', 'Arsenal', 'Chelsea', 2, 1),
+                                     ('17/08/2024', 'Fulham', 'Everton', 0, 0)], extra={'B365H': 8}))
+    before = open(history).read().splitlines()
+    season = tmp_path / 'season.csv'
+    season.write_bytes(season_csv('E0', [('17/08/2024', 'Fulham', 'Everton', 3, 0),
+                                         ('24/08/2024', 'Chelsea', 'Fulham', 1, 2)], extra={'B365H': '2.50'}))
+
+    assert backfill.add_to_history(EPL, [str(season)]) == 3
+    after = open(history).read().splitlines()
+    assert after[:2] == before[:2]
+    assert after[2].startswith('E0,17/08/2024,15:00,Fulham,Everton,3,0,H,')
+    assert after[2].endswith(',2.50')
+    assert after[3].startswith('E0,24/08/2024,15:00,Chelsea,Fulham,1,2,A,')
+
+
+def test_refresh_rolls_the_previous_season_into_the_history(feed, resources, monkeypatch, capsys):
+    monkeypatch.setattr(rf, 'season_year', lambda date=None: 2024)
+    feed.publish('2425', 'E0', season_csv('E0', [('17/08/2024', 'Fulham', 'Everton', 0, 0)]))
+    with open(f'{resources}/epl.csv', 'wb') as file:
+        file.write(season_csv('E0', [('19/08/2023', 'Arsenal', 'Chelsea', 2, 1)]))
+    assert rf.refresh_league('E0', notify=False) == 'updated'
+    assert rf.read_meta('E0')['season'] == '2425'
+
+    # The 2025-26 feed is out: the stored 2024-25 matches move into the historic file
+    monkeypatch.setattr(rf, 'season_year', lambda date=None: 2025)
+    feed.publish('2526', 'E0', season_csv('E0', [('16/08/2025', 'Chelsea', 'Fulham', 1, 2)]))
+    assert rf.refresh_league('E0', force=True, notify=False) == 'updated'
+    assert rf.read_meta('E0')['season'] == '2526'
+    assert pd.read_csv(f'{resources}/epl.csv')['HomeTeam'].tolist() == ['Arsenal', 'Fulham']
+    assert pd.read_csv(f'{resources}/E0.csv')['HomeTeam'].tolist() == ['Chelsea']
+    assert feed.paths()[-1] == '/2526/E0.csv'
+    assert 'If-Modified-Since' not in feed.requests[-1][1]
+    assert 'missing from its history' not in capsys.readouterr().out
+
+    # Skipping a season merges the stored one and logs the gap
+    monkeypatch.setattr(rf, 'season_year', lambda date=None: 2027)
+    feed.publish('2728', 'E0', season_csv('E0', [('14/08/2027', 'Everton', 'Chelsea', 0, 1)]))
+    assert rf.refresh_league('E0', force=True, notify=False) == 'updated'
+    assert pd.read_csv(f'{resources}/epl.csv')['HomeTeam'].tolist() == ['Arsenal', 'Fulham', 'Chelsea']
+    assert 'Seasons 2627 of E0 are missing from its history' in capsys.readouterr().out
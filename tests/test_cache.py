@@ -0,0 +1,128 @@
+"""
+The prediction cache of cache.py:
+
+    python -m pytest tests/test_cache.py
+"""
+import os
+
+import pytest
+
+import cache
+import predict as pr
+
+LEAGUE = 'English Premier League'
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', None)
+    monkeypatch.setattr(cache, '_counters', dict.fromkeys(cache._counters, 0))
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'predictions'))
+    monkeypatch.setattr(cache, '_puts_since_trim', 0)
+    return tmp_path / 'predictions'
+
+
+# Key of a prediction computed from a data version of LEAGUE, as predict.py builds them
+def key(home_team, away_team, data_version, engine='form', windows=None):
+    return cache.make_key(LEAGUE, home_team, away_team, f'{data_version}-{pr.WEIGHTS_VERSION}',
+                          pr.fixture_variant(engine, windows))
+
+
+def test_a_league_update_carries_over_the_fixtures_of_unchanged_teams():
+    windows = dict(pr.DEFAULT_WINDOWS, num_games=10)
+    cache.put(key('Arsenal', 'Chelsea', 'v1'), {'fixture': 1})
+    cache.put(key('Everton', 'Fulham', 'v1'), {'fixture': 2})
+    cache.put(key('Everton', 'Fulham', 'v1', windows=windows), {'fixture': 3})
+    cache.put(key('Everton', 'Fulham', 'v1', 'poisson'), {'fixture': 4})
+    cache.put(key('Fulham', 'Arsenal', 'v1'), {'fixture': 5})
+    other = cache.make_key('Serie A', 'Inter', 'Milan', 'w1', '')
+    cache.put(other, {'fixture': 6})
+
+    pr._on_league_update(LEAGUE, 'v1', 'v2', {'Arsenal'})
+    assert cache.get(key('Everton', 'Fulham', 'v2')) == {'fixture': 2}
+    assert cache.get(key('Everton', 'Fulham', 'v2', windows=windows)) == {'fixture': 3}
+    # The teams of a fixture with a new match lose it, models fitted on the whole league too
+    assert cache.get(key('Arsenal', 'Chelsea', 'v2')) is None
+    assert cache.get(key('Fulham', 'Arsenal', 'v2')) is None
+    assert cache.get(key('Everton', 'Fulham', 'v2', 'poisson')) is None
+    assert cache.get(key('Everton', 'Fulham', 'v1')) is None
+    assert cache.get(other) == {'fixture': 6}
+
+
+def test_a_rebuilt_league_drops_every_entry():
+    cache.put(key('Everton', 'Fulham', 'v1'), {'fixture': 1})
+    pr._on_league_update(LEAGUE, 'v1', 'v2', None)
+    assert cache.get(key('Everton', 'Fulham', 'v2')) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_an_update_from_another_version_is_ignored():
+    cache.put(key('Everton', 'Fulham', 'v2'), {'fixture': 1})
+    pr._on_league_update(LEAGUE, 'v1', 'v3', set())
+    assert cache.get(key('Everton', 'Fulham', 'v2')) == {'fixture': 1}
+    assert cache.get(key('Everton', 'Fulham', 'v3')) is None
+
+
+def test_the_least_recently_used_entry_is_evicted_first(monkeypatch):
+    monkeypatch.setattr(cache, 'MAX_ENTRIES', 3)
+    keys = [key(home_team, 'Chelsea', 'v1') for home_team in ('Arsenal', 'Everton', 'Fulham', 'Wolves')]
+    for i, fixture_key in enumerate(keys[:3]):
+        cache.put(fixture_key, {'fixture': i})
+    assert cache.get(keys[0]) == {'fixture': 0}
+
+    cache.put(keys[3], {'fixture': 3})
+    assert cache.get(keys[1]) is None
+    assert [cache.get(fixture_key) for fixture_key in (keys[0], keys[2], keys[3])] == [{'fixture': 0}, {'fixture': 2}, {'fixture': 3}]
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['entries'] == 3
+
+
+def test_new_league_data_misses_and_drops_the_old_entries():
+    cache.put(key('Arsenal', 'Chelsea', 'v1'), {'fixture': 1})
+    cache.put(key('Arsenal', 'Chelsea', 'v1', 'poisson'), {'fixture': 2})
+    other = cache.make_key('Serie A', 'Inter', 'Milan', 'w1', '')
+    cache.put(other, {'fixture': 3})
+
+    assert cache.get(key('Arsenal', 'Chelsea', 'v2')) is None
+    assert cache.get(key('Arsenal', 'Chelsea', 'v1')) is None
+    assert cache.get(other) == {'fixture': 3}
+    counters = cache.stats()
+    assert (counters['hits'], counters['misses'], counters['invalidations']) == (1, 2, 2)
+
+
+def test_other_workers_read_the_shared_directory(shared):
+    cache.put(key('Arsenal', 'Chelsea', 'v1'), {'fixture': 1})
+    assert len(os.listdir(shared)) == 1
+
+    # A worker with nothing in memory
+    cache.clear()
+    assert cache.get(key('Arsenal', 'Chelsea', 'v1')) == {'fixture': 1}
+    assert cache.get(key('Arsenal', 'Chelsea', 'v2')) is None
+    assert cache.stats()['shared_hits'] == 1
+
+
+def test_the_shared_directory_is_trimmed_to_its_least_recently_used_files(shared, monkeypatch):
+    monkeypatch.setattr(cache, 'MAX_FILES', 2)
+    keys = [key(home_team, 'Chelsea', 'v1') for home_team in ('Arsenal', 'Everton', 'Fulham', 'Wolves')]
+    for i, fixture_key in enumerate(keys[:2]):
+        cache.put(fixture_key, {'fixture': i})
+        os.utime(cache._file_path(fixture_key), (1000 + i, 1000 + i))
+
+    cache.put(keys[2], {'fixture': 2})
+    assert not os.path.exists(cache._file_path(keys[0]))
+    assert len(os.listdir(shared)) == 2
+
+    # Reading a file marks it as recently used
+    cache.clear()
+    os.utime(cache._file_path(keys[2]), (2000, 2000))
+    assert cache.get(keys[1]) == {'fixture': 1}
+    cache.put(keys[3], {'fixture': 3})
+    assert sorted(os.listdir(shared)) == sorted(os.path.basename(cache._file_path(k)) for k in (keys[1], keys[3]))
+    assert cache.stats()['evictions'] == 2
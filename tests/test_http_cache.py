@@ -0,0 +1,120 @@
+"""
+ETag, compression and 304 negotiation of http_cache.py:
+
+    python -m pytest tests/test_http_cache.py
+"""
+import gzip
+import json
+
+import pytest
+from flask import Flask, request
+
+import http_cache as hc
+
+VERSION = 'abc123'
+PAYLOAD = {'stats': {'Inter': [1.5, 0.25]}, 'league': 'Serie A'}
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+
+    @app.route('/stats')
+    def stats():
+        response = hc.not_modified(request, VERSION)
+        if response is not None:
+            return response
+        return hc.respond(request, VERSION, hc.encode(PAYLOAD))
+
+    return app.test_client()
+
+
+def test_bodies_only_depend_on_the_payload():
+    bodies = hc.encode(PAYLOAD)
+    assert bodies == hc.encode(json.loads(json.dumps(PAYLOAD)))
+    assert json.loads(bodies['identity']) == PAYLOAD
+    assert gzip.decompress(bodies['gzip']) == bodies['identity']
+    assert set(bodies) == {'identity'} | set(hc.ENCODINGS)
+
+
+def test_the_best_accepted_encoding_is_served(client):
+    response = client.get('/stats', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == f'"{VERSION}-gzip"'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Cache-Control'] == f'public, max-age={hc.MAX_AGE}'
+    assert json.loads(gzip.decompress(response.data)) == PAYLOAD
+
+    response = client.get('/stats', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['ETag'] == f'"{VERSION}"'
+    assert json.loads(response.data) == PAYLOAD
+
+    response = client.get('/stats', headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+    assert 'Content-Encoding' not in response.headers
+
+
+@pytest.mark.parametrize('if_none_match', [
+    f'"{VERSION}"',
+    f'W/"{VERSION}"',
+    f'"{VERSION}-gzip"',
+    f'W/"{VERSION}-br"',
+    '*',
+    f'"stale", W/"{VERSION}-gzip"',
+    f' "stale" ,"{VERSION}" ',
+])
+def test_a_held_version_is_not_modified(client, if_none_match):
+    response = client.get('/stats', headers={'If-None-Match': if_none_match, 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == f'"{VERSION}-gzip"'
+
+
+@pytest.mark.parametrize('if_none_match', ['', '"stale"', f'"{VERSION}0"', f'"x{VERSION}"', f'"{VERSION}-deflate"', VERSION])
+def test_another_version_gets_the_body(client, if_none_match):
+    response = client.get('/stats', headers={'If-None-Match': if_none_match})
+    assert response.status_code == 200
+    assert json.loads(response.data) == PAYLOAD
+
+
+def test_stats_bodies_are_built_once_per_key(monkeypatch):
+    monkeypatch.setattr(hc, 'MAX_BODIES', 2)
+    hc.clear()
+    calls = []
+
+    def payload(name):
+        return lambda: calls.append(name) or {'stats': name}
+
+    first = hc.stats_bodies(('Serie A', 'Inter', 'Milan', 'v1'), payload('first'))
+    assert hc.stats_bodies(('Serie A', 'Inter', 'Milan', 'v1'), payload('again')) is first
+    hc.stats_bodies(('Serie A', 'Inter', 'Milan', 'v2'), payload('second'))
+    hc.stats_bodies(('Serie A', 'Milan', 'Inter', 'v2'), payload('third'))
+    # The least recently used body was dropped
+    hc.stats_bodies(('Serie A', 'Inter', 'Milan', 'v1'), payload('fourth'))
+    assert calls == ['first', 'second', 'third', 'fourth']
+    hc.clear()
+
+
+def test_a_revalidation_of_get_stats_is_answered_without_scoring(monkeypatch):
+    import app
+    import predict as pr
+
+    calls = []
+    get_stats = pr.get_stats
+    monkeypatch.setattr(pr, 'get_stats', lambda *args: calls.append(args) or get_stats(*args))
+    hc.clear()
+    client = app.app.test_client()
+    query = {'league': 'Serie A', 'home_team': 'Inter', 'away_team': 'Milan'}
+
+    response = client.get('/get_stats', query_string=query, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'stats' in json.loads(gzip.decompress(response.data))
+    etag = response.headers['ETag']
+
+    response = client.get('/get_stats', query_string=query, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    response = client.get('/get_stats', query_string=dict(query, engine='poisson'), headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(calls) == 2
+    hc.clear()
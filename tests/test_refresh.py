@@ -0,0 +1,115 @@
+"""
+refresh.py against a local feed server (see conftest.py):
+
+    python -m pytest tests/test_refresh.py
+"""
+import fcntl
+import os
+import threading
+
+import pytest
+
+import extract as ex
+import refresh as rf
+
+CONTENT = b'Div,Date,HomeTeam,AwayTeam,FTHG,FTAG,FTR\nE0,16/08/2025,Chelsea,Fulham,1,2,A\n'
+
+
+@pytest.fixture(autouse=True)
+def season(monkeypatch):
+    monkeypatch.setattr(rf, 'season_year', lambda date=None: 2025)
+    return '2526'
+
+
+@pytest.fixture
+def listeners(monkeypatch):
+    monkeypatch.setattr(rf, '_listeners', [])
+
+
+def stored(resources, code='E0'):
+    with open(os.path.join(resources, f'{code}.csv'), 'rb') as file:
+        return file.read()
+
+
+def test_conditional_get(feed, resources, season):
+    feed.publish(season, 'E0', CONTENT)
+
+    assert rf.refresh_league('E0', notify=False) == 'updated'
+    assert stored(resources) == CONTENT
+    assert rf.read_meta('E0')['last_modified']
+
+    # Within the TTL upstream is not asked, after it the validators get a 304
+    assert rf.refresh_league('E0', notify=False) == 'fresh'
+    assert len(feed.requests) == 1
+    assert rf.refresh_league('E0', ttl=0, notify=False) == 'not_modified'
+    assert feed.requests[-1][1]['If-Modified-Since'] == rf.read_meta('E0')['last_modified']
+    assert stored(resources) == CONTENT
+
+
+def test_a_held_lock_means_busy(feed, resources, season):
+    feed.publish(season, 'E0', CONTENT)
+    with open(os.path.join(resources, '.E0.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert rf.refresh_league('E0', force=True, notify=False) == 'busy'
+    assert feed.requests == []
+    assert rf.refresh_league('E0', force=True, notify=False) == 'updated'
+
+
+def test_failures_keep_the_stored_feed(feed, resources, season, monkeypatch):
+    feed.publish(season, 'E0', CONTENT)
+    assert rf.refresh_league('E0', notify=False) == 'updated'
+    meta = rf.read_meta('E0')
+
+    feed.failures[f'/{season}/E0.csv'] = 1
+    assert rf.refresh_league('E0', force=True, notify=False) == 'failed'
+    os.remove(os.path.join(feed.directory, season, 'E0.csv'))
+    assert rf.refresh_league('E0', force=True, notify=False) == 'failed'
+    monkeypatch.setattr(rf, 'BASE_URL', 'http://127.0.0.1:1')
+    assert rf.refresh_league('E0', force=True, notify=False) == 'failed'
+    assert stored(resources) == CONTENT
+    assert rf.read_meta('E0') == meta
+
+
+def test_an_interrupted_write_keeps_the_old_file(resources, monkeypatch):
+    path = os.path.join(resources, 'E0.csv')
+    rf.atomic_write(path, CONTENT)
+
+    def fail(fd):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'fsync', fail)
+    with pytest.raises(OSError):
+        rf.atomic_write(path, b'partial')
+    assert stored(resources) == CONTENT
+    assert not [name for name in os.listdir(resources) if name.endswith('.tmp')]
+
+
+def test_refresh_all_notifies_the_updated_leagues_once(feed, resources, season, listeners):
+    calls = []
+    rf.add_listener(calls.append)
+    feed.publish(season, 'E0', CONTENT)
+    feed.publish(season, 'E1', CONTENT.replace(b'E0,', b'E1,'))
+    statuses = rf.refresh_all()
+    assert len(statuses) == len(ex.league_codes)
+    assert statuses['E0'] == statuses['E1'] == 'updated'
+    assert {status for code, status in statuses.items() if code not in ('E0', 'E1')} == {'failed'}
+    assert calls == [['E0', 'E1']]
+
+    # Nothing new upstream, nothing to notify
+    assert set(rf.refresh_all(ttl=0).values()) == {'not_modified', 'failed'}
+    assert len(calls) == 1
+
+
+def test_a_single_refresh_notifies_the_listeners(feed, resources, season, listeners):
+    notified = threading.Event()
+    calls = []
+
+    def listener(codes):
+        calls.append(codes)
+        notified.set()
+
+    rf.add_listener(listener)
+    feed.publish(season, 'E0', CONTENT)
+    assert rf.refresh_league('E0') == 'updated'
+    assert notified.wait(5)
+    assert calls == [['E0']]
@@ -0,0 +1,89 @@
+"""
+Coalescing of concurrent identical calls by singleflight.py:
+
+    python -m pytest tests/test_singleflight.py
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import singleflight as sf
+
+CALLERS = 8
+
+
+@pytest.fixture(autouse=True)
+def counters(monkeypatch):
+    monkeypatch.setattr(sf, '_counters', dict.fromkeys(sf._counters, 0))
+    monkeypatch.setattr(sf, 'LOCK_DIR', None)
+
+
+# Call `sf.do` from CALLERS threads at once, `function` running until they all wait for it
+def call_together(key, function):
+    release = threading.Event()
+    runs = []
+
+    def run():
+        runs.append(threading.current_thread().name)
+        assert release.wait(5)
+        return function()
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        futures = [pool.submit(sf.do, key, run) for _ in range(CALLERS)]
+        deadline = time.monotonic() + 5
+        while sf.stats()['coalesced'] < CALLERS - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(5))
+            except ValueError as e:
+                outcomes.append(e)
+    return runs, outcomes
+
+
+def test_concurrent_identical_calls_run_once_and_share_the_result():
+    runs, results = call_together(('Serie A', 'Inter', 'Milan'), lambda: {'stats': object()})
+    assert len(runs) == 1
+    assert all(result is results[0] for result in results)
+    assert sf.stats() == {'calls': 1, 'coalesced': CALLERS - 1, 'inflight': 0}
+
+
+def test_concurrent_identical_calls_share_the_exception():
+    error = ValueError('not enough data')
+
+    def fail():
+        raise error
+
+    runs, errors = call_together(('Serie A', 'Inter', 'Milan'), fail)
+    assert len(runs) == 1
+    assert all(e is error for e in errors)
+    assert sf.stats()['inflight'] == 0
+
+
+def test_finished_calls_are_not_cached():
+    calls = []
+    for _ in range(3):
+        assert sf.do('key', lambda: calls.append(1) or len(calls)) == len(calls)
+    assert len(calls) == 3
+    assert sf.stats() == {'calls': 3, 'coalesced': 0, 'inflight': 0}
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        blocked = pool.submit(sf.do, 'first', lambda: release.wait(5))
+        assert sf.do('second', lambda: 'second') == 'second'
+        release.set()
+        assert blocked.result(5) is True
+    assert sf.stats()['coalesced'] == 0
+
+
+def test_calls_hold_a_lock_file_with_a_lock_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(sf, 'LOCK_DIR', str(tmp_path / 'locks'))
+    assert sf.do(('Serie A', 'Inter', 'Milan'), lambda: 'stats') == 'stats'
+    assert [name.endswith('.lock') for name in os.listdir(tmp_path / 'locks')] == [True]
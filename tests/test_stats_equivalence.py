@@ -0,0 +1,361 @@
+"""
+The vectorized stat extractors of predict.py against the row by row code they
+replaced, on every team and team pair of every league csv in resources/:
+
+    python -m pytest tests
+"""
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ['REFRESH_INTERVAL'] = '0'
+sys.path.insert(0, ROOT)
+
+import predict as pr  # noqa: E402
+import store  # noqa: E402
+
+CSV_FILES = sorted(glob.glob(os.path.join(ROOT, 'resources', '*.csv')))
+
+
+# The row by row extractors of the baseline predict.py (commit c0db7fe), unchanged
+
+
+# Function to calculate the last 5 match statistics for a given team.
+def get_team_stats(team, latest_5_games):
+    """
+    Parameters:
+    - team (str): The team for which to calculate the stats.
+    - latest_5_games (DataFrame): The DataFrame containing match data.
+
+    Returns:
+    - dict: A dictionary with calculated statistics for the team.
+    """
+    results = [
+        "Win" if (row['HomeTeam'] == team and row['FTR'] == 'H') or 
+                 (row['AwayTeam'] == team and row['FTR'] == 'A') 
+        else "Lose" if (row['HomeTeam'] == team and row['FTR'] == 'A') or 
+                      (row['AwayTeam'] == team and row['FTR'] == 'H') 
+        else "Draw"
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    goals_for = [
+        row['FTHG'] if (row['HomeTeam'] == team) 
+        else row['FTAG']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    goals_against = [
+        row['FTAG'] if (row['HomeTeam'] == team) 
+        else row['FTHG']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    goals = list(np.add(goals_for, goals_against))
+    
+    btts = [
+        1 if (row['FTHG'] > 0 and row['FTAG'] > 0)
+        else 0
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    shots_on_target_for = [
+        row['HST'] if (row['HomeTeam'] == team) 
+        else row['AST']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    shots_on_target_against = [
+        row['AST'] if (row['HomeTeam'] == team) 
+        else row['HST']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    corners_for = [
+        row['HC'] if (row['HomeTeam'] == team) 
+        else row['AC']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    corners_against = [
+        row['AC'] if (row['HomeTeam'] == team) 
+        else row['HC']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    corners = list(np.add(corners_for, corners_against))
+    
+    cards_for = [
+        row['HY'] + row['HR'] if (row['HomeTeam'] == team) 
+        else row['AY'] + row['AR']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    cards_against = [
+        row['AY'] + row['AR'] if (row['HomeTeam'] == team) 
+        else row['HY'] + row['HR']
+        for _, row in latest_5_games.iterrows()
+    ]
+    
+    cards = list(np.add(cards_for, cards_against))
+
+    # Returning the dictionary of stats
+    team_stats = {
+        "results": results,
+        "goals_for": goals_for,
+        "goals_against": goals_against,
+        "goals": goals,
+        "btts": btts,
+        "shots_on_target_for": shots_on_target_for,
+        "shots_on_target_against": shots_on_target_against,
+        "corners_for": corners_for,
+        "corners_against": corners_against,
+        "corners": corners,
+        "cards_for": cards_for,
+        "cards_against": cards_against,
+        "cards": cards,
+    }
+
+    return team_stats
+
+
+# Function to calculate the last 2 h2h match statistics for given teams.
+def get_h2h_stats(home_team, away_team, latest_games):
+    """
+    Parameters:
+    - team (str): The team for which to calculate the stats.
+    - latest_5_games (DataFrame): The DataFrame containing match data.
+
+    Returns:
+    - dict: A dictionary with calculated statistics for the team.
+    """
+    results = [
+        home_team + " Win" if (row['HomeTeam'] == home_team and row['FTR'] == 'H') or 
+                 (row['AwayTeam'] == home_team and row['FTR'] == 'A') 
+        else away_team + " Win" if (row['HomeTeam'] == home_team and row['FTR'] == 'A') or 
+                      (row['AwayTeam'] == home_team and row['FTR'] == 'H') 
+        else "Draw"
+        for _, row in latest_games.iterrows()
+    ]
+    
+    home_goals = [
+        row['FTHG'] if (row['HomeTeam'] == home_team) 
+        else row['FTAG']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    away_goals = [
+        row['FTHG'] if (row['HomeTeam'] == away_team) 
+        else row['FTAG']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    goals = list(np.add(home_goals, away_goals))
+    
+    btts = [
+        1 if (row['FTHG'] > 0 and row['FTAG'] > 0)
+        else 0
+        for _, row in latest_games.iterrows()
+    ]
+    
+    shots_on_target_for = [
+        row['HST'] if (row['HomeTeam'] == home_team) 
+        else row['AST']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    shots_on_target_against = [
+        row['HST'] if (row['HomeTeam'] == away_team) 
+        else row['AST']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    corners_for = [
+        row['HC'] if (row['HomeTeam'] == home_team) 
+        else row['AC']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    corners_against = [
+        row['HC'] if (row['HomeTeam'] == away_team) 
+        else row['AC']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    corners = list(np.add(corners_for, corners_against))
+    
+    cards_for = [
+        row['HY'] + row['HR'] if (row['HomeTeam'] == home_team) 
+        else row['AY'] + row['AR']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    cards_against = [
+        row['HY'] + row['HR'] if (row['HomeTeam'] == away_team) 
+        else row['AY'] + row['AR']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    cards = list(np.add(cards_for, cards_against))
+
+    # Returning the dictionary of stats
+    home_team_name = home_team.lower().replace(' ', '_')
+    away_team_name = away_team.lower().replace(' ', '_')
+    h2h_stats = {
+        "results": results,
+        f"{home_team_name}_goals": home_goals,
+        f"{away_team_name}_goals": away_goals,
+        "goals": goals,
+        "btts": btts,
+        f"{home_team_name}_shots_on_target": shots_on_target_for,
+        f"{away_team_name}_shots_on_target": shots_on_target_against,
+        f"{home_team_name}_corners": corners_for,
+        f"{away_team_name}_corners": corners_against,
+        "corners": corners,
+        f"{home_team_name}_cards": cards_for,
+        f"{away_team_name}_cards": cards_against,
+        "cards": cards,
+    }
+
+    return h2h_stats
+
+
+# Function to calculate the last 2 h2h home/away match statistics for given teams.
+def get_h2h_home_or_away_stats(home_team, away_team, latest_games):
+    """
+    Parameters:
+    - team (str): The team for which to calculate the stats.
+    - latest_5_games (DataFrame): The DataFrame containing match data.
+
+    Returns:
+    - dict: A dictionary with calculated statistics for the team.
+    """
+    results = [
+        home_team + " Win" if (row['FTR'] == 'H')
+        else away_team + " Win" if (row['FTR'] == 'A')
+        else "Draw"
+        for _, row in latest_games.iterrows()
+    ]
+    
+    home_goals = [
+        row['FTHG']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    away_goals = [
+        row['FTAG']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    goals = list(np.add(home_goals, away_goals))
+    
+    btts = [
+        1 if (row['FTHG'] > 0 and row['FTAG'] > 0)
+        else 0
+        for _, row in latest_games.iterrows()
+    ]
+    
+    shots_on_target_for = [
+        row['HST']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    shots_on_target_against = [
+        row['AST']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    corners_for = [
+        row['HC']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    corners_against = [
+        row['AC']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    corners = list(np.add(corners_for, corners_against))
+    
+    cards_for = [
+        row['HY'] + row['HR']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    cards_against = [
+        row['AY'] + row['AR']
+        for _, row in latest_games.iterrows()
+    ]
+    
+    cards = list(np.add(cards_for, cards_against))
+
+    # Returning the dictionary of stats
+    home_team_name = home_team.lower().replace(' ', '_')
+    away_team_name = away_team.lower().replace(' ', '_')
+    h2h_stats = {
+        "results": results,
+        f"{home_team_name}_goals": home_goals,
+        f"{away_team_name}_goals": away_goals,
+        "goals": goals,
+        "btts": btts,
+        f"{home_team_name}_shots_on_target": shots_on_target_for,
+        f"{away_team_name}_shots_on_target": shots_on_target_against,
+        f"{home_team_name}_corners": corners_for,
+        f"{away_team_name}_corners": corners_against,
+        "corners": corners,
+        f"{home_team_name}_cards": cards_for,
+        f"{away_team_name}_cards": cards_against,
+        "cards": cards,
+    }
+
+    return h2h_stats
+
+
+def _same(value, expected):
+    if isinstance(expected, float) and math.isnan(expected):
+        return isinstance(value, float) and math.isnan(value)
+    return value == expected
+
+
+def assert_equivalent(stats, expected):
+    assert stats.keys() == expected.keys()
+    for key, values in expected.items():
+        assert len(stats[key]) == len(values), key
+        assert all(_same(value, reference) for value, reference in zip(stats[key], values)), key
+
+
+def _teams(df):
+    return sorted(set(df['HomeTeam']) | set(df['AwayTeam']))
+
+
+@pytest.fixture(scope='module', params=CSV_FILES, ids=os.path.basename)
+def matches(request):
+    return store.read_matches(request.param).sort_values(by='Date', kind='stable', ignore_index=True)
+
+
+def test_team_stats(matches):
+    for team in _teams(matches):
+        games = pr.get_latest_games(team, matches)
+        assert_equivalent(pr.get_team_stats(team, games), get_team_stats(team, games))
+        for location in ('home', 'away'):
+            games = pr.get_latest_home_or_away_games(team, matches, location=location)
+            assert_equivalent(pr.get_team_stats(team, games), get_team_stats(team, games))
+
+
+def test_h2h_stats(matches):
+    teams = _teams(matches)
+    for home_team in teams:
+        for away_team in teams:
+            if home_team == away_team:
+                continue
+            games = pr.get_last_2_h2h_games(home_team, away_team, matches)
+            assert_equivalent(pr.get_h2h_stats(home_team, away_team, games),
+                              get_h2h_stats(home_team, away_team, games))
+            games = pr.get_last_2_h2h_home_or_away_games(home_team, away_team, matches)
+            assert_equivalent(pr.get_h2h_home_or_away_stats(home_team, away_team, games),
+                              get_h2h_home_or_away_stats(home_team, away_team, games))
@@ -0,0 +1,118 @@
+"""
+Incremental updates of the league store against a rebuild from scratch:
+
+    python -m pytest tests/test_store.py
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import store
+import team_index as ti
+from conftest import ROOT
+
+EPL = 'English Premier League'
+
+
+@pytest.fixture
+def league(resources, monkeypatch):
+    for path in store.league_files(EPL):
+        shutil.copy(os.path.join(ROOT, 'resources', os.path.basename(path)), path)
+    updates = []
+    monkeypatch.setattr(store, '_subscribers', [])
+    store.subscribe(lambda *update: updates.append(update))
+    return updates
+
+
+def current_season():
+    return pd.read_csv(store.league_files(EPL)[1], dtype=str, keep_default_na=False)
+
+
+def write_current_season(df):
+    path = store.league_files(EPL)[1]
+    df.to_csv(path, index=False)
+    # A rewrite within the same clock tick still has to change the file's signature
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+
+def assert_same_as_rebuild(data):
+    df = store.build_league_frame(store.league_files(EPL))
+    pd.testing.assert_frame_equal(data['df'].reset_index(drop=True), df, check_dtype=False)
+    index = ti.build_index(df)
+    assert data['index'].keys() == index.keys()
+    assert data['index']['size'] == index['size']
+    for name in ('home', 'away', 'team', 'pair', 'fixture'):
+        assert data['index'][name].keys() == index[name].keys(), name
+        for key, positions in index[name].items():
+            assert np.array_equal(data['index'][name][key], positions), (name, key)
+    assert data['keys'] == store.key_positions(df)
+
+
+def test_a_correction_and_an_appended_match(league):
+    before = store.get_league(EPL)
+    rows = current_season()
+    corrected = 3
+    home_team, away_team = rows.loc[corrected, 'HomeTeam'], rows.loc[corrected, 'AwayTeam']
+    rows.loc[corrected, ['FTHG', 'FTR']] = str(int(rows.loc[corrected, 'FTHG']) + 5), 'H'
+    added = rows.iloc[[-1]].copy()
+    added['Date'] = (before['high_water'] + pd.Timedelta(days=1)).strftime('%d/%m/%Y')
+    added[['HomeTeam', 'AwayTeam']] = rows.loc[0, 'AwayTeam'], rows.loc[0, 'HomeTeam']
+    write_current_season(pd.concat([rows, added], ignore_index=True))
+
+    data = store.get_league(EPL)
+    assert len(data['df']) == len(before['df']) + 1
+    assert data['index']['size'] == len(data['df'])
+    assert_same_as_rebuild(data)
+    # Rows before the corrected match are left as they were, the old frame and index too
+    key = ('E0', pd.to_datetime(rows.loc[corrected, 'Date'], dayfirst=True), home_team, away_team)
+    assert data['unchanged_rows'] == data['keys'][key]
+    assert before['df'].loc[data['keys'][key], 'FTHG'] + 5 == data['df'].loc[data['keys'][key], 'FTHG']
+    assert before['index']['size'] == len(before['df'])
+    assert league == [(EPL, before['version'], data['version'],
+                       {home_team, away_team, rows.loc[0, 'HomeTeam'], rows.loc[0, 'AwayTeam']})]
+
+
+def test_a_match_older_than_the_high_water_mark(league):
+    before = store.get_league(EPL)
+    rows = current_season()
+    added = rows.iloc[[0]].copy()
+    added['Date'] = (before['high_water'] - pd.Timedelta(days=30)).strftime('%d/%m/%Y')
+    write_current_season(pd.concat([rows, added], ignore_index=True))
+
+    data = store.get_league(EPL)
+    assert data['unchanged_rows'] == 0
+    assert_same_as_rebuild(data)
+
+
+def test_a_rewrite_with_the_same_matches(league):
+    before = store.get_league(EPL)
+    write_current_season(current_season())
+
+    data = store.get_league(EPL)
+    assert data['version'] != before['version']
+    assert data['df'] is before['df'] and data['index'] is before['index']
+    assert data['unchanged_rows'] == len(data['df'])
+    assert league == [(EPL, before['version'], data['version'], set())]
+
+
+def test_the_leagues_of_a_team_are_those_loaded_with_its_matches(resources):
+    for league in (EPL, 'Championship'):
+        for path in store.league_files(league):
+            shutil.copy(os.path.join(ROOT, 'resources', os.path.basename(path)), path)
+    epl = store.get_league(EPL)
+    epl_only = next(team_id for team_id in epl['index']['team'] if team_id not in store.get_league('Championship')['index']['team'])
+    store.clear()
+
+    epl = store.get_league(EPL)
+    assert store.leagues_of_team(epl_only) == [EPL]
+    assert list(store._leagues) == [EPL]
+    championship = store.get_league('Championship')
+    promoted = sorted(set(epl['index']['team']) & set(championship['index']['team']))
+    assert promoted
+    assert all(store.leagues_of_team(team_id) == [EPL, 'Championship'] for team_id in promoted)
+    assert store.leagues_of_team(epl_only) == [EPL]
+    assert store.leagues_of_team(-1) == []
@@ -0,0 +1,35 @@
+"""
+Parsing of the form windows and as_of date of the requests:
+
+    python -m pytest tests/test_windows.py
+"""
+import pytest
+
+import predict as pr
+
+
+@pytest.mark.parametrize('as_of, expected', [('2024-01-01', '2024-01-01'), ('2024-1-5', '2024-01-05'), ('', None), (None, None)])
+def test_as_of_dates(as_of, expected):
+    assert pr.parse_windows({'as_of': as_of})['as_of'] == expected
+
+
+# The same on every Python version, date.fromisoformat takes the basic format from 3.11
+@pytest.mark.parametrize('as_of', [20240101, '20240101', '2024-02-30', '2024-01-01T00:00', ' 2024-01-01', '01/01/2024', True])
+def test_invalid_as_of_dates(as_of):
+    with pytest.raises(ValueError) as error:
+        pr.parse_windows({'as_of': as_of})
+    assert str(error.value) == pr.INVALID_AS_OF_ERROR
+
+
+@pytest.mark.parametrize('params, engine', [({'as_of': '2024-01-01', 'half_life': 90}, 'form'), ({'as_of': '2024-01-01'}, 'poisson')])
+def test_as_of_only_with_the_form_engine(params, engine):
+    with pytest.raises(ValueError) as error:
+        pr.parse_windows(params, engine)
+    assert str(error.value) == pr.INVALID_AS_OF_ERROR
+
+
+@pytest.mark.parametrize('params', [{'num_games': 'five'}, {'num_games': 0}, {'h2h_games': pr.MAX_H2H_GAMES + 1}, {'half_life': 7.5}])
+def test_invalid_windows(params):
+    with pytest.raises(ValueError) as error:
+        pr.parse_windows(params)
+    assert str(error.value) == pr.INVALID_WINDOWS_ERROR
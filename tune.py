@@ -0,0 +1,234 @@
+import argparse
+import json
+
+import numpy as np
+
+import backtest as bt
+import extract as ex
+import predict as pr
+import registry
+import store
+
+# Stat types each weight table combines, in the order of the feature columns
+COMPONENTS = {
+    'base': ['home_away_form', 'overall_form', 'opposition_form', 'h2h', 'home_away_h2h'],
+    'draw': ['home_away_form', 'overall_form', 'h2h', 'home_away_h2h'],
+    'btts': ['home_away_form', 'overall_form', 'h2h', 'home_away_h2h'],
+    'team_stats': ['home_away_form', 'overall_form', 'h2h', 'home_away_h2h'],
+    'total_goals': ['home_away_form', 'overall_form', 'h2h', 'home_away_h2h'],
+}
+TEAM_STATS = ['goals', 'shots_on_target', 'corners', 'cards']
+TEAM_STAT_COLUMNS = {'goals': ('FTHG', 'FTAG'), 'shots_on_target': ('HST', 'AST'), 'corners': ('HC', 'AC'), 'cards': (None, None)}
+
+
+def _rate(results, value):
+    return results.count(value) / len(results) if results else 0.0
+
+
+def _mean(values):
+    return float(np.mean(values)) if len(values) else 0.0
+
+
+# Component rates of one match, as aggregate_team_specific_predictions sees them
+def match_features(home_team, away_team, prematch_stats):
+    home_stats, away_stats, home_home_stats, away_away_stats, h2h_stats, fixture_stats = prematch_stats
+    home_name = registry.slug(home_team)
+    away_name = registry.slug(away_team)
+    h2h, fixture = h2h_stats['results'], fixture_stats['results']
+
+    features = {
+        'home': [_rate(home_home_stats['results'], 'Win'), _rate(home_stats['results'], 'Win'),
+                 _rate(away_away_stats['results'], 'Lose'), _rate(h2h, f"{home_team} Win"), _rate(fixture, f"{home_team} Win")],
+        'away': [_rate(away_away_stats['results'], 'Win'), _rate(away_stats['results'], 'Win'),
+                 _rate(home_home_stats['results'], 'Lose'), _rate(h2h, f"{away_team} Win"), _rate(fixture, f"{away_team} Win")],
+        'draw': [(_rate(home_home_stats['results'], 'Draw') + _rate(away_away_stats['results'], 'Draw')) / 2,
+                 (_rate(home_stats['results'], 'Draw') + _rate(away_stats['results'], 'Draw')) / 2,
+                 _rate(h2h, 'Draw'), _rate(fixture, 'Draw')],
+        'btts': [(_mean(home_home_stats['btts']) + _mean(away_away_stats['btts'])) / 2,
+                 (_mean(home_stats['btts']) + _mean(away_stats['btts'])) / 2,
+                 _mean(h2h_stats['btts']), _mean(fixture_stats['btts'])],
+        'total_goals': [(_mean(home_home_stats['goals']) + _mean(away_away_stats['goals'])) / 2,
+                        (_mean(home_stats['goals']) + _mean(away_stats['goals'])) / 2,
+                        _mean(h2h_stats['goals']), _mean(fixture_stats['goals'])],
+    }
+    for stat in TEAM_STATS:
+        features[f'home_{stat}'] = [_mean(home_home_stats[f'{stat}_for']), _mean(home_stats[f'{stat}_for']),
+                                    _mean(h2h_stats[f'{home_name}_{stat}']), _mean(fixture_stats[f'{home_name}_{stat}'])]
+        features[f'away_{stat}'] = [_mean(away_away_stats[f'{stat}_for']), _mean(away_stats[f'{stat}_for']),
+                                    _mean(h2h_stats[f'{away_name}_{stat}']), _mean(fixture_stats[f'{away_name}_{stat}'])]
+    return features
+
+
+# Feature matrices of every predictable historical match of the given leagues
+def build_features(leagues=None, num_games=5, h2h_games=2):
+    """
+    :return: A dict of (matches x components) matrices keyed like `match_features`,
+             the availability `mask` of the H2H components, and the actual outcomes.
+    """
+    rows = {}
+    mask, outcome, btts, total_goals = [], [], [], []
+    actual = {f'{side}_{stat}': [] for side in ('home', 'away') for stat in TEAM_STATS}
+
+    for league in leagues or ex.leagues:
+        df = store.build_league_frame(store.league_files(league))
+        ftr = df['FTR'].tolist()
+        home_teams, away_teams = df['HomeTeam'].tolist(), df['AwayTeam'].tolist()
+        columns = {'FTHG': df['FTHG'].tolist(), 'FTAG': df['FTAG'].tolist(), 'HST': df['HST'].tolist(),
+                   'AST': df['AST'].tolist(), 'HC': df['HC'].tolist(), 'AC': df['AC'].tolist(),
+                   'HCards': (df['HY'] + df['HR']).tolist(), 'ACards': (df['AY'] + df['AR']).tolist()}
+
+        for position, prematch_stats in bt.walk_forward(df, num_games, h2h_games):
+            # Same matches the backtest can predict: every team window has games
+            if ftr[position] not in bt.OUTCOMES or not all(stats['results'] for stats in prematch_stats[:4]):
+                continue
+            for key, values in match_features(home_teams[position], away_teams[position], prematch_stats).items():
+                rows.setdefault(key, []).append(values)
+            # predict drops both H2H components when there is no H2H game at this venue
+            mask.append(bool(prematch_stats[5]['results']))
+            outcome.append(bt.OUTCOMES.index(ftr[position]))
+            btts.append(int(columns['FTHG'][position] > 0 and columns['FTAG'][position] > 0))
+            total_goals.append(columns['FTHG'][position] + columns['FTAG'][position])
+            for stat in TEAM_STATS:
+                home_column, away_column = TEAM_STAT_COLUMNS[stat]
+                actual[f'home_{stat}'].append(columns[home_column or 'HCards'][position])
+                actual[f'away_{stat}'].append(columns[away_column or 'ACards'][position])
+
+    features = {key: np.array(values, dtype=float) for key, values in rows.items()}
+    features['h2h_available'] = np.array(mask)
+    features['outcome'] = np.array(outcome, dtype=int)
+    features['btts_actual'] = np.array(btts, dtype=float)
+    features['total_goals_actual'] = np.array(total_goals, dtype=float)
+    for key, values in actual.items():
+        features[f'{key}_actual'] = np.array(values, dtype=float)
+    return features
+
+
+def _availability(h2h_available, num_components):
+    mask = np.ones((len(h2h_available), num_components))
+    mask[:, -2:] = h2h_available[:, None]
+    return mask
+
+
+# Weighted sums of the components for many candidate weight vectors at once
+def weighted(features, mask, candidates):
+    """
+    Same as the redistributed weighted sum in aggregate_team_specific_predictions:
+    the weights of the missing components are shared out over the available ones
+    in proportion to their size.
+
+    :param features: (matches x components) rates.
+    :param mask: (matches x components) 1 where the component is available.
+    :param candidates: (components x candidates) weights.
+    :return: (matches x candidates) predictions.
+    """
+    return (features * mask) @ candidates / (mask @ candidates) * candidates.sum(axis=0)
+
+
+def sample_candidates(group, num_candidates, rng):
+    """
+    :return: (components x candidates) weights, the current weights first,
+             then random weight vectors summing to 1.
+    """
+    current = np.array([[pr.WEIGHTS[group][name] for name in COMPONENTS[group]]]).T
+    sampled = rng.dirichlet(np.ones(len(COMPONENTS[group])), size=num_candidates - 1).T
+    return np.hstack([current, sampled])
+
+
+def _chunks(num_candidates, chunk_size):
+    for start in range(0, num_candidates, chunk_size):
+        yield slice(start, min(start + chunk_size, num_candidates))
+
+
+# Log loss of the 1X2 probabilities for every (base, draw) candidate pair
+def result_losses(features, base, draw, chunk_size=500, eps=1e-15):
+    n = len(features['outcome'])
+    base_mask = _availability(features['h2h_available'], base.shape[0])
+    draw_mask = _availability(features['h2h_available'], draw.shape[0])
+    losses = np.empty(base.shape[1])
+    for chunk in _chunks(base.shape[1], chunk_size):
+        home = weighted(features['home'], base_mask, base[:, chunk])
+        away = weighted(features['away'], base_mask, base[:, chunk])
+        draws = weighted(features['draw'], draw_mask, draw[:, chunk])
+        total = home + away + draws
+        probs = np.stack([home, draws, away])[features['outcome'], np.arange(n)] / np.where(total > 0, total, np.nan)
+        losses[chunk] = -np.mean(np.log(np.clip(np.nan_to_num(probs, nan=1 / 3), eps, 1)), axis=0)
+    return losses
+
+
+def btts_losses(features, candidates, chunk_size=500, eps=1e-15):
+    mask = _availability(features['h2h_available'], candidates.shape[0])
+    actual = features['btts_actual'][:, None]
+    losses = np.empty(candidates.shape[1])
+    for chunk in _chunks(candidates.shape[1], chunk_size):
+        probs = np.clip(weighted(features['btts'], mask, candidates[:, chunk]), eps, 1 - eps)
+        losses[chunk] = -np.mean(actual * np.log(probs) + (1 - actual) * np.log(1 - probs), axis=0)
+    return losses
+
+
+def squared_errors(features, key, candidates, chunk_size=500):
+    mask = _availability(features['h2h_available'], candidates.shape[0])
+    actual = features[f'{key}_actual'][:, None]
+    errors = np.empty(candidates.shape[1])
+    for chunk in _chunks(candidates.shape[1], chunk_size):
+        errors[chunk] = np.mean((weighted(features[key], mask, candidates[:, chunk]) - actual) ** 2, axis=0)
+    return errors
+
+
+# Squared errors of every team stat prediction, each scaled by the variance of the stat
+def team_stats_losses(features, candidates):
+    losses = np.zeros(candidates.shape[1])
+    for stat in TEAM_STATS:
+        for side in ('home', 'away'):
+            key = f'{side}_{stat}'
+            losses += squared_errors(features, key, candidates) / max(np.var(features[f'{key}_actual']), 1e-9)
+    return losses
+
+
+def _as_weights(group, column):
+    return {name: round(float(weight), 6) for name, weight in zip(COMPONENTS[group], column)}
+
+
+# Evaluate random weight candidates for every table and keep the best of each
+def tune(features, num_candidates=5000, seed=0):
+    """
+    :return: (weights, report) where weights is in the format of predict.DEFAULT_WEIGHTS
+             and report holds the loss of the current and of the best weights per table.
+    """
+    rng = np.random.default_rng(seed)
+    weights, report = {}, {}
+
+    base, draw = sample_candidates('base', num_candidates, rng), sample_candidates('draw', num_candidates, rng)
+    losses = result_losses(features, base, draw)
+    best = int(np.argmin(losses))
+    weights['base'], weights['draw'] = _as_weights('base', base[:, best]), _as_weights('draw', draw[:, best])
+    report['result_log_loss'] = {'current': float(losses[0]), 'best': float(losses[best])}
+
+    for group, evaluate, name in (('btts', lambda c: btts_losses(features, c), 'btts_log_loss'),
+                                  ('total_goals', lambda c: squared_errors(features, 'total_goals', c), 'total_goals_mse'),
+                                  ('team_stats', lambda c: team_stats_losses(features, c), 'team_stats_scaled_mse')):
+        candidates = sample_candidates(group, num_candidates, rng)
+        losses = evaluate(candidates)
+        best = int(np.argmin(losses))
+        weights[group] = _as_weights(group, candidates[:, best])
+        report[name] = {'current': float(losses[0]), 'best': float(losses[best])}
+
+    return weights, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search the weights of aggregate_team_specific_predictions on the historical matches.')
+    parser.add_argument('--league', action='append', dest='leagues', choices=ex.leagues, help='League to tune on, repeatable (default: all)')
+    parser.add_argument('--candidates', type=int, default=5000, help='Number of weight vectors to try per table')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=pr.WEIGHTS_FILE, help='Weights file loaded by predict at startup')
+    args = parser.parse_args()
+
+    features = build_features(args.leagues)
+    weights, report = tune(features, args.candidates, args.seed)
+    print(f"{len(features['outcome'])} matches")
+    for name, losses in report.items():
+        print(f"{name:<24} current {losses['current']:.4f} best {losses['best']:.4f}")
+
+    with open(args.output, 'w') as file:
+        json.dump(weights, file, indent=4)
+    print(f"Wrote {args.output}")